@@ -0,0 +1,156 @@
+"""Army list evaluation. The profile attributes every list is checked against
+are loaded once into flat arrays, so lists can be validated and scored in
+batches without touching the database."""
+
+from db_classes import db, Unit, Profile, UnitSectorial, catalogue_version
+from peewee import SqliteDatabase
+from collections import Counter, defaultdict
+from typing import NamedTuple
+from array import array
+
+
+# Points per available SWC, when a list doesn't set its own SWC limit
+POINTS_PER_SWC = 50
+
+# Most troopers an army list can have
+MAX_TROOPERS = 15
+
+
+class ArmyList(NamedTuple):
+    """An army list: the sectorial it is built for, its limits and the IDs of
+    the profiles it takes, repeated once per trooper."""
+
+    sectorial: int
+    points_limit: int
+    profile_ids: tuple
+    swc_limit: float = None
+
+
+class Violation(NamedTuple):
+    """A rule broken by an army list."""
+
+    rule: str
+    detail: str
+
+
+class ListReport(NamedTuple):
+    """Totals of an army list and every rule it breaks."""
+
+    points: int
+    swc: float
+    regular_orders: int
+    irregular_orders: int
+    impetuous_orders: int
+    violations: tuple
+
+    @property
+    def is_valid(self) -> bool:
+        """Checks if the list doesn't break any rule."""
+
+        return not self.violations
+
+
+class ProfileTable:
+    """Column arrays with the attributes of every profile, indexed by the row
+    of the profile, along with the availability of every unit and the units
+    of every sectorial. A table belongs to the catalogue version it was
+    loaded from."""
+
+    def __init__(self, database: SqliteDatabase = db):
+        self.database = database
+        self.load()
+
+    def load(self) -> None:
+        """Loads every profile, unit and sectorial in three queries."""
+
+        self.version = catalogue_version(self.database)
+        self.rows = {}
+        self.points, self.swc = array("i"), array("d")
+        self.units, self.orders = array("i"), array("i")
+
+        for profile_id, unit_id, points, swc, regular, irregular, impetuous \
+                in Profile.select(
+                    Profile.profile_id, Profile.unit_id, Profile.point_cost,
+                    Profile.cap, Profile.regular_orders,
+                    Profile.irregular_orders, Profile.impetuous_orders
+                ).order_by(Profile.profile_id).tuples():
+            self.rows[profile_id] = len(self.points)
+            self.points.append(points)
+            self.swc.append(swc)
+            self.units.append(unit_id)
+            # Orders are stored three per profile, in the same order as in
+            # ListReport
+            self.orders.extend((regular or 0, irregular or 0, impetuous or 0))
+
+        self.availability = dict(
+            Unit.select(Unit.unit_id, Unit.availability).tuples())
+        self.sectorial_units = defaultdict(set)
+        for unit_id, sectorial in UnitSectorial.select(
+                UnitSectorial.unit, UnitSectorial.sectorial).tuples():
+            self.sectorial_units[sectorial].add(unit_id)
+
+    def is_stale(self) -> bool:
+        """Checks if the catalogue changed since the table was loaded."""
+
+        return catalogue_version(self.database) != self.version
+
+    def evaluate(self, army_list: ArmyList) -> ListReport:
+        """Adds up the totals of a list and checks it against every rule."""
+
+        violations = []
+        rows = []
+        for profile_id in army_list.profile_ids:
+            row = self.rows.get(profile_id)
+            if row is None:
+                violations.append(Violation(
+                    "unknown_profile", f"Profile {profile_id} doesn't exist"))
+            else:
+                rows.append(row)
+
+        points = sum(self.points[row] for row in rows)
+        # Rounded, since SWC values are halves and summing them as floats
+        # could land just over a limit
+        swc = round(sum(self.swc[row] for row in rows), 2)
+        orders = [sum(self.orders[row * 3 + kind] for row in rows)
+                  for kind in range(3)]
+
+        if points > army_list.points_limit:
+            violations.append(Violation(
+                "points", f"{points} points over a limit of "
+                          f"{army_list.points_limit}"))
+
+        swc_limit = army_list.swc_limit
+        if swc_limit is None:
+            swc_limit = army_list.points_limit / POINTS_PER_SWC
+        if swc > swc_limit:
+            violations.append(Violation(
+                "swc", f"{swc:g} SWC over a limit of {swc_limit:g}"))
+
+        if len(rows) > MAX_TROOPERS:
+            violations.append(Violation(
+                "troopers", f"{len(rows)} troopers over a limit of "
+                            f"{MAX_TROOPERS}"))
+
+        if rows and not orders[0]:
+            violations.append(Violation(
+                "orders", "The list has no regular orders"))
+
+        sectorial_units = self.sectorial_units.get(army_list.sectorial, ())
+        for unit_id, count in sorted(Counter(
+                self.units[row] for row in rows).items()):
+            if unit_id not in sectorial_units:
+                violations.append(Violation(
+                    "sectorial", f"Unit {unit_id} isn't available in "
+                                 f"sectorial {army_list.sectorial}"))
+            if count > self.availability.get(unit_id, 0):
+                violations.append(Violation(
+                    "availability", f"Unit {unit_id} taken {count} times, "
+                                    f"over its availability of "
+                                    f"{self.availability.get(unit_id, 0)}"))
+
+        return ListReport(points, swc, *orders, tuple(violations))
+
+    def evaluate_many(self, army_lists) -> list:
+        """Evaluates a batch of lists, returning a report for each one."""
+
+        return [self.evaluate(army_list) for army_list in army_lists]
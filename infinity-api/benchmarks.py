@@ -0,0 +1,1795 @@
+"""Offline harnesses and benchmarks. Everything here runs against synthetic
+data and local stand-in servers, so no connection to the real army site is
+needed. Run with: python benchmarks.py <name> [<name>...]"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from tempfile import TemporaryDirectory
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+from time import perf_counter, sleep
+from os import chdir, getcwd
+from random import Random
+import json
+import sys
+
+
+LANGUAGES = ("ENG", "ESP", "FRA")
+
+
+class CheckFailed(AssertionError):
+    """Raised when a benchmark gets a wrong result, however fast."""
+
+
+def synthetic_corpus(factions: int = 4, sectorials_per_faction: int = 3,
+                     units_per_sectorial: int = 20, weapons: int = 300,
+                     languages: tuple = LANGUAGES, seed: int = 0) -> dict:
+    """Returns a dict of languages, each one with a dict of file names and
+    contents following the same structure as the army site payloads."""
+
+    rng = Random(seed)
+    sectorials = [faction * 100 + index for faction in range(1, factions + 1)
+                  for index in range(1, sectorials_per_faction + 2)] + [901]
+    corpus = {}
+
+    for lang in languages:
+        files = {
+            "JSON_MUNICION": [{"id": ammo, "nombre": f"{lang} ammo {ammo}"}
+                              for ammo in range(1, 21)],
+            "JSON_HABILIDADES": [{"id": ability,
+                                  "nombre": f"{lang} ability {ability}",
+                                  "equipo": str(ability % 2)}
+                                 for ability in range(1, 201)],
+            "JSON_HABS_WIKI_URLS": {str(ability): f"https://wiki/{lang}/{ability}"
+                                    for ability in range(1, 201, 3)},
+            "JSON_CARACTERISTICAS": [{"id": trait, "nombre": f"{lang} trait {trait}"}
+                                     for trait in range(1, 31)],
+            "JSON_SECTORIAL_NOMBRE": {"nombresSectorial": {
+                f"idSectorial_{sectorial}": f"{lang} sectorial {sectorial}"
+                for sectorial in sectorials}},
+            "JSON_ARMAS_WIKI_URLS": {str(weapon): f"https://wiki/{lang}/w{weapon}"
+                                     for weapon in range(1, weapons + 1, 5)}}
+        corpus[lang] = files
+
+    weapon_rng = Random(seed)
+    weapon_list = []
+    for weapon in range(1, weapons + 1):
+        properties = weapon_rng.sample(range(1, 41), weapon_rng.randint(0, 3))
+        melee = weapon_rng.random() < 0.2
+        weapon_list.append({
+            "id": str(weapon), "dano": str(weapon_rng.randint(10, 16)),
+            "CC": "1" if melee else "0",
+            "corta": "" if melee else f"{weapon_rng.choice([0, 3])}|8",
+            "media": "" if melee else "3|16", "larga": "" if melee else "-3|24",
+            "maxima": "" if melee else "-6|48",
+            "idMunicion": str(weapon_rng.randint(0, 20)),
+            "rafaga": str(weapon_rng.randint(1, 4)),
+            "parent": str(weapon_rng.randint(1, 9))
+            if weapon > 10 and weapon_rng.random() < 0.1 else "0",
+            "propiedades": "|".join(str(prop) for prop in properties),
+            "names": [f"property {prop}" for prop in properties]})
+
+    for lang in languages:
+        corpus[lang]["JSON_ARMAS"] = [
+            dict({key: value for key, value in weapon.items() if key != "names"},
+                 nombre_completo=f"{lang} weapon {weapon['id']}",
+                 lista_propiedades="|".join(f"{lang} {name}"
+                                            for name in weapon["names"]))
+            for weapon in weapon_list]
+
+    for lang in languages:
+        corpus[lang]["901"] = []
+
+    unit_pool = [1000 + unit for unit in range(
+        factions * sectorials_per_faction * units_per_sectorial)]
+    for sectorial in sectorials[:-1]:
+        units = rng.sample(unit_pool, units_per_sectorial)
+        for lang in languages:
+            corpus[lang][str(sectorial)] = []
+        for unit_id in sorted(units):
+            unit_rng = Random(unit_id)
+            attributes = {key: str(unit_rng.randint(low, high)) for key, low, high in (
+                ("MOV1", 2, 6), ("MOV2", 2, 4), ("CC", 10, 23), ("CD", 9, 15),
+                ("FIS", 10, 15), ("VOL", 12, 15), ("BLI", 0, 8), ("PB", 0, 9),
+                ("H", 1, 3), ("S", 1, 8), ("Disp", 1, 5), ("EST", 0, 1))}
+            options = []
+            for option in range(unit_rng.randint(1, 6)):
+                option_id = unit_id * 10 + option
+                options.append({
+                    "id": str(option_id), "idPerfil": str(unit_id),
+                    "CAP": unit_rng.choice(["0", "0.5", "1", "1.5", "-"]),
+                    "puntos": str(unit_rng.randint(8, 80)),
+                    "ordenes": unit_rng.choice(["1%0%0", "0%1%0", "1%0%1"]),
+                    "armas": "|".join(str(unit_rng.randint(1, weapons))
+                                      for _ in range(unit_rng.randint(1, 4))),
+                    "caracteristicas": "|".join(str(unit_rng.randint(1, 30))
+                                                for _ in range(2)),
+                    "extra": "|".join(str(unit_rng.randint(1, 200))
+                                      for _ in range(unit_rng.randint(0, 2)))})
+            characteristics = f"|{unit_rng.randint(1, 30)}|"
+            abilities = "|".join(str(unit_rng.randint(1, 200)) for _ in range(3))
+            for lang in languages:
+                corpus[lang][str(sectorial)].append({
+                    "IDArmy": str(unit_id),
+                    "perfiles": [{
+                        "id": str(unit_id), "nombre": f"{lang} unit {unit_id}",
+                        "atributos": attributes,
+                        "caracteristicas": characteristics,
+                        "equipo_habs": abilities,
+                        "opciones": [dict(option, nombre=f"{lang} option {option['id']}")
+                                     for option in options]}]})
+
+    return corpus
+
+
+def to_js_payloads(corpus: dict) -> dict:
+    """Turns a synthetic corpus into the JS files served by the army site,
+    keyed by the path they are served from."""
+
+    payloads = {}
+    for lang, files in corpus.items():
+        payloads[f"/idioma_{lang}.js"] = "\n".join(
+            f"var {name} = {json.dumps(content)};"
+            for name, content in files.items() if name.startswith("JSON_"))
+        for name, content in files.items():
+            if not name.startswith("JSON_"):
+                payloads[f"/json_dataUnidades_{name}_{lang}.js"] = \
+                    f"var JSON_DATA_UNIDADES = {json.dumps(content)};"
+    return payloads
+
+
+class LocalServer:
+    """A stand-in for the army site serving payloads from memory. It can add
+    latency to every response and fail the first requests to some paths."""
+
+    def __init__(self, payloads: dict, latency: float = 0.,
+                 flaky: dict = None, broken: tuple = (), etags: bool = False):
+        self.payloads = payloads
+        self.etags = etags
+        self.latency = latency
+        self.flaky = dict(flaky or {})
+        self.broken = set(broken)
+        self.hits = defaultdict(int)
+        self.connections = 0
+        self.lock = Lock()
+        harness = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with harness.lock:
+                    harness.connections += 1
+
+            def do_GET(self):
+                sleep(harness.latency)
+                with harness.lock:
+                    harness.hits[self.path] += 1
+                    failing = self.path in harness.broken or \
+                        harness.flaky.get(self.path, 0) >= harness.hits[self.path]
+                if self.path not in harness.payloads or failing:
+                    self.send_response(404 if not failing else 503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = harness.payloads[self.path].encode()
+                etag = f'"{hash(body)}"'
+                if harness.etags and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if harness.etags:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def write_corpus(corpus: dict, root: str = "JSON") -> None:
+    """Stores a synthetic corpus with the same layout fetch_json uses."""
+
+    from pathlib import Path
+
+    for lang, files in corpus.items():
+        Path(f"{root}/{lang}").mkdir(parents=True, exist_ok=True)
+        for name, content in files.items():
+            with open(f"{root}/{lang}/{name}.json", "w") as open_file:
+                json.dump(content, open_file, sort_keys=True,
+                          indent=4, separators=(',', ': '))
+
+
+def build_database(corpus: dict = None, workers: int = 1) -> float:
+    """Writes a corpus into the current directory and builds infinity.db from
+    it. Returns the seconds the build took."""
+
+    write_corpus(corpus or synthetic_corpus())
+
+    from db_operations import generate_db, populate_db
+    from db_classes import db
+
+    start = perf_counter()
+    quietly(generate_db, db, indexes=False)
+    quietly(populate_db, db, workers=workers)
+    return perf_counter() - start
+
+
+@contextmanager
+def workspace(corpus: dict = None, build: bool = False):
+    """Runs the body in a temporary directory holding the given corpus, and
+    infinity.db built from it (from the default corpus if none is given) if
+    build is True. Yields the seconds the build took, if any. The database
+    is closed and the previous directory restored on the way out."""
+
+    cwd = getcwd()
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+        try:
+            if build:
+                yield build_database(corpus)
+            else:
+                if corpus:
+                    write_corpus(corpus)
+                yield None
+        finally:
+            if "db_classes" in sys.modules:
+                sys.modules["db_classes"].db.close()
+            chdir(cwd)
+
+
+def check(passed: bool, what: str) -> bool:
+    """Fails the benchmark if a check didn't pass. Returns the result, so it
+    can be reported along with the timings."""
+
+    if not passed:
+        raise CheckFailed(f"{what}: failed")
+    return passed
+
+
+def quietly(function, *args, **kwargs):
+    """Runs a function with its progress output silenced."""
+
+    stdout, sys.stdout = sys.stdout, open("/dev/null", "w")
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def bench_fetch() -> None:
+    """Compares the serial fetch against the concurrent one, and checks that
+    transient errors are retried and permanent ones are reported."""
+
+    from fetcher import fetch_json, fetch_all, create_session
+
+    payloads = to_js_payloads(synthetic_corpus())
+
+    with workspace():
+        for name, fetch in (
+                ("serial", lambda url: [fetch_json(lang, create_session(), url)
+                                        for lang in LANGUAGES]),
+                ("concurrent", lambda url: fetch_all(LANGUAGES, base_url=url))):
+            with LocalServer(payloads, latency=0.02) as server:
+                start = perf_counter()
+                quietly(fetch, server.url)
+                elapsed = perf_counter() - start
+            print(f"{name:>10}: {len(payloads)} files in {elapsed:.2f}s "
+                  f"({len(payloads) / elapsed:.1f} files/s, "
+                  f"{server.connections} connections)")
+
+        flaky = {path: 2 for path in list(payloads)[::7]}
+        broken = (list(payloads)[-1],)
+        with LocalServer(payloads, flaky=flaky, broken=broken) as server:
+            failed = quietly(fetch_all, LANGUAGES, base_url=server.url).failed
+        retried = all(server.hits[path] == 3 for path in flaky
+                      if path not in broken)
+        print(f"   retries: {len(flaky)} flaky files recovered: "
+              f"{check(retried, 'flaky files retried')}, "
+              f"reported failures: {[url.split('/')[-1] for url in failed]}")
+        check([url[len(server.url):] for url in failed] == list(broken),
+              "broken file reported")
+
+
+def bench_http_cache() -> None:
+    """Refreshes an unchanged corpus and then one with a single modified
+    sectorial, checking that only that sectorial is written again."""
+
+    from fetcher import fetch_all
+
+    payloads = to_js_payloads(synthetic_corpus())
+    expected = {"unchanged": {}, "one change": {"ENG": ("101",)}}
+
+    with workspace(), LocalServer(payloads, latency=0.02, etags=True) as server:
+        for name in ("cold", "unchanged", "one change"):
+            if name == "one change":
+                path = "/json_dataUnidades_101_ENG.js"
+                payloads[path] = payloads[path].replace("unit", "Unit", 1)
+            start = perf_counter()
+            report = quietly(fetch_all, LANGUAGES, base_url=server.url)
+            elapsed = perf_counter() - start
+            written = sum(len(names) for names in report.changed.values())
+            print(f"{name:>10}: {elapsed:.2f}s, {written} files written, "
+                  f"changed: {report.changed if written < 5 else '...'}")
+            check(report.changed == expected.get(name, report.changed),
+                  f"{name} files written")
+
+
+def legacy_generate_dict(object_string: str) -> dict:
+    """The replace and regex based parser that js_parser replaced."""
+
+    from re import findall
+
+    object_string = object_string.replace(r"\'", r"\"")
+    invalid_chars = ["'", "+", "\n", "\r", "//"]
+    for char in invalid_chars:
+        object_string = object_string.replace(char, "")
+
+    parsed_string = findall(r"(JSON_\w+)\s?=\s?(.*?[]}]);", object_string)
+
+    return {item[0]: json.loads(item[1]) for item in parsed_string}
+
+
+def measure(function, *args) -> tuple:
+    """Returns the result, the elapsed seconds and the peak traced memory of
+    a function call."""
+
+    import tracemalloc
+
+    tracemalloc.start()
+    start = perf_counter()
+    result = function(*args)
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_js_parser() -> None:
+    """Compares js_parser against the legacy parser on large synthetic language
+    payloads, both as plain literals and as quoted string concatenations."""
+
+    from fetcher import generate_dict
+
+    for weapons in (2000, 20000):
+        files = synthetic_corpus(weapons=weapons, languages=("ENG",))["ENG"]
+        literal = "\n".join(f"var {name} = {json.dumps(content)};"
+                            for name, content in files.items()
+                            if name.startswith("JSON_"))
+        quoted = "\n".join(
+            f"var {name} = " + " +\n".join(
+                "'" + chunk + "'" for chunk in (
+                    lambda text: [text[i:i + 200]
+                                  for i in range(0, len(text), 200)])(
+                    json.dumps(content).replace("\\", "\\\\")
+                    .replace("'", "\\'"))) + ";"
+            for name, content in files.items() if name.startswith("JSON_"))
+
+        for form, payload in (("literal", literal), ("quoted", quoted)):
+            for name, parser in (("legacy", legacy_generate_dict),
+                                 ("js_parser", generate_dict)):
+                try:
+                    result, elapsed, peak = measure(parser, payload)
+                except ValueError as error:
+                    print(f"{len(payload) / 2 ** 20:5.1f}MB {form:>7} {name:>9}: "
+                          f"failed ({str(error)[:40]})")
+                    continue
+                exact = result == {name: content for name, content in files.items()
+                                   if name.startswith("JSON_")}
+                print(f"{len(payload) / 2 ** 20:5.1f}MB {form:>7} {name:>9}: "
+                      f"{elapsed * 1000:7.1f}ms, peak {peak / 2 ** 20:6.1f}MB"
+                      f"{'' if exact else ', corrupted output'}")
+                check(exact or parser is legacy_generate_dict,
+                      f"js_parser output of the {form} payload")
+
+    payload = "var JSON_X = '[{\"nombre\": \"Mk12 d\\'Arc + 1 // http://x\"}]';"
+    for name, parser in (("legacy", legacy_generate_dict),
+                         ("js_parser", generate_dict)):
+        try:
+            print(f"{name:>9}: {parser(payload)}")
+        except ValueError as error:
+            print(f"{name:>9}: failed ({error})")
+    check(generate_dict(payload) == {
+        "JSON_X": [{"nombre": "Mk12 d'Arc + 1 // http://x"}]},
+        "js_parser output of escaped quotes")
+
+    payload = ("if (JSON_X == null) {}\nvar fooJSON_Y = 1;\n"
+               "var JSON_Z = window.JSON_Z || {};\nvar JSON_W = [1];")
+    print(f"js_parser: {generate_dict(payload)}")
+    check(generate_dict(payload) == {"JSON_W": [1]},
+          "js_parser skipping comparisons and non literal values")
+
+
+def bench_bulk_insert() -> None:
+    """Compares inserting rows one get_or_create at a time against the chunked
+    bulk_insert path, and times a full build of a synthetic corpus."""
+
+    from db_operations import generate_db, bulk_insert
+    from db_classes import db, String, UnitAbility
+
+    strings = [{"string_id": f"unit_{index}"} for index in range(5000)]
+    links = [{"unit": index % 2000, "ability": index % 97}
+             for index in range(5000)]
+
+    with workspace():
+        for name in ("get_or_create", "bulk_insert"):
+            db.close()
+            for model in (String, UnitAbility):
+                db.drop_tables([model], safe=True)
+            quietly(generate_db, db)
+            db.connect()
+            start = perf_counter()
+            for model, rows in ((String, strings), (UnitAbility, links)):
+                if name == "bulk_insert":
+                    bulk_insert(model, rows)
+                else:
+                    for row in rows:
+                        model.get_or_create(**row)
+            elapsed = perf_counter() - start
+            print(f"{name:>14}: {len(strings) + len(links)} rows in "
+                  f"{elapsed:.2f}s ({(len(strings) + len(links)) / elapsed:.0f} rows/s)")
+            check(String.select().count() == len(strings) and
+                  UnitAbility.select().count() == len({
+                      (link["unit"], link["ability"]) for link in links}),
+                  f"{name} rows")
+
+    with workspace(build=True) as elapsed:
+        print(f"    full build: {elapsed:.2f}s")
+
+
+def bench_corpus() -> None:
+    """Counts how many times a full build opens each corpus file."""
+
+    import builtins
+    from collections import Counter
+
+    opened = Counter()
+    original_open = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        if str(file).startswith("JSON/") and \
+                "w" not in (args[0] if args else kwargs.get("mode", "r")):
+            opened[file] += 1
+        return original_open(file, *args, **kwargs)
+
+    with workspace(synthetic_corpus()):
+        builtins.open = counting_open
+        try:
+            elapsed = build_database()
+        finally:
+            builtins.open = original_open
+
+    print(f"build: {elapsed:.2f}s, {sum(opened.values())} reads of "
+          f"{len(opened)} files, most read: {max(opened.values())} time(s)")
+    check(max(opened.values()) == 1, "every file read once")
+
+
+def bench_key_map() -> None:
+    """Times a full build, and checks that a corpus with dangling references
+    fails with all of them listed."""
+
+    from key_map import DanglingReferenceError
+
+    for broken in (False, True):
+        corpus = synthetic_corpus(units_per_sectorial=60)
+        if broken:
+            for lang in LANGUAGES:
+                option = corpus[lang]["101"][0]["perfiles"][0]["opciones"][0]
+                option["armas"] += "|99999"
+                corpus[lang]["JSON_ARMAS"][20]["parent"] = "88888"
+        try:
+            with workspace(corpus, build=True) as elapsed:
+                print(f"build: {elapsed:.2f}s")
+            check(not broken, "dangling references rejected")
+        except DanglingReferenceError as error:
+            print(f"build failed: {error}")
+            check(broken, "build of a sound corpus")
+
+
+def table_contents(database: str = "infinity.db") -> dict:
+    """Returns the sorted rows of every table, leaving out link table IDs."""
+
+    import sqlite3
+
+    connection = sqlite3.connect(database)
+    contents = {}
+    tables = connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+        "AND name NOT LIKE 'sqlite%'").fetchall()
+    # The internal tables of full-text indexes depend on the insertion order,
+    # so only the contents of the indexes themselves are compared
+    virtual = [name for name, sql in tables if sql.startswith("CREATE VIRTUAL")]
+    for table, _ in tables:
+        if any(table.startswith(f"{name}_") for name in virtual):
+            continue
+        columns = [column[1] for column in connection.execute(
+            f"PRAGMA table_info({table})") if column[1] != "id"]
+        contents[table] = sorted(connection.execute(
+            f"SELECT {', '.join(columns)} FROM {table}"), key=repr)
+    connection.close()
+    return contents
+
+
+def modified_corpus(corpus: dict) -> tuple:
+    """Applies a small release to a synthetic corpus: a changed unit stat, a
+    renamed weapon, a new weapon given to a profile and a removed unit.
+    Returns the changed files per language, like a FetchReport would."""
+
+    for lang in LANGUAGES:
+        files = corpus[lang]
+        files["101"][0]["perfiles"][0]["atributos"]["BLI"] = "9"
+        files["JSON_ARMAS"][3]["nombre_completo"] += " Mk2"
+        new_weapon = dict(files["JSON_ARMAS"][4], id="9001",
+                          nombre_completo=f"{lang} weapon 9001")
+        files["JSON_ARMAS"].append(new_weapon)
+        files["102"][0]["perfiles"][0]["opciones"][0]["armas"] += "|9001"
+        del files["103"][-1]
+    return {lang: ("JSON_ARMAS", "101", "102", "103") for lang in LANGUAGES}
+
+
+def bench_sync() -> None:
+    """Syncs a database with a small release and compares the result and the
+    time taken against a full rebuild."""
+
+    from shutil import rmtree
+    from db_classes import db
+
+    from os import remove
+    from sync import sync_db
+
+    corpus = synthetic_corpus(units_per_sectorial=200, weapons=3000)
+    with workspace(corpus, build=True):
+        start = perf_counter()
+        unchanged = sync_db(db, changed={})
+        print(f"  no changes: {(perf_counter() - start) * 1000:.0f}ms, {unchanged}")
+        check(unchanged == {}, "nothing synced without changes")
+
+        changed = modified_corpus(corpus)
+        rmtree("JSON")
+        write_corpus(corpus)
+        start = perf_counter()
+        changeset = sync_db(db, changed=changed)
+        print(f"small change: {(perf_counter() - start) * 1000:.0f}ms")
+        for table, changes in sorted(changeset.items()):
+            print(f"{table:>20}: {changes}")
+        synced = table_contents()
+
+        # A weapon removed from JSON_ARMAS alone is still carried by profiles
+        from copy import deepcopy
+        from db_classes import ProfileWeapon
+        from key_map import DanglingReferenceError
+
+        carried = str(ProfileWeapon.select(ProfileWeapon.weapon).scalar())
+        broken = deepcopy(corpus)
+        for lang in LANGUAGES:
+            broken[lang]["JSON_ARMAS"] = [
+                weapon for weapon in broken[lang]["JSON_ARMAS"]
+                if weapon["id"] != carried]
+        rmtree("JSON")
+        write_corpus(broken)
+        try:
+            sync_db(db, changed={lang: ("JSON_ARMAS",) for lang in LANGUAGES})
+            rejected = False
+        except DanglingReferenceError as error:
+            rejected = str(error).splitlines()[1]
+        print(f"weapon {carried} removed alone: {rejected}, rolled back: "
+              f"{check(rejected and table_contents() == synced, 'rollback')}")
+
+        rmtree("JSON")
+        db.close()
+        remove("infinity.db")
+        print(f"full rebuild: {build_database(corpus) * 1000:.0f}ms, same "
+              f"contents: {check(table_contents() == synced, 'synced contents')}")
+
+
+def bench_parallel_build() -> None:
+    """Builds the same corpus with a growing number of worker processes,
+    timing the sectorial normalization and the whole build, and checks that
+    every build writes exactly the same rows in the same order."""
+
+    import sqlite3
+    from os import cpu_count, remove
+    from corpus import Corpus
+    from db_classes import db
+
+    from db_operations import generate_db, populate_db
+
+    with workspace(synthetic_corpus(factions=8, units_per_sectorial=300,
+                                    weapons=3000)):
+        reference = None
+        for workers in sorted({1, 2, 4, cpu_count() or 1}):
+            local = Corpus()
+            start = perf_counter()
+            if workers > 1:
+                local.parse_sectorials(workers)
+            else:
+                local.sectorial_rows
+            parsing = perf_counter() - start
+
+            db.close()
+            if reference:
+                remove("infinity.db")
+            start = perf_counter()
+            quietly(generate_db, db)
+            quietly(populate_db, db, Corpus(), workers=workers)
+            elapsed = perf_counter() - start
+
+            connection = sqlite3.connect("infinity.db")
+            dump = list(connection.iterdump())
+            connection.close()
+            reference = reference or dump
+            print(f"{workers:>2} worker(s): normalization {parsing:.2f}s, "
+                  f"build {elapsed:.2f}s, identical: "
+                  f"{check(dump == reference, f'build with {workers} workers')}")
+
+
+def bench_query_plans() -> None:
+    """Builds a database and checks with EXPLAIN QUERY PLAN that the main
+    lookups search an index instead of scanning a table, using the serving
+    pragmas the API reads with."""
+
+    from db_classes import db, use_pragmas, SERVING_PRAGMAS, \
+        Profile, ProfileWeapon, WeaponProperty, ProfileCharacteristic, \
+        ProfileAbility, UnitProfile, UnitCharacteristic, UnitAbility, \
+        WeaponAncestry, WeaponInheritedProperty
+
+    lookups = {"profiles of a unit": Profile.select().where(Profile.unit_id == 1),
+               "ancestors of a weapon": WeaponAncestry
+               .select(WeaponAncestry.ancestor)
+               .where(WeaponAncestry.weapon == 1)
+               .order_by(WeaponAncestry.depth),
+               "descendants of a weapon": WeaponAncestry
+               .select(WeaponAncestry.weapon)
+               .where(WeaponAncestry.ancestor == 1)}
+    for model in (ProfileWeapon, WeaponProperty, ProfileCharacteristic,
+                  ProfileAbility, UnitProfile, UnitCharacteristic, UnitAbility,
+                  WeaponInheritedProperty):
+        first, second = [field for field in model._meta.sorted_fields
+                         if field.name != "id"]
+        for field, other in ((first, second), (second, first)):
+            lookups[f"{model.__name__}.{other.name} by {field.name}"] = \
+                model.select(other).where(field == 1)
+
+    scans = []
+    with workspace(build=True) as elapsed:
+        print(f"build: {elapsed * 1000:.0f}ms")
+        use_pragmas(db, SERVING_PRAGMAS)
+        try:
+            with db.connection_context():
+                for name, query in lookups.items():
+                    sql, params = query.sql()
+                    plan = " / ".join(row[-1] for row in db.execute_sql(
+                        f"EXPLAIN QUERY PLAN {sql}", params))
+                    verdict = "ok  " if "INDEX" in plan and "SCAN" not in plan \
+                        else "SCAN"
+                    if verdict == "SCAN":
+                        scans.append(name)
+                    print(f"{verdict} {name:>45}: {plan}")
+                try:
+                    Profile.delete().execute()
+                    print("query_only: writes were accepted")
+                    rejected = False
+                except Exception as error:
+                    print(f"query_only: writes rejected ({error})")
+                    rejected = True
+        finally:
+            use_pragmas(db, {})
+    check(not scans, f"indexed lookups, scanned: {scans}")
+    check(rejected, "writes rejected by the serving pragmas")
+
+
+def lazy_unit(unit_id: int) -> dict:
+    """Hydrates a unit the way the models allow out of the box, following
+    every foreign key lazily. Used as the reference for bench_queries."""
+
+    from db_classes import Unit, Profile, String, ProfileWeapon, \
+        WeaponProperty, UnitAbility, UnitCharacteristic
+
+    def name(string_id: str) -> dict:
+        return {translation.language: translation.text for translation in
+                String.get_by_id(string_id).translations}
+
+    unit = Unit.get_by_id(unit_id)
+    return {
+        "id": unit.unit_id, "name": name(unit.name),
+        "characteristics": [name(link.characteristic.name_id) for link in
+                            UnitCharacteristic.select().where(
+                                UnitCharacteristic.unit == unit_id)],
+        "abilities": [name(link.ability.name_id) for link in
+                      UnitAbility.select().where(UnitAbility.unit == unit_id)],
+        "profiles": [{
+            "id": profile.profile_id, "name": name(profile.name_id),
+            "weapons": [{
+                "id": link.weapon.weapon_id, "name": name(link.weapon.name_id),
+                "ammo": link.weapon.ammo and name(link.weapon.ammo.name_id),
+                "properties": [name(prop.weapon_property.name_id) for prop in
+                               WeaponProperty.select().where(
+                                   WeaponProperty.weapon == link.weapon_id)]}
+                for link in ProfileWeapon.select().where(
+                    ProfileWeapon.profile == profile.profile_id)]}
+            for profile in Profile.select().where(Profile.unit_id == unit_id)]}
+
+
+def bench_queries() -> None:
+    """Counts the queries and the time taken to hydrate batches of units with
+    the read API, compared with following the foreign keys lazily."""
+
+    from db_classes import db, Unit
+    from queries import get_units
+
+    with workspace(synthetic_corpus(units_per_sectorial=100), build=True):
+        statements, counts = [], set()
+        with db.connection_context():
+            db.connection().set_trace_callback(statements.append)
+            unit_ids = [unit_id for unit_id, in
+                        Unit.select(Unit.unit_id).tuples()]
+
+            for label, function in (("lazy FKs", lazy_unit),
+                                    ("queries", None)):
+                for batch in (1, 10, 100, len(unit_ids)):
+                    if function and batch > 10:
+                        continue
+                    statements.clear()
+                    start = perf_counter()
+                    if function:
+                        units = [function(unit_id)
+                                 for unit_id in unit_ids[:batch]]
+                    else:
+                        units = get_units(unit_ids[:batch])
+                        counts.add(len(statements))
+                    elapsed = perf_counter() - start
+                    print(f"{label:>8}: {len(units):>4} unit(s), "
+                          f"{len(statements):>5} queries, "
+                          f"{elapsed * 1000:.1f}ms")
+                    check(len(units) == batch, f"{label} units found")
+            db.connection().set_trace_callback(None)
+        check(len(counts) == 1, "queries independent of the batch size")
+
+
+def bench_catalogue_cache() -> None:
+    """Times repeated unit lookups from several threads with and without the
+    catalogue cache, and checks that a sync invalidates the cached units and
+    that every language is cached apart."""
+
+    from concurrent.futures import ThreadPoolExecutor
+    from shutil import rmtree
+    from db_classes import db, Unit
+    from catalogue_cache import CatalogueCache
+    from queries import get_unit
+
+    corpus = synthetic_corpus(units_per_sectorial=100)
+    with workspace(corpus, build=True):
+        unit_ids = [unit_id for unit_id, in
+                    Unit.select(Unit.unit_id).tuples()]
+        cache = CatalogueCache(max_size=len(unit_ids) // 2)
+        rng = Random(0)
+        requests = [rng.choice(unit_ids[:len(unit_ids) // 4])
+                    for _ in range(4000)]
+
+        for label, lookup in (("uncached", get_unit),
+                              ("cached", cache.unit)):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                start = perf_counter()
+                list(pool.map(lookup, requests))
+                elapsed = perf_counter() - start
+            print(f"{label:>8}: {elapsed / len(requests) * 1000:.3f}ms "
+                  f"per lookup over {len(requests)} lookups, 8 threads")
+
+        start = perf_counter()
+        for unit_id in requests:
+            cache.unit(unit_id)
+        print(f"  repeat: {(perf_counter() - start) / len(requests) * 1000:.3f}"
+              f"ms per lookup from a single thread")
+        print(f"   stats: {cache.stats()}")
+
+        list(map(cache.unit, unit_ids))
+        print(f"after a full scan: {cache.stats()}")
+
+        from sync import sync_db
+        changed = modified_corpus(corpus)
+        rmtree("JSON")
+        write_corpus(corpus)
+        sync_db(db, changed=changed)
+        unit_id = int(corpus["ENG"]["101"][0]["perfiles"][0]["id"])
+        fresh = cache.unit(unit_id) == get_unit(unit_id)
+        print(f"after a sync: {cache.stats()}, fresh unit: "
+              f"{check(fresh, 'unit refreshed after a sync')}")
+
+        localized = [cache.unit(unit_id, language) for language in
+                     ("esp", "ESP", "FRA")] + [cache.unit(unit_id)]
+        print("languages cached apart: " + str(check(
+            localized[0] is localized[1] and
+            localized[0] == get_unit(unit_id, language="ESP") and
+            localized[2] == get_unit(unit_id, language="FRA") and
+            localized[3] == get_unit(unit_id),
+            "units cached per language")))
+
+
+def bench_localization() -> None:
+    """Builds a corpus with a fourth, partially translated language and times
+    resolving the names of every weapon in it, following each name foreign
+    key, in a single join, and from the denormalized name table."""
+
+    from db_classes import Weapon, Translation
+    from localization import entity_names
+
+    corpus = synthetic_corpus(languages=LANGUAGES + ("ITA",))
+    corpus["ITA"]["JSON_ARMAS"] = corpus["ITA"]["JSON_ARMAS"][::2]
+    with workspace(corpus, build=True):
+        weapon_ids = [weapon_id for weapon_id, in
+                      Weapon.select(Weapon.weapon_id).tuples()]
+
+        start = perf_counter()
+        lazy = {weapon.weapon_id: Translation.get_by_id(
+            (weapon.name_id, "ENG")).text for weapon in Weapon.select()}
+        print(f"      lazy: {(perf_counter() - start) * 1000:.1f}ms "
+              f"(English only)")
+
+        for materialized in (False, True):
+            start = perf_counter()
+            names = entity_names(Weapon, weapon_ids, "ITA",
+                                 materialized=materialized)
+            elapsed = perf_counter() - start
+            translated = sum(name.startswith("ITA") for name in names.values())
+            print(f"{'table' if materialized else 'join':>10}: "
+                  f"{elapsed * 1000:.1f}ms, {len(names)} names, "
+                  f"{translated} in Italian, "
+                  f"{len(names) - translated} from the fallback")
+        fallback = [key for key, name in names.items()
+                    if not name.startswith("ITA")]
+        same = all(names[key] == lazy[key] for key in fallback)
+        print(f"fallback names are the English ones: "
+              f"{check(same, 'fallback names')}")
+
+
+def pseudo_name(rng: Random) -> str:
+    """Returns a made up name of one to three words, like the ones of real
+    units and weapons."""
+
+    syllables = ("ka", "ro", "mi", "tar", "sen", "vo", "li", "dra", "gu", "ne",
+                 "bis", "to", "fen", "ar", "qui", "mor", "zel", "pha", "nu", "ix")
+    return " ".join(
+        "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).title()
+        for _ in range(rng.randint(1, 3)))
+
+
+def bench_search() -> None:
+    """Times typeahead searches over a large catalogue with made up names,
+    typing them one character at a time with and without typos, against a
+    latency target, and times an incremental refresh of the index."""
+
+    from statistics import quantiles
+    from db_classes import db
+    from search import search, refresh_search_index
+
+    target_ms = 10
+    with workspace(synthetic_corpus(factions=8, units_per_sectorial=300,
+                                    weapons=3000), build=True) as elapsed:
+        print(f"build: {elapsed:.2f}s")
+
+        rng = Random(0)
+        string_ids = [string_id for string_id, in db.execute_sql(
+            "SELECT DISTINCT string_id FROM translation")]
+        with db.atomic():
+            for string_id in string_ids:
+                db.execute_sql("UPDATE translation SET text = ? || ' ' || "
+                               "language WHERE string_id = ?",
+                               (pseudo_name(rng), string_id))
+            start = perf_counter()
+            rewritten = refresh_search_index(db)
+        print(f"renamed every string, refresh: {rewritten} rows rewritten "
+              f"in {perf_counter() - start:.2f}s")
+
+        names = [name for name, in db.execute_sql(
+            "SELECT name FROM search_index ORDER BY random() LIMIT 100")]
+        for label, typo in (("prefix", False), ("typo", True)):
+            timings = []
+            for name in names:
+                if typo:
+                    position = rng.randrange(1, len(name) - 1)
+                    name = name[:position] + name[position + 1:]
+                for length in range(2, len(name) + 1):
+                    start = perf_counter()
+                    search(name[:length], limit=10)
+                    timings.append((perf_counter() - start) * 1000)
+            p50, p95 = (quantiles(timings, n=20)[index] for index in (9, 18))
+            print(f"{label:>7}: {len(timings)} keystrokes, p50 {p50:.2f}ms, "
+                  f"p95 {p95:.2f}ms, target {target_ms}ms met: "
+                  f"{check(p95 <= target_ms, f'{label} p95 target')}")
+
+        with db.atomic():
+            db.execute_sql("UPDATE translation SET text = 'Zyx Mk2' "
+                           "WHERE string_id = 'weapon_7'")
+            start = perf_counter()
+            rewritten = refresh_search_index(db, items={"weapon": [7]})
+        elapsed = perf_counter() - start
+        found = bool(search("zyx", fuzzy=False))
+        print(f"renamed a weapon, refresh of its rows: {rewritten} rows "
+              f"rewritten in {elapsed * 1000:.0f}ms, found: "
+              f"{check(found, 'renamed weapon found')}")
+        left = refresh_search_index(db)
+        print(f"full refresh afterwards: {left} rows rewritten: "
+              f"{check(not left, 'nothing left for a full refresh')}")
+
+
+def synthetic_lists(count: int, seed: int = 0) -> list:
+    """Returns army lists built from the profiles of the current database,
+    most of them valid and the rest breaking a random rule."""
+
+    from db_classes import Profile, UnitSectorial
+    from army_lists import ArmyList
+
+    profiles_by_sectorial = defaultdict(list)
+    for sectorial, profile_id in (UnitSectorial
+                                  .select(UnitSectorial.sectorial,
+                                          Profile.profile_id)
+                                  .join(Profile, on=(UnitSectorial.unit ==
+                                                     Profile.unit_id))
+                                  .tuples()):
+        profiles_by_sectorial[sectorial].append(profile_id)
+
+    rng = Random(seed)
+    sectorials = sorted(profiles_by_sectorial)
+    lists = []
+    for _ in range(count):
+        sectorial = rng.choice(sectorials)
+        profile_ids = rng.sample(profiles_by_sectorial[sectorial],
+                                 rng.randint(6, 12))
+        if rng.random() < 0.1:
+            profile_ids.append(rng.choice(
+                profiles_by_sectorial[rng.choice(sectorials)]))
+        if rng.random() < 0.05:
+            profile_ids.append(-1)
+        lists.append(ArmyList(sectorial, rng.choice((150, 300, 400)) * 4,
+                              tuple(profile_ids)))
+    return lists
+
+
+def bench_army_lists() -> None:
+    """Times validating synthetic army lists with the preloaded profile table,
+    compared with reading every profile of every list from the database."""
+
+    from db_classes import Profile, Unit, UnitSectorial
+    from army_lists import ProfileTable
+
+    def query_per_list(army_list) -> bool:
+        profiles = list(Profile.select().where(
+            Profile.profile_id.in_(army_list.profile_ids)))
+        units = {unit.unit_id: unit for unit in Unit.select().where(
+            Unit.unit_id.in_([profile.unit_id for profile in profiles]))}
+        members = {unit_id for unit_id, in UnitSectorial.select(
+            UnitSectorial.unit).where(
+            UnitSectorial.sectorial == army_list.sectorial).tuples()}
+        return sum(profile.point_cost for profile in profiles) <= \
+            army_list.points_limit and len(units) and \
+            all(unit_id in members for unit_id in units)
+
+    with workspace(synthetic_corpus(units_per_sectorial=100), build=True):
+        lists = synthetic_lists(20000)
+
+        start = perf_counter()
+        table = ProfileTable()
+        print(f"table load: {(perf_counter() - start) * 1000:.0f}ms, "
+              f"{len(table.rows)} profiles")
+
+        start = perf_counter()
+        reports = table.evaluate_many(lists)
+        elapsed = perf_counter() - start
+        rules = Counter(violation.rule for report in reports
+                        for violation in report.violations)
+        print(f"     table: {len(lists) / elapsed:,.0f} lists/s, "
+              f"{sum(report.is_valid for report in reports)} valid, "
+              f"violations: {dict(sorted(rules.items()))}")
+
+        start = perf_counter()
+        for army_list in lists[:500]:
+            query_per_list(army_list)
+        elapsed = perf_counter() - start
+        print(f"  database: {500 / elapsed:,.0f} lists/s")
+
+
+def pair_odds(active_sv: int, active_burst: int, reactive_sv: int,
+              reactive_burst: int, damage: int, armor: int) -> tuple:
+    """Computes the win chance and expected wounds of a single face to face
+    roll in plain Python, going through every die face of both sides."""
+
+    from math import comb
+
+    def die(sv: int) -> list:
+        scores = [0.0] * 22
+        for face in range(1, 21):
+            if sv > 20:
+                score = 21 if face + sv - 20 >= 20 else face + sv - 20
+            else:
+                score = face if face < sv else 21 if face == sv else 0
+            scores[score] += 1 / 20
+        return scores
+
+    def highest(sv: int, burst: int) -> list:
+        cumulative, total = [], 0.0
+        for probability in die(sv):
+            total += probability
+            cumulative.append(total ** burst)
+        return [cumulative[0]] + [cumulative[score] - cumulative[score - 1]
+                                  for score in range(1, 22)]
+
+    active, reactive = die(active_sv), highest(reactive_sv, reactive_burst)
+    failed_save = min(max(damage - armor, 0), 20) / 20
+    wins = wounds = 0.0
+    for other, chance in enumerate(reactive):
+        beats = sum(active[other + 1:])
+        criticals = active[21] if other < 21 else 0.0
+        for hits in range(1, active_burst + 1):
+            wins += chance * comb(active_burst, hits) * beats ** hits * \
+                (1 - beats) ** (active_burst - hits)
+        normal = beats - criticals
+        wounds += chance * active_burst * (normal * failed_save + criticals)
+    return wins, wounds
+
+
+def bench_probability() -> None:
+    """Computes every attacker, weapon, range band and defender matchup of a
+    synthetic catalogue with the vectorized engine, and compares a sample of
+    them, and their speed, with a plain per pair loop."""
+
+    import numpy as np
+    from probability import load_units, load_weapons, matchups, \
+        outcome_tables, BANDS
+
+    with workspace(synthetic_corpus(units_per_sectorial=40), build=True):
+        unit_ids, units = load_units()
+        weapon_ids, weapons = load_weapons()
+        defender_ids = unit_ids[:20]
+        defenders = {key: values[:20] for key, values in units.items()}
+
+        start = perf_counter()
+        outcome_tables()
+        print(f"outcome tables: {(perf_counter() - start) * 1000:.0f}ms")
+
+        start = perf_counter()
+        result = matchups(units, weapons, defenders)
+        elapsed = perf_counter() - start
+        count = np.count_nonzero(~np.isnan(result.expected_wounds))
+        print(f"    vectorized: {count:,} matchups in {elapsed * 1000:.0f}ms "
+              f"({count / elapsed:,.0f}/s)")
+
+        rng = Random(0)
+        sample = []
+        while len(sample) < 2000:
+            indices = (rng.randrange(len(unit_ids)), rng.randrange(len(weapon_ids)),
+                       rng.randrange(len(BANDS)), rng.randrange(len(defender_ids)))
+            if not np.isnan(result.expected_wounds[indices]):
+                sample.append(indices)
+
+        start = perf_counter()
+        worst = 0.0
+        for attacker, weapon, band, defender in sample:
+            melee = weapons["is_melee"][weapon]
+            skill = units["close_combat" if melee else "ballistic_skill"][attacker]
+            damage = weapons["damage"][weapon] + \
+                (units["phisique"][attacker] if weapons["adds_ph"][weapon] else 0)
+            wins, wounds = pair_odds(
+                int(skill + weapons["modifiers"][weapon, band]),
+                int(weapons["burst"][weapon]),
+                int(defenders["phisique"][defender]), 1,
+                int(damage), int(defenders["armor"][defender]))
+            index = (attacker, weapon, band, defender)
+            worst = max(worst, abs(wins - result.active_wins[index]),
+                        abs(wounds - result.expected_wounds[index]))
+        elapsed = perf_counter() - start
+        print(f"per pair loop: {len(sample) / elapsed:,.0f}/s, "
+              f"largest difference on {len(sample)} matchups: {worst:.2e}")
+        check(worst < 1e-9, "vectorized odds")
+
+
+def bench_ranges() -> None:
+    """Times range modifier lookups of random (weapon, distance) pairs with
+    the precomputed range table, compared with parsing the stored range
+    strings of each pair, and checks both agree."""
+
+    import numpy as np
+    from db_classes import Weapon
+    from weapon_ranges import RangeTable
+
+    def parsed_modifier(weapon: Weapon, distance: float):
+        for weapon_range in (weapon.short_range, weapon.medium_range,
+                             weapon.long_range, weapon.maximum_range):
+            if weapon_range:
+                modifier, band_distance = weapon_range.split(",")[:2]
+                if distance <= int(band_distance):
+                    return int(modifier)
+        return None
+
+    with workspace(synthetic_corpus(units_per_sectorial=40), build=True):
+        weapons = {weapon.weapon_id: weapon for weapon in Weapon.select()}
+
+        start = perf_counter()
+        table = RangeTable()
+        print(f"table load: {(perf_counter() - start) * 1000:.0f}ms, "
+              f"{len(table.weapon_ids)} ranged weapons")
+
+        rng = np.random.default_rng(0)
+        weapon_ids = rng.choice(list(weapons), 1_000_000)
+        distances = rng.uniform(0, 60, 1_000_000)
+
+        start = perf_counter()
+        modifiers = table.modifiers(weapon_ids, distances)
+        elapsed = perf_counter() - start
+        print(f"     batch: {len(distances) / elapsed:,.0f} pairs/s")
+
+        sample = 100_000
+        start = perf_counter()
+        parsed = [parsed_modifier(weapons[weapon_id], distance)
+                  for weapon_id, distance in zip(
+                      weapon_ids[:sample].tolist(),
+                      distances[:sample].tolist())]
+        elapsed = perf_counter() - start
+        mismatches = sum(
+            (expected is None) != np.isnan(modifier) or
+            (expected is not None and expected != modifier)
+            for expected, modifier in zip(parsed, modifiers[:sample]))
+        print(f"   parsing: {sample / elapsed:,.0f} pairs/s, "
+              f"{mismatches} mismatches on {sample:,} pairs")
+        check(not mismatches, "range table modifiers")
+
+
+def bench_lineages() -> None:
+    """Times reading the ancestors and inherited properties of every weapon
+    from the closure tables, compared with following the parent chain of
+    each weapon one query at a time, and checks both agree."""
+
+    from db_classes import Weapon, WeaponProperty
+    from queries import get_lineages
+
+    def walked_lineage(weapon_id: int) -> dict:
+        ancestors, properties = [], set()
+        while weapon_id is not None:
+            properties.update(property_id for property_id, in WeaponProperty
+                              .select(WeaponProperty.weapon_property)
+                              .where(WeaponProperty.weapon == weapon_id)
+                              .tuples())
+            weapon_id = Weapon.get_by_id(weapon_id).parent_weapon_id
+            if weapon_id is not None:
+                ancestors.append(weapon_id)
+        return {"ancestors": ancestors, "properties": sorted(properties)}
+
+    with workspace(synthetic_corpus(units_per_sectorial=40), build=True):
+        weapon_ids = [weapon_id for weapon_id, in
+                      Weapon.select(Weapon.weapon_id).tuples()]
+
+        start = perf_counter()
+        lineages = get_lineages(weapon_ids)
+        elapsed = perf_counter() - start
+        print(f"closure: {len(weapon_ids)} weapons in "
+              f"{elapsed * 1000:.1f}ms")
+
+        start = perf_counter()
+        walked = {weapon_id: walked_lineage(weapon_id)
+                  for weapon_id in weapon_ids}
+        elapsed = perf_counter() - start
+        same = all(
+            walked[weapon_id] == {
+                "ancestors": lineage["ancestors"],
+                "properties": [item["id"] for item in lineage["properties"]]}
+            for weapon_id, lineage in lineages.items())
+        inherited = sum(bool(lineage["ancestors"])
+                        for lineage in lineages.values())
+        print(f"   walk: {len(weapon_ids)} weapons in "
+              f"{elapsed * 1000:.1f}ms, {inherited} with a parent, "
+              f"same lineages: {check(same, 'closure lineages')}")
+
+
+def bench_columnar() -> None:
+    """Exports a synthetic catalogue to columnar files, memory maps them and
+    times a few balance aggregations over every profile against the same
+    aggregations looping over model instances, checking both agree."""
+
+    import numpy as np
+    from db_classes import Unit, Profile, Weapon, ProfileWeapon
+    from columnar import export_columns, load_columns
+
+    def columnar_aggregates(directory: str) -> dict:
+        tables = load_columns(directory).tables
+        profiles, weapons = tables["profiles"], tables["weapons"]
+        links = tables["profile_weapons"]
+
+        units, unit_rows = np.unique(profiles["unit_id"], return_inverse=True)
+        points = np.bincount(unit_rows, weights=profiles["point_cost"])
+        swc = np.bincount(unit_rows, weights=profiles["cap"])
+        armors, armor_rows = np.unique(profiles["armor"], return_inverse=True)
+        armor_points = np.bincount(armor_rows, weights=profiles["point_cost"]) \
+            / np.bincount(armor_rows)
+        bursts = np.maximum(weapons["burst_range"][links["weapon"]],
+                            weapons["burst_melee"][links["weapon"]])
+        burst = np.bincount(links["profile"], weights=bursts,
+                            minlength=len(profiles))
+        return {"points": dict(zip(units.tolist(), points.tolist())),
+                "swc": dict(zip(units.tolist(), np.round(swc, 2).tolist())),
+                "armor_points": dict(zip(armors.tolist(), armor_points.tolist())),
+                "burst": dict(zip(profiles["profile_id"].tolist(),
+                                  burst.tolist()))}
+
+    def orm_aggregates() -> dict:
+        units = {unit.unit_id: unit for unit in Unit.select()}
+        weapons = {weapon.weapon_id: weapon for weapon in Weapon.select()}
+        points, swc, burst = defaultdict(int), defaultdict(float), {}
+        armor_points = defaultdict(list)
+        for profile in Profile.select():
+            points[profile.unit_id] += profile.point_cost
+            swc[profile.unit_id] += profile.cap
+            armor_points[units[profile.unit_id].armor].append(profile.point_cost)
+            burst[profile.profile_id] = 0
+        for link in ProfileWeapon.select():
+            weapon = weapons[link.weapon_id]
+            burst[link.profile_id] += max(weapon.burst_range or -1,
+                                          weapon.burst_melee or -1)
+        return {"points": dict(points),
+                "swc": {unit: round(total, 2) for unit, total in swc.items()},
+                "armor_points": {armor: sum(costs) / len(costs)
+                                 for armor, costs in armor_points.items()},
+                "burst": burst}
+
+    with workspace(synthetic_corpus(units_per_sectorial=200), build=True):
+        start = perf_counter()
+        catalogue = export_columns("columnar")
+        print(f"    export: {(perf_counter() - start) * 1000:.0f}ms, "
+              f"{len(catalogue.tables['profiles'])} profiles, "
+              f"{len(catalogue.tables['profile_weapons'])} profile weapons")
+
+        columns, columns_time, columns_peak = measure(
+            columnar_aggregates, "columnar")
+        orm, orm_time, orm_peak = measure(orm_aggregates)
+        print(f"  columnar: {columns_time * 1000:.1f}ms, "
+              f"peak {columns_peak / 2 ** 20:.1f}MB")
+        print(f"       orm: {orm_time * 1000:.1f}ms, "
+              f"peak {orm_peak / 2 ** 20:.1f}MB, "
+              f"same results: {check(columns == orm, 'columnar aggregates')}")
+
+
+async def http_load(host: str, port: int, requests: list,
+                    connections: int) -> tuple:
+    """Sends a list of (path, headers) requests over a number of keep-alive
+    connections, each one taking the next pending request as soon as it gets
+    a response. Returns the latency of every request in milliseconds, a
+    Counter of the response statuses and the body bytes received."""
+
+    import asyncio
+
+    pending = iter(requests)
+    latencies, statuses = [], Counter()
+    received = 0
+
+    async def client() -> None:
+        nonlocal received
+        reader, writer = await asyncio.open_connection(host, port)
+        for path, headers in pending:
+            start = perf_counter()
+            writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}\r\n" + "".join(
+                f"{name}: {value}\r\n" for name, value in headers.items())
+                + "\r\n").encode())
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            length = 0
+            for line in head.split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    length = int(line.split(":")[1])
+            await reader.readexactly(length)
+            latencies.append((perf_counter() - start) * 1000)
+            statuses[int(head.split(" ")[1])] += 1
+            received += length
+        writer.close()
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return latencies, statuses, received
+
+
+def bench_service() -> None:
+    """Starts the HTTP service over a synthetic catalogue in another process
+    and measures latency percentiles and throughput under concurrent
+    keep-alive clients: first lookups, repeated gzip lookups and
+    revalidations answered with 304."""
+
+    import asyncio
+    from subprocess import Popen, PIPE
+    from urllib.request import urlopen
+    from statistics import quantiles
+    from pathlib import Path
+    from db_classes import db, Unit, Profile, Weapon, Ability
+
+    with workspace(synthetic_corpus(units_per_sectorial=40), build=True):
+        paths = [f"/{kind}/{item_id}" for kind, model in (
+            ("units", Unit), ("profiles", Profile), ("weapons", Weapon),
+            ("abilities", Ability))
+            for item_id, in model.select(model._meta.primary_key).tuples()]
+        db.close()
+
+        server = Popen([sys.executable, str(Path(__file__).with_name(
+            "cli.py")), "--database", str(Path("infinity.db").resolve()),
+            "serve", "--port", "0"], stdout=PIPE, text=True)
+        try:
+            host, port = server.stdout.readline().split("//")[1].split(":")
+            port = int(port)
+            rng = Random(0)
+            with urlopen(f"http://{host}:{port}/version") as response:
+                version = json.load(response)["version"]
+            gzip = {"Accept-Encoding": "gzip"}
+            scenarios = (
+                ("first lookups", [(path, gzip) for path in paths]),
+                ("repeated gzip", [(rng.choice(paths), gzip)
+                                   for _ in range(20000)]),
+                ("repeated plain", [(rng.choice(paths), {})
+                                    for _ in range(20000)]),
+                ("revalidations", [(rng.choice(paths), dict(
+                    gzip, **{"If-None-Match": f'"{version}-gzip"'}))
+                    for _ in range(20000)]))
+            for name, requests in scenarios:
+                start = perf_counter()
+                latencies, statuses, received = asyncio.run(
+                    http_load(host, port, requests, 32))
+                elapsed = perf_counter() - start
+                cuts = quantiles(latencies, n=100)
+                print(f"{name:>14}: {len(requests) / elapsed:>7,.0f} req/s, "
+                      f"p50 {cuts[49]:.2f}ms, p99 {cuts[98]:.2f}ms, "
+                      f"{received / len(requests):,.0f}B per body, "
+                      f"statuses {dict(statuses)}")
+                expected = 304 if name == "revalidations" else 200
+                check(statuses == {expected: len(requests)},
+                      f"{name} answered {expected}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def bench_instrumentation() -> None:
+    """Fetches a synthetic corpus from a local server and builds it with a
+    Metrics profiling the weapons stage, printing the report of every
+    stage."""
+
+    from fetcher import fetch_all
+    from instrumentation import Metrics
+    from pathlib import Path
+
+    payloads = to_js_payloads(synthetic_corpus(units_per_sectorial=40))
+    with workspace(), LocalServer(payloads, latency=0.005) as server:
+        metrics = Metrics("metrics.json", profile=("weapons",))
+        quietly(fetch_all, LANGUAGES, base_url=server.url, metrics=metrics)
+
+        from db_operations import generate_db, populate_db
+        from db_classes import db
+
+        quietly(generate_db, db, indexes=False)
+        quietly(populate_db, db, metrics=metrics)
+        db.close()
+
+        stages = json.load(open("metrics.json"))["stages"]
+        for stage in stages:
+            name = "  " * stage["depth"] + stage["stage"]
+            print(f"{name:<20} wall {stage['wall_seconds'] * 1000:7.1f}ms "
+                  f"cpu {stage['cpu_seconds'] * 1000:7.1f}ms "
+                  f"{sum(stage['rows'].values()):6} rows "
+                  f"{stage['statements']:5} statements "
+                  f"{stage['bytes_fetched'] / 1024:6.0f}KB fetched "
+                  f"{stage['bytes_parsed'] / 1024:6.0f}KB parsed "
+                  f"peak {stage['process_peak_rss_kb'] / 1024:.0f}MB "
+                  f"(+{stage['peak_rss_growth_kb'] / 1024:.0f}MB)")
+        print(f"weapons profile written: "
+              f"{check(Path('profiles/weapons.prof').exists(), 'weapons profile')}")
+
+        # Rows skipped as duplicates aren't counted, so a fresh build counts
+        # exactly the rows stored, and the search index statements are logged
+        import db_classes
+        counted = {stage["stage"]: stage for stage in stages}
+        stored = {table: getattr(db_classes, table).select().count()
+                  for table in counted["build"]["rows"]}
+        print(f"rows counted as stored: "
+              f"{check(counted['build']['rows'] == stored, 'rows counted')}")
+        statements = counted["search_index"]["statements"]
+        print(f"search index statements counted: "
+              f"{check(statements > 0, 'search statements')}")
+        db.close()
+
+
+def bench_import_time() -> None:
+    """Times starting a Python process that imports each entry point, in an
+    empty folder, and checks that no import writes any file or loads the
+    fetching modules unless it needs them."""
+
+    from subprocess import run
+    from os import listdir
+    from pathlib import Path
+
+    source = str(Path(__file__).parent)
+
+    def startup(code: str) -> tuple:
+        timings = []
+        for _ in range(5):
+            start = perf_counter()
+            result = run([sys.executable, "-c", code], capture_output=True,
+                         text=True, env={"PYTHONPATH": source}, check=True)
+            timings.append((perf_counter() - start) * 1000)
+        return min(timings), result.stdout.strip()
+
+    with workspace():
+        baseline, _ = startup("pass")
+        print(f"{'interpreter':>16}: {baseline:6.1f}ms")
+        for module in ("queries", "catalogue_cache", "service", "cli",
+                       "sync", "db_operations", "fetcher"):
+            elapsed, loaded = startup(
+                f"import sys, {module}; print(sorted(name for name in "
+                "('requests', 'numpy', 'fetcher', 'db_operations') "
+                "if name in sys.modules))")
+            print(f"{module:>16}: {elapsed:6.1f}ms "
+                  f"(+{elapsed - baseline:5.1f}ms), loads {loaded}")
+            check(module == "fetcher" or "requests" not in loaded,
+                  f"{module} import without the fetching modules")
+            check(module in ("sync", "db_operations") or
+                  "db_operations" not in loaded,
+                  f"{module} import without the ingestion modules")
+        elapsed, _ = startup("import sys; sys.argv = ['cli.py', '--help']\n"
+                             "import cli\ntry:\n    cli.main()\n"
+                             "except SystemExit:\n    pass")
+        print(f"{'cli --help':>16}: {elapsed:6.1f}ms "
+              f"(+{elapsed - baseline:5.1f}ms)")
+        print(f"files written by the imports: {listdir()}")
+        check(not listdir(), "imports without writes")
+
+
+def bench_refresh() -> None:
+    """Serves generation 1 of a synthetic catalogue while a shadow build of a
+    changed corpus runs in another process and is swapped in, comparing the
+    latency percentiles and failures with and without the refresh going on.
+    Then rolls back to generation 1 and checks its answers are served
+    again."""
+
+    import asyncio
+    from subprocess import Popen, PIPE, DEVNULL, run
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from statistics import quantiles
+    from pathlib import Path
+    from generations import shadow_build
+    from db_classes import db, Unit
+
+    cli = str(Path(__file__).with_name("cli.py"))
+    with workspace(synthetic_corpus(units_per_sectorial=40)):
+        quietly(shadow_build)
+        with db:
+            paths = [f"/units/{unit_id}" for unit_id, in
+                     Unit.select(Unit.unit_id).tuples()]
+        write_corpus(synthetic_corpus(units_per_sectorial=40, seed=1))
+
+        server = Popen([sys.executable, cli, "serve", "--port", "0"],
+                       stdout=PIPE, text=True)
+        try:
+            host, port = server.stdout.readline().split("//")[1].split(":")
+            port = int(port)
+
+            def get(path: str) -> bytes:
+                try:
+                    with urlopen(f"http://{host}:{port}{path}") as response:
+                        return response.read()
+                except HTTPError as response:
+                    # Units missing from a generation are answered too
+                    return response.read()
+
+            rng = Random(0)
+            requests = [(rng.choice(paths), {"Accept-Encoding": "gzip"})
+                        for _ in range(500)]
+            before = {path: get(path) for path in paths[:20]}
+            versions = [json.loads(get("/version"))["version"]]
+
+            def report(name: str, latencies: list, statuses: Counter,
+                       failures: int) -> None:
+                cuts = quantiles(latencies, n=100)
+                print(f"{name:>16}: {len(latencies):>6} requests, p50 "
+                      f"{cuts[49]:.2f}ms, p99 {cuts[98]:.2f}ms, statuses "
+                      f"{dict(statuses)}, failures {failures}")
+
+            def load_while(running) -> tuple:
+                latencies, statuses, failures = [], Counter(), 0
+                while True:
+                    try:
+                        batch, batch_statuses, _ = asyncio.run(
+                            http_load(host, port, requests, 8))
+                    except (OSError, asyncio.IncompleteReadError):
+                        failures += 1
+                        continue
+                    latencies += batch
+                    statuses += batch_statuses
+                    if not running():
+                        return latencies, statuses, failures
+
+            # Fills the cache of generation 1 first
+            asyncio.run(http_load(host, port, requests, 8))
+            idle = iter(range(10))
+            report("idle", *load_while(lambda: next(idle, None) is not None))
+
+            build = Popen([sys.executable, cli, "build"], stdout=DEVNULL)
+            report("during refresh",
+                   *load_while(lambda: build.poll() is None))
+            versions.append(json.loads(get("/version"))["version"])
+            changed = sum(get(path) != body for path, body in before.items())
+            print(f"swapped to {Path('infinity.db').resolve().name}: "
+                  f"version {versions[0]} -> {versions[1]}, "
+                  f"{changed} of {len(before)} sampled units changed")
+            check(versions[1] != versions[0] and changed, "refresh swapped in")
+
+            run([sys.executable, cli, "rollback"], stdout=DEVNULL,
+                check=True)
+            versions.append(json.loads(get("/version"))["version"])
+            restored = all(get(path) == body
+                           for path, body in before.items())
+            print(f"rolled back to {Path('infinity.db').resolve().name}: "
+                  f"version {versions[1]} -> {versions[2]}, same answers "
+                  f"as before the refresh: {check(restored, 'rollback')}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def write_scaled_corpus(scale: int) -> None:
+    """Writes a synthetic corpus scaled up from the default one, with scale
+    times its units and weapons."""
+
+    write_corpus(synthetic_corpus(units_per_sectorial=20 * scale,
+                                  weapons=300 * scale))
+
+
+def same_contents(first: str, second: str) -> bool:
+    """Checks if two databases have the same table contents."""
+
+    return table_contents(first) == table_contents(second)
+
+
+# Runs the command given after it and exits with its status. The peak memory
+# of a process is kept across fork and exec, so commands started by the
+# harness report its peak if it was higher than theirs, while the ones
+# started by this fresh interpreter only carry its own few megabytes.
+LAUNCHER = ("import subprocess, sys; "
+            "sys.exit(subprocess.call(sys.argv[1:]))")
+
+
+def bench_streaming() -> None:
+    """Builds synthetic corpora of growing size with populate_db and with the
+    streaming ingestion, each one in a process of its own started from a
+    fresh LAUNCHER interpreter, and compares the time and peak memory of the
+    build stage and the resulting contents. The corpora are written and
+    compared from other processes, to keep the harness itself small."""
+
+    from multiprocessing import Process
+    from concurrent.futures import ProcessPoolExecutor
+    from subprocess import run, DEVNULL
+    from pathlib import Path
+
+    cli = str(Path(__file__).with_name("cli.py"))
+    for scale in (1, 4, 16):
+        with workspace():
+            writer = Process(target=write_scaled_corpus, args=(scale,))
+            writer.start()
+            writer.join()
+            size = sum(file.stat().st_size
+                       for file in Path("JSON").rglob("*.json"))
+
+            results, peaks = [], {}
+            for mode, options in (("populate", []), ("stream", ["--stream"])):
+                run([sys.executable, "-c", LAUNCHER, sys.executable, cli,
+                     "--database", f"{mode}/infinity.db", "build",
+                     "--metrics", f"{mode}.json", *options], stdout=DEVNULL,
+                    check=True)
+                with open(f"{mode}.json") as metrics_file:
+                    build = next(
+                        stage for stage in json.load(metrics_file)["stages"]
+                        if stage["stage"] == "build")
+                peaks[mode] = build["process_peak_rss_kb"] / 1024
+                results.append(f"{mode} {build['wall_seconds']:6.2f}s, peak "
+                               f"{peaks[mode]:6.1f}MB")
+            check(peaks["stream"] < peaks["populate"],
+                  f"streamed build x{scale} peak")
+
+            with ProcessPoolExecutor(1) as pool:
+                same = pool.submit(same_contents, "populate/infinity.db",
+                                   "stream/infinity.db").result()
+            print(f"x{scale:<3} {size / 2 ** 20:6.1f}MB corpus: "
+                  f"{' | '.join(results)} | same contents: "
+                  f"{check(same, f'streamed build x{scale}')}")
+
+
+def bench_corpus_format() -> None:
+    """Converts synthetic corpora of growing size from indented JSON to packed
+    files, and compares their size on disk, the time taken to load every
+    file and to read single weapons and sectorials, and the databases built
+    from each format, streamed builds included."""
+
+    from corpus_format import convert_corpus, corpus_files, load_corpus_file, \
+        PackedFile
+    from subprocess import run, DEVNULL
+    from pathlib import Path
+
+    def load_all(root: str) -> float:
+        start = perf_counter()
+        for language in LANGUAGES:
+            for name in corpus_files(f"{root}/{language}"):
+                load_corpus_file(f"{root}/{language}", name)
+        return perf_counter() - start
+
+    cli = str(Path(__file__).with_name("cli.py"))
+    for scale in (1, 4, 16):
+        with workspace():
+            write_scaled_corpus(scale)
+            start = perf_counter()
+            convert_corpus("JSON", "packed")
+            convert_seconds = perf_counter() - start
+            sizes = [sum(file.stat().st_size
+                         for file in Path(root).rglob(pattern))
+                     for root, pattern in (("JSON", "*.json"),
+                                           ("packed", "*.pack"))]
+            print(f"x{scale:<3} disk: JSON {sizes[0] / 2 ** 20:6.2f}MB, "
+                  f"packed {sizes[1] / 2 ** 20:6.2f}MB "
+                  f"({sizes[0] / sizes[1]:.1f}x smaller), "
+                  f"converted in {convert_seconds:.2f}s")
+            print(f"     load everything: JSON {load_all('JSON'):.3f}s, "
+                  f"packed {load_all('packed'):.3f}s")
+
+            rng = Random(scale)
+            weapons = [str(rng.randint(1, 300 * scale)) for _ in range(100)]
+            start = perf_counter()
+            from_json = [next(weapon for weapon in load_corpus_file(
+                "JSON/ENG", "JSON_ARMAS") if weapon["id"] == weapon_id)
+                for weapon_id in weapons]
+            json_seconds = perf_counter() - start
+            start = perf_counter()
+            from_packed = [PackedFile("packed/ENG/JSON_ARMAS.pack").get(
+                weapon_id) for weapon_id in weapons]
+            packed_seconds = perf_counter() - start
+            print(f"     single weapon: JSON "
+                  f"{json_seconds / len(weapons) * 1000:.2f}ms, packed "
+                  f"{packed_seconds / len(weapons) * 1000:.2f}ms, "
+                  f"same: {check(from_json == from_packed, 'packed weapons')}")
+
+            sectorials = [name for name in corpus_files("JSON/ENG")
+                          if name.isdigit()]
+            timings = []
+            for root in ("JSON", "packed"):
+                start = perf_counter()
+                for name in sectorials:
+                    load_corpus_file(f"{root}/ENG", name)
+                timings.append(perf_counter() - start)
+            print(f"     single sectorial: JSON "
+                  f"{timings[0] / len(sectorials) * 1000:.2f}ms, packed "
+                  f"{timings[1] / len(sectorials) * 1000:.2f}ms")
+
+            Path("JSON").rename("indented")
+            builds = {}
+            for mode, root, options in (
+                    ("json", "indented", []), ("packed", "packed", []),
+                    ("stream", "packed", ["--stream"])):
+                Path(root).rename("JSON")
+                start = perf_counter()
+                run([sys.executable, cli, "--database",
+                     f"{mode}-db/infinity.db", "build", *options],
+                    stdout=DEVNULL, check=True)
+                builds[mode] = perf_counter() - start
+                Path("JSON").rename(root)
+            same = same_contents("json-db/infinity.db",
+                                 "packed-db/infinity.db") and \
+                same_contents("json-db/infinity.db", "stream-db/infinity.db")
+            print(f"     build: {', '.join(f'{mode} {seconds:.2f}s' for mode, seconds in builds.items())}"
+                  f", same contents: {check(same, f'packed builds x{scale}')}")
+
+
+def bench_snapshot() -> None:
+    """Exports a synthetic catalogue as a snapshot and compares loading it and
+    looking up random units, profiles and weapons from it against the ORM
+    queries, along with the memory the snapshot holds and the peak memory
+    of every lookup, checking both return the same items."""
+
+    from db_classes import db, Unit, Profile, Weapon
+    from queries import get_units, get_profiles, get_weapons
+    from snapshot import export_snapshot, load_snapshot
+    from pathlib import Path
+
+    with workspace(synthetic_corpus(units_per_sectorial=200), build=True):
+        start = perf_counter()
+        quietly(export_snapshot, "catalogue.snapshot")
+        print(f"    export: {(perf_counter() - start) * 1000:.0f}ms, "
+              f"{Path('catalogue.snapshot').stat().st_size / 2 ** 20:.1f}MB")
+
+        load_snapshot("catalogue.snapshot")
+        loads = []
+        for _ in range(5):
+            start = perf_counter()
+            load_snapshot("catalogue.snapshot")
+            loads.append(perf_counter() - start)
+        snapshot, _, held = measure(load_snapshot, "catalogue.snapshot")
+        print(f"      load: {sorted(loads)[2] * 1000:.1f}ms, "
+              f"{held / 2 ** 20:.1f}MB held, {len(snapshot.units)} units, "
+              f"{len(snapshot.profiles)} profiles, "
+              f"{len(snapshot.weapons)} weapons")
+
+        with db:
+            ids = {"units": [unit_id for unit_id, in
+                             Unit.select(Unit.unit_id).tuples()],
+                   "profiles": [profile_id for profile_id, in
+                                Profile.select(Profile.profile_id).tuples()],
+                   "weapons": [weapon_id for weapon_id, in
+                               Weapon.select(Weapon.weapon_id).tuples()]}
+            orm_lookups = {"units": get_units, "profiles": get_profiles,
+                           "weapons": get_weapons}
+            rng = Random(0)
+            for kind in ("units", "profiles", "weapons"):
+                for batch in (1, 10, 100):
+                    batches = [rng.sample(ids[kind], batch)
+                               for _ in range(2000 // batch)]
+                    timings = []
+                    for lookup in (orm_lookups[kind],
+                                   snapshot.lookups[kind]):
+                        # Results aren't kept, so the time spent
+                        # collecting them doesn't grow with the batches
+                        start = perf_counter()
+                        for item_ids in batches:
+                            lookup(item_ids)
+                        timings.append((perf_counter() - start) /
+                                       len(batches))
+                    same = all(orm_lookups[kind](item_ids) ==
+                               snapshot.lookups[kind](item_ids)
+                               for item_ids in batches)
+                    print(f"{kind:>10} x{batch:<3}: orm "
+                          f"{timings[0] * 1000:7.3f}ms, snapshot "
+                          f"{timings[1] * 1000:7.3f}ms "
+                          f"({timings[0] / timings[1]:5.1f}x), "
+                          f"same: {check(same, f'snapshot {kind} x{batch}')}")
+
+            everything, orm_time, orm_peak = measure(get_units,
+                                                     ids["units"])
+            from_snapshot, snapshot_time, snapshot_peak = measure(
+                snapshot.get_units, ids["units"])
+            print(f" all units: orm {orm_time * 1000:.0f}ms, peak "
+                  f"{orm_peak / 2 ** 20:.1f}MB | snapshot "
+                  f"{snapshot_time * 1000:.0f}ms, peak "
+                  f"{snapshot_peak / 2 ** 20:.1f}MB | same: "
+                  f"{check(everything == from_snapshot, 'snapshot of every unit')}")
+
+
+BENCHMARKS = {"fetch": bench_fetch, "http_cache": bench_http_cache,
+              "js_parser": bench_js_parser, "bulk_insert": bench_bulk_insert,
+              "corpus": bench_corpus, "key_map": bench_key_map,
+              "sync": bench_sync, "parallel_build": bench_parallel_build,
+              "query_plans": bench_query_plans, "queries": bench_queries,
+              "catalogue_cache": bench_catalogue_cache,
+              "localization": bench_localization, "search": bench_search,
+              "army_lists": bench_army_lists, "probability": bench_probability,
+              "ranges": bench_ranges, "lineages": bench_lineages,
+              "columnar": bench_columnar,
+              "service": bench_service,
+              "instrumentation": bench_instrumentation,
+              "import_time": bench_import_time, "refresh": bench_refresh,
+              "streaming": bench_streaming,
+              "corpus_format": bench_corpus_format,
+              "snapshot": bench_snapshot}
+
+
+if __name__ == "__main__":
+    failed = []
+    for benchmark in sys.argv[1:] or BENCHMARKS:
+        print(f"== {benchmark} ==")
+        try:
+            BENCHMARKS[benchmark]()
+        except CheckFailed as error:
+            print(f"FAILED {error}")
+            failed.append(benchmark)
+    sys.exit(f"failed checks in: {', '.join(failed)}" if failed else 0)
@@ -0,0 +1,196 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from functools import partial
+from typing import Callable, Hashable, NamedTuple
+from peewee import SqliteDatabase
+
+from db_classes import db, catalogue_version, version_listeners
+from queries import get_units, get_profiles, get_weapons, get_abilities, \
+    get_strings
+
+
+class CacheStats(NamedTuple):
+    """Counters of a CatalogueCache since it was created."""
+
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    invalidations: int
+    size: int
+    version: int
+
+
+class CatalogueCache:
+    """Bounded read-through cache in front of the read API. Entries are kept
+    in least recently used order, evicted once there are more than max_size
+    of them and dropped when they are older than ttl seconds. Every entry
+    belongs to a catalogue version, and the whole cache is invalidated once
+    a build or a sync bumps the version of the database.
+    The version is only read from the database every version_ttl seconds, so
+    cache hits don't run any query. Bumps made in this process, through the
+    same database, are seen on the next lookup, while the ones made by other
+    processes take up to version_ttl seconds, unless invalidate is called.
+    Items of the read API are cached apart for every language they are asked
+    in. Cached items are shared between callers, so they must not be
+    modified."""
+
+    def __init__(self, database: SqliteDatabase = db, max_size: int = 4096,
+                 ttl: float = 3600, clock: Callable = monotonic,
+                 version_ttl: float = 1.):
+        self.database = database
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.version_ttl = version_ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.version = None
+        self.version_checked = None
+        version_listeners.add(self)
+        self.hits = self.misses = self.evictions = 0
+        self.expirations = self.invalidations = 0
+
+    def stats(self) -> CacheStats:
+        """Returns the current counters."""
+
+        with self.lock:
+            return CacheStats(self.hits, self.misses, self.evictions,
+                              self.expirations, self.invalidations,
+                              len(self.entries), self.version)
+
+    def clear(self) -> None:
+        """Drops every entry."""
+
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self) -> None:
+        """Makes the next lookup read the catalogue version again, like after
+        the database path is swapped to another generation."""
+
+        with self.lock:
+            self.version_checked = None
+
+    def version_bumped(self, database: SqliteDatabase) -> None:
+        """Invalidates the cache when the version of its database is bumped
+        in this process."""
+
+        if database is self.database:
+            self.invalidate()
+
+    def check_version(self) -> int:
+        """Reads the catalogue version, if it wasn't in the last version_ttl
+        seconds, and drops every entry of the previous one if it changed."""
+
+        now = self.clock()
+        with self.lock:
+            if self.version_checked is not None and \
+                    now - self.version_checked < self.version_ttl:
+                return self.version
+
+        version = catalogue_version(self.database)
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.version = version
+            self.version_checked = now
+        return version
+
+    def get_many(self, kind: Hashable, keys: list, loader: Callable) -> dict:
+        """Returns a dict with the items of a kind found for a list of keys.
+        The ones missing from the cache are loaded with a single call to
+        loader, which takes a list of keys and returns a dict."""
+
+        version = self.check_version()
+        now = self.clock()
+        found, missing = {}, []
+
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                entry = self.entries.get((version, kind, key))
+                if entry is None:
+                    missing.append(key)
+                elif now - entry[0] > self.ttl:
+                    del self.entries[(version, kind, key)]
+                    self.expirations += 1
+                    missing.append(key)
+                else:
+                    self.entries.move_to_end((version, kind, key))
+                    found[key] = entry[1]
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = loader(missing)
+            with self.lock:
+                # Items loaded while a new version was being written are
+                # returned, but not kept around.
+                if version == self.version:
+                    for key, item in loaded.items():
+                        self.entries[(version, kind, key)] = (now, item)
+                    while len(self.entries) > self.max_size:
+                        self.entries.popitem(last=False)
+                        self.evictions += 1
+            found.update(loaded)
+
+        return found
+
+    def get_localized(self, kind: str, keys: list, loader: Callable,
+                      language: str = None) -> dict:
+        """get_many for a read API function, whose items are kept apart for
+        every language."""
+
+        language = language and language.upper()
+        return self.get_many((kind, language), keys,
+                             partial(loader, language=language))
+
+    def units(self, unit_ids: list, language: str = None) -> dict:
+        """Cached get_units."""
+
+        return self.get_localized("unit", unit_ids, get_units, language)
+
+    def profiles(self, profile_ids: list, language: str = None) -> dict:
+        """Cached get_profiles."""
+
+        return self.get_localized("profile", profile_ids, get_profiles,
+                                  language)
+
+    def weapons(self, weapon_ids: list, language: str = None) -> dict:
+        """Cached get_weapons."""
+
+        return self.get_localized("weapon", weapon_ids, get_weapons, language)
+
+    def abilities(self, ability_ids: list, language: str = None) -> dict:
+        """Cached get_abilities."""
+
+        return self.get_localized("ability", ability_ids, get_abilities,
+                                  language)
+
+    def strings(self, string_ids: list, language: str = None) -> dict:
+        """Cached get_strings."""
+
+        return self.get_localized("string", string_ids, get_strings, language)
+
+    def unit(self, unit_id: int, language: str = None) -> dict:
+        """Returns a cached hydrated unit, or None if it doesn't exist."""
+
+        return self.units([unit_id], language).get(unit_id)
+
+    def profile(self, profile_id: int, language: str = None) -> dict:
+        """Returns a cached hydrated profile, or None if it doesn't exist."""
+
+        return self.profiles([profile_id], language).get(profile_id)
+
+    def weapon(self, weapon_id: int, language: str = None) -> dict:
+        """Returns a cached hydrated weapon, or None if it doesn't exist."""
+
+        return self.weapons([weapon_id], language).get(weapon_id)
+
+    def ability(self, ability_id: int, language: str = None) -> dict:
+        """Returns a cached hydrated ability, or None if it doesn't exist."""
+
+        return self.abilities([ability_id], language).get(ability_id)
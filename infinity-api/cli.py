@@ -0,0 +1,312 @@
+"""Command line entry point:
+
+    python cli.py fetch      fetches the corpus into the JSON folder
+    python cli.py build      builds a new generation from the JSON folder
+    python cli.py rollback   goes back to a previous generation
+    python cli.py generations  lists the stored generations
+    python cli.py sync       applies the changes of the JSON folder
+    python cli.py query      prints units, profiles, weapons or abilities
+    python cli.py serve      serves the catalogue over HTTP
+    python cli.py export     exports the columnar catalogue
+    python cli.py convert    converts the JSON folder to another file format
+    python cli.py snapshot   exports the catalogue snapshot
+
+Every command imports what it needs when it runs, so read-only commands
+never load the fetching or ingestion modules."""
+
+from argparse import ArgumentParser, Namespace
+from os import path
+import json
+import sys
+
+
+def metrics_of(arguments: Namespace):
+    """Returns the Metrics asked for on the command line."""
+
+    from instrumentation import Metrics
+
+    return Metrics(arguments.metrics, tuple(
+        stage for stage in (arguments.profile or "").split(",") if stage),
+        arguments.profile_directory)
+
+
+def fetch(arguments: Namespace, metrics=None):
+    """Fetches every language and returns the FetchReport."""
+
+    from fetcher import fetch_all
+
+    report = fetch_all(tuple(arguments.languages), base_url=arguments.base_url,
+                       metrics=metrics or metrics_of(arguments),
+                       packed=not arguments.json)
+    for language, names in report.changed.items():
+        print(f"{language}: {len(names)} file(s) changed")
+    for url in report.failed:
+        print(f"Failed: {url}")
+    return report
+
+
+def require_database() -> bool:
+    """Checks if the database exists, since opening it would create an empty
+    one."""
+
+    from db_classes import db
+
+    if not path.exists(db.database):
+        print(f"{db.database} doesn't exist yet, build it first.")
+        return False
+    return True
+
+
+def command_fetch(arguments: Namespace) -> int:
+    """Fetches the corpus into the JSON folder."""
+
+    return 1 if fetch(arguments).failed else 0
+
+
+def command_build(arguments: Namespace) -> int:
+    """Builds a new generation of the database and swaps it in, fetching the
+    corpus first if asked."""
+
+    from db_classes import db
+    from generations import shadow_build
+
+    metrics = metrics_of(arguments)
+    if arguments.fetch:
+        fetch(arguments, metrics)
+    generation = shadow_build(db.database, workers=arguments.workers,
+                              metrics=metrics, keep=arguments.keep,
+                              stream=arguments.stream)
+    print(f"{db.database} is now generation {generation}.")
+    return 0
+
+
+def command_rollback(arguments: Namespace) -> int:
+    """Points the database back to a previous generation."""
+
+    from db_classes import db
+    from generations import rollback, GenerationError
+
+    try:
+        generation = rollback(db.database, arguments.generation)
+    except GenerationError as error:
+        print(error)
+        return 1
+    print(f"{db.database} is now generation {generation}.")
+    return 0
+
+
+def command_generations(arguments: Namespace) -> int:
+    """Lists the stored generations, marking the current one."""
+
+    from db_classes import db
+    from generations import generations, current_generation
+
+    current = current_generation(db.database)
+    for generation in generations(db.database):
+        print(f"{'*' if generation == current else ' '} {generation}")
+    return 0
+
+
+def command_sync(arguments: Namespace) -> int:
+    """Applies the changes of the corpus to the database, fetching it first
+    if asked."""
+
+    if not require_database():
+        return 1
+
+    from db_classes import db
+    from sync import sync_db
+
+    changed = fetch(arguments).changed if arguments.fetch else None
+    changeset = sync_db(db, changed=changed)
+    for table, changes in sorted(changeset.items()):
+        print(f"{table}: {changes.inserted} inserted, {changes.updated} "
+              f"updated, {changes.deleted} deleted")
+    if not changeset:
+        print("Nothing changed.")
+    return 0
+
+
+def command_query(arguments: Namespace) -> int:
+    """Prints the items of a kind as JSON, with names in a single language
+    if one is given. Fails if any of them is missing."""
+
+    if not require_database():
+        return 1
+
+    from queries import get_units, get_profiles, get_weapons, get_abilities
+    from localization import UnknownLanguageError
+
+    lookup = {"units": get_units, "profiles": get_profiles,
+              "weapons": get_weapons, "abilities": get_abilities}
+    try:
+        items = lookup[arguments.kind](arguments.ids, language=arguments.lang)
+    except UnknownLanguageError as error:
+        print(f"{error}.")
+        return 1
+    json.dump([items[item_id] for item_id in dict.fromkeys(arguments.ids)
+               if item_id in items], sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 0 if len(items) == len(set(arguments.ids)) else 1
+
+
+def command_serve(arguments: Namespace) -> int:
+    """Serves the catalogue until interrupted."""
+
+    if not require_database():
+        return 1
+
+    from db_classes import db
+    from service import run
+    from snapshot import load_snapshot
+
+    snapshot = load_snapshot(arguments.snapshot) if arguments.snapshot \
+        else None
+    run(arguments.host, arguments.port, arguments.workers, db, snapshot)
+    return 0
+
+
+def command_export(arguments: Namespace) -> int:
+    """Exports the columnar catalogue."""
+
+    if not require_database():
+        return 1
+
+    from columnar import export_columns
+
+    export_columns(arguments.directory)
+    return 0
+
+
+def command_snapshot(arguments: Namespace) -> int:
+    """Exports the catalogue snapshot."""
+
+    if not require_database():
+        return 1
+
+    from snapshot import export_snapshot
+
+    export_snapshot(arguments.file)
+    return 0
+
+
+def command_convert(arguments: Namespace) -> int:
+    """Converts every file of the corpus to packed files or indented JSON."""
+
+    from corpus_format import convert_corpus
+
+    converted = convert_corpus(arguments.source,
+                               arguments.target or arguments.source,
+                               arguments.to == "packed")
+    print(f"{converted} file(s) converted.")
+    return 0
+
+
+def parser() -> ArgumentParser:
+    """Returns the parser of every command and its options."""
+
+    parser = ArgumentParser(description="Fetches, builds and serves the "
+                                        "Infinity army catalogue.")
+    parser.add_argument("--database", default="infinity.db",
+                        help="SQLite file of the catalogue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add(name: str, handler, description: str) -> ArgumentParser:
+        command = commands.add_parser(name, help=description)
+        command.set_defaults(handler=handler)
+        return command
+
+    def add_fetch_options(command: ArgumentParser) -> None:
+        command.add_argument("--languages", nargs="+",
+                             default=["ENG", "ESP", "FRA"])
+        command.add_argument("--base-url",
+                             default="https://army.infinitythegame.com/import")
+        command.add_argument("--json", action="store_true",
+                             help="store the corpus as indented JSON instead "
+                                  "of packed files")
+
+    def add_metrics_options(command: ArgumentParser) -> None:
+        command.add_argument("--metrics", help="JSON file for the stage metrics")
+        command.add_argument("--profile", help="comma separated stages to run "
+                                               "under cProfile, or all")
+        command.add_argument("--profile-directory", default="profiles")
+
+    command = add("fetch", command_fetch, "fetch the corpus")
+    add_fetch_options(command)
+    add_metrics_options(command)
+
+    command = add("build", command_build, "build the database")
+    command.add_argument("--fetch", action="store_true",
+                         help="fetch the corpus first")
+    command.add_argument("--keep", type=int, default=3,
+                         help="generations kept, the new one included")
+    command.add_argument("--workers", type=int, default=1,
+                         help="processes normalizing sectorial files")
+    command.add_argument("--stream", action="store_true",
+                         help="read the corpus an item at a time, in bounded "
+                              "memory")
+    add_fetch_options(command)
+    add_metrics_options(command)
+
+    command = add("rollback", command_rollback,
+                  "go back to a previous generation")
+    command.add_argument("--generation", type=int,
+                         help="generation to go back to, the previous one by "
+                              "default")
+
+    add("generations", command_generations, "list the stored generations")
+
+    command = add("sync", command_sync, "apply corpus changes")
+    command.add_argument("--fetch", action="store_true",
+                         help="fetch the corpus first, comparing only the "
+                              "files that changed")
+    add_fetch_options(command)
+    add_metrics_options(command)
+
+    command = add("query", command_query, "print items as JSON")
+    command.add_argument("kind", choices=("units", "profiles", "weapons",
+                                          "abilities"))
+    command.add_argument("ids", nargs="+", type=int)
+    command.add_argument("--lang",
+                         help="language of the names, falling back to "
+                              "others for the untranslated ones")
+
+    command = add("serve", command_serve, "serve the catalogue over HTTP")
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=8000)
+    command.add_argument("--workers", type=int, default=4,
+                         help="threads running lookups")
+    command.add_argument("--snapshot",
+                         help="catalogue snapshot answering the lookups of "
+                              "its version")
+
+    command = add("export", command_export, "export the columnar catalogue")
+    command.add_argument("--directory", default="columnar")
+
+    command = add("snapshot", command_snapshot,
+                  "export the catalogue snapshot")
+    command.add_argument("--file", default="catalogue.snapshot")
+
+    command = add("convert", command_convert,
+                  "convert the corpus to another file format")
+    command.add_argument("to", choices=("packed", "json"))
+    command.add_argument("--source", default="JSON")
+    command.add_argument("--target",
+                         help="folder to write to, the source one by default")
+
+    return parser
+
+
+def main(argv: list = None) -> int:
+    """Runs a command and returns its exit status."""
+
+    arguments = parser().parse_args(argv)
+    if arguments.command not in ("fetch", "convert"):
+        from db_classes import db
+
+        db.init(arguments.database)
+    return arguments.handler(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Columnar export of the catalogue for analysis. Every table is written as a
+NumPy structured array in its own .npy file, so it can be memory mapped and
+scanned a column at a time without building a model instance per row.
+
+Profiles are exported along with the stats of their unit in a single flat
+table, and link tables are integer coded: profiles and weapons are referenced
+by their row in the exported tables, so joins are plain array indexing, and
+any other item by its ID. Missing integers are stored as MISSING, unless the
+column sets its own value, and missing modifiers as NaN."""
+
+from db_classes import db, Unit, Profile, Weapon, ProfileWeapon, \
+    ProfileAbility, ProfileCharacteristic, WeaponProperty, \
+    WeaponInheritedProperty, UnitSectorial, catalogue_version
+from peewee import SqliteDatabase, fn
+from typing import NamedTuple
+from pathlib import Path
+from os import replace
+import numpy as np
+import json
+
+
+EXPORT_DIRECTORY = "columnar"
+MANIFEST = "manifest.json"
+
+MISSING = -1
+
+UNIT_PROFILE_COLUMNS = (
+    (Profile.profile_id, "i4"), (Profile.unit_id, "i4"),
+    (Profile.point_cost, "i4"), (Profile.cap, "f4"),
+    # Profiles without orders of a kind have none of them
+    (Profile.regular_orders, "i1", 0), (Profile.irregular_orders, "i1", 0),
+    (Profile.impetuous_orders, "i1", 0), (Unit.mov_1, "i1"), (Unit.mov_2, "i1"),
+    (Unit.close_combat, "i1"), (Unit.ballistic_skill, "i1"),
+    (Unit.phisique, "i1"), (Unit.willpower, "i1"), (Unit.armor, "i1"),
+    (Unit.bts, "i1"), (Unit.wounds, "i1"), (Unit.silhouette, "i1"),
+    (Unit.availability, "i1"), (Unit.has_structure, "?"))
+
+WEAPON_COLUMNS = (
+    (Weapon.weapon_id, "i4"), (Weapon.is_melee, "?"),
+    (Weapon.burst_range, "i1"), (Weapon.burst_melee, "i1"),
+    (Weapon.short_modifier, "f4"), (Weapon.short_distance, "i2"),
+    (Weapon.medium_modifier, "f4"), (Weapon.medium_distance, "i2"),
+    (Weapon.long_modifier, "f4"), (Weapon.long_distance, "i2"),
+    (Weapon.maximum_modifier, "f4"), (Weapon.maximum_distance, "i2"),
+    (Weapon.ammo, "i4"), (Weapon.parent_weapon, "i4"))
+
+# Every exported link table and its two fields. Fields referencing profiles
+# or weapons hold their row in the exported tables.
+LINK_TABLES = {
+    "profile_weapons": (ProfileWeapon.profile, ProfileWeapon.weapon),
+    "profile_abilities": (ProfileAbility.profile, ProfileAbility.ability),
+    "profile_characteristics": (ProfileCharacteristic.profile,
+                                ProfileCharacteristic.characteristic),
+    "weapon_properties": (WeaponProperty.weapon,
+                          WeaponProperty.weapon_property),
+    "weapon_inherited_properties": (WeaponInheritedProperty.weapon,
+                                    WeaponInheritedProperty.weapon_property),
+    "unit_sectorials": (UnitSectorial.unit, UnitSectorial.sectorial)}
+
+
+class ColumnarCatalogue(NamedTuple):
+    """Exported tables, keyed by name, and the catalogue version they were
+    exported from."""
+
+    version: int
+    tables: dict
+
+
+def id_rows(sorted_ids: np.ndarray, ids) -> np.ndarray:
+    """Returns the position of every ID in a sorted ID column, or MISSING for
+    the IDs that aren't in it."""
+
+    ids = np.asarray(ids)
+    if not len(sorted_ids):
+        return np.full(ids.shape, MISSING, dtype=np.int32)
+    rows = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[rows] == ids, rows, MISSING).astype(np.int32)
+
+
+def column_array(query, columns: tuple) -> np.ndarray:
+    """Selects some columns, each a field, its NumPy type and optionally the
+    value of its nulls, and returns the rows of a query as a structured array.
+    Nulls are MISSING by default, or NaN in float columns."""
+
+    dtype = np.dtype([(field.name, kind) for field, kind, *_ in columns])
+    selected = []
+    for field, kind, *missing in columns:
+        if missing or np.dtype(kind).kind != "f":
+            selected.append(fn.COALESCE(
+                field, missing[0] if missing else MISSING).alias(field.name))
+        else:
+            # SQLite has no NaN, so float nulls are replaced in Python
+            selected.append(field)
+    rows = list(query.select(*selected).tuples())
+    return np.array([tuple(np.nan if value is None else value for value in row)
+                     for row in rows], dtype=dtype)
+
+
+def link_array(fields: tuple, tables: dict) -> np.ndarray:
+    """Returns the pairs of a link table as a structured array, with the
+    profiles and weapons coded as their rows in the exported tables."""
+
+    pairs = np.array(list(fields[0].model.select(*fields)
+                          .order_by(*fields).tuples()),
+                     dtype=np.int32).reshape(-1, 2)
+    array = np.empty(len(pairs), dtype=[(field.name, "i4") for field in fields])
+    for index, field in enumerate(fields):
+        column = pairs[:, index]
+        if field.rel_model is Profile:
+            column = id_rows(tables["profiles"]["profile_id"], column)
+        elif field.rel_model is Weapon:
+            column = id_rows(tables["weapons"]["weapon_id"], column)
+        array[field.name] = column
+    return array
+
+
+def export_columns(directory: str = EXPORT_DIRECTORY,
+                   database: SqliteDatabase = db) -> ColumnarCatalogue:
+    """Exports the unit profiles, the weapons and the link tables between
+    them as .npy files, one per table, inside a directory. Each file is
+    written aside and moved in place, and the manifest with the catalogue
+    version goes last."""
+
+    print("Exporting columnar catalogue...", end=" ")
+
+    with database:
+        tables = {
+            "profiles": column_array(
+                Profile.select()
+                .join(Unit, on=(Profile.unit_id == Unit.unit_id))
+                .order_by(Profile.profile_id), UNIT_PROFILE_COLUMNS),
+            "weapons": column_array(
+                Weapon.select().order_by(Weapon.weapon_id), WEAPON_COLUMNS)}
+        for name, fields in LINK_TABLES.items():
+            tables[name] = link_array(fields, tables)
+        version = catalogue_version(database)
+
+    # Parents are coded as rows too, once every weapon is known
+    parents = tables["weapons"]["parent_weapon"]
+    has_parent = parents != MISSING
+    parents[has_parent] = id_rows(tables["weapons"]["weapon_id"],
+                                  parents[has_parent])
+
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in tables.items():
+        with open(path / f"{name}.npy.tmp", "wb") as file:
+            np.save(file, array)
+        replace(path / f"{name}.npy.tmp", path / f"{name}.npy")
+    (path / f"{MANIFEST}.tmp").write_text(json.dumps({
+        "version": version,
+        "tables": {name: len(array) for name, array in tables.items()}}))
+    replace(path / f"{MANIFEST}.tmp", path / MANIFEST)
+
+    print("Done.")
+    return ColumnarCatalogue(version, tables)
+
+
+def load_columns(directory: str = EXPORT_DIRECTORY) -> ColumnarCatalogue:
+    """Memory maps every table of an export, without copying them. Pages are
+    only read from the disk once their columns are scanned."""
+
+    path = Path(directory)
+    manifest = json.loads((path / MANIFEST).read_text())
+    return ColumnarCatalogue(manifest["version"], {
+        name: np.load(path / f"{name}.npy", mmap_mode="r")
+        for name in manifest["tables"]})
@@ -0,0 +1,246 @@
+from functools import wraps
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from os import listdir, path
+
+from normalization import parse_sectorial, property_names
+from corpus_format import corpus_path, load_corpus_file
+from instrumentation import Metrics
+
+
+# 901 sectorial is an outlier that makes everything harder since it doesn't
+# follow any structure, so we blacklist it.
+BLACKLISTED_SECTORIALS = (901,)
+
+
+def cached_view(method):
+    """Turns a method into a property that is only computed once."""
+
+    @property
+    @wraps(method)
+    def view(self):
+        if method.__name__ not in self.views:
+            self.views[method.__name__] = method(self)
+        return self.views[method.__name__]
+
+    return view
+
+
+class Corpus:
+    """Read-once view over the locally stored JSON folder, in either corpus
+    file format. Every file is loaded the first time it's needed and kept
+    around, and the populate stages work on the indexed views built from
+    them. Stats are read from the first language, while names are gathered
+    from every language. The bytes of every file loaded are counted in the
+    given Metrics, if any."""
+
+    def __init__(self, root: str = "JSON", metrics: Metrics = None):
+        self.root = root
+        self.metrics = metrics
+        self.languages = tuple(sorted(
+            language for language in listdir(root)
+            if path.isdir(f"{root}/{language}")))
+        self.files = {}
+        self.views = {}
+        self.name_cache = {}
+
+    def load(self, name: str, language: str = "") -> object:
+        """Returns the contents of a corpus file, loading it only once."""
+
+        key = (language or self.languages[0], name)
+        if key not in self.files:
+            folder = f"{self.root}/{key[0]}"
+            if self.metrics:
+                self.metrics.add("bytes_parsed",
+                                 corpus_path(folder, name).stat().st_size)
+            self.files[key] = load_corpus_file(folder, name)
+        return self.files[key]
+
+    @cached_view
+    def sectorials(self) -> tuple:
+        """IDs of every sectorial and faction."""
+
+        return tuple(int(sectorial.split("_")[-1]) for sectorial in
+                     self.load("JSON_SECTORIAL_NOMBRE")["nombresSectorial"])
+
+    @cached_view
+    def unit_sectorials(self) -> tuple:
+        """IDs of the sectorials whose unit files can be ingested."""
+
+        return tuple(sectorial for sectorial in self.sectorials
+                     if sectorial not in BLACKLISTED_SECTORIALS)
+
+    def subset(self, sectorials) -> "Corpus":
+        """Returns a corpus sharing the files loaded by this one, whose unit
+        views only cover the given sectorials, in the same order."""
+
+        corpus = Corpus(self.root, self.metrics)
+        corpus.files = self.files
+        corpus.views["unit_sectorials"] = tuple(
+            sectorial for sectorial in self.unit_sectorials
+            if sectorial in sectorials)
+        return corpus
+
+    def unit_entries(self, language: str = ""):
+        """Yields a (sectorial, army unit, unit profile) tuple for every unit
+        profile in every sectorial. Units in several sectorials show up once
+        per sectorial."""
+
+        for sectorial in self.unit_sectorials:
+            for unit in self.load(str(sectorial), language):
+                for unit_profile in unit["perfiles"]:
+                    yield sectorial, unit, unit_profile
+
+    @cached_view
+    def sectorial_rows(self) -> list:
+        """Normalized rows of every sectorial, as returned by parse_sectorial,
+        in the same order as unit_sectorials."""
+
+        return [parse_sectorial(sectorial, {
+            language: self.load(str(sectorial), language)
+            for language in self.languages})
+            for sectorial in self.unit_sectorials]
+
+    def parse_sectorials(self, workers: int) -> None:
+        """Builds sectorial_rows in a pool of worker processes, each of them
+        loading and normalizing whole sectorial files. Results are gathered
+        in sectorial order, so they don't depend on the number of workers."""
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            self.views["sectorial_rows"] = list(pool.map(
+                load_sectorial, [self.root] * len(self.unit_sectorials),
+                [self.languages] * len(self.unit_sectorials),
+                self.unit_sectorials))
+        if self.metrics:
+            self.metrics.add("bytes_parsed", sum(
+                corpus_path(f"{self.root}/{language}", sectorial).stat().st_size
+                for language in self.languages
+                for sectorial in self.unit_sectorials))
+
+    @cached_view
+    def weapons_by_id(self) -> dict:
+        """First raw weapon found for each weapon ID."""
+
+        weapons = {}
+        for weapon in self.load("JSON_ARMAS"):
+            weapons.setdefault(int(weapon["id"]), weapon)
+        return weapons
+
+    @cached_view
+    def abilities_by_id(self) -> dict:
+        """First raw ability found for each ability ID."""
+
+        abilities = {}
+        for ability in self.load("JSON_HABILIDADES"):
+            abilities.setdefault(int(ability["id"]), ability)
+        return abilities
+
+    def names(self, kind: str) -> dict:
+        """Returns a dict with the names of every item of a kind, each one
+        being a dict with the name in every language."""
+
+        if kind not in self.name_cache:
+            names = defaultdict(dict)
+            for language in self.languages:
+                for item_id, name in NAME_EXTRACTORS[kind](self, language):
+                    names[item_id][language] = name
+            self.name_cache[kind] = names
+        return self.name_cache[kind]
+
+
+def ammo_names(corpus: Corpus, language: str):
+    """Names of the ammo types."""
+
+    for item in corpus.load("JSON_MUNICION", language):
+        yield item["id"], item["nombre"]
+
+
+def ability_names(corpus: Corpus, language: str):
+    """Names of the abilities."""
+
+    for ability in corpus.load("JSON_HABILIDADES", language):
+        yield ability["id"], ability["nombre"]
+
+
+def ability_wiki_names(corpus: Corpus, language: str):
+    """Wiki URLs of the abilities."""
+
+    for ability_id, name in corpus.load("JSON_HABS_WIKI_URLS", language).items():
+        yield int(ability_id), name
+
+
+def characteristic_names(corpus: Corpus, language: str):
+    """Names of the characteristics."""
+
+    for item in corpus.load("JSON_CARACTERISTICAS", language):
+        yield item["id"], item["nombre"]
+
+
+def sectorial_names(corpus: Corpus, language: str):
+    """Names of the sectorials and factions."""
+
+    for sectorial, name in corpus.load(
+            "JSON_SECTORIAL_NOMBRE", language)["nombresSectorial"].items():
+        yield int(sectorial.lstrip("idSectorial_")), name
+
+
+def weapon_names(corpus: Corpus, language: str):
+    """Full names of the weapons."""
+
+    for weapon in corpus.load("JSON_ARMAS", language):
+        yield int(weapon["id"]), weapon["nombre_completo"]
+
+
+def weapon_wiki_names(corpus: Corpus, language: str):
+    """Wiki URLs of the weapons."""
+
+    for weapon_id, link in corpus.load("JSON_ARMAS_WIKI_URLS", language).items():
+        yield int(weapon_id), link
+
+
+def weapon_property_names(corpus: Corpus, language: str):
+    """Names of the weapon properties, taken from the weapons using them."""
+
+    for weapon in corpus.load("JSON_ARMAS", language):
+        yield from property_names(weapon)
+
+
+def unit_names(corpus: Corpus, language: str):
+    """Names of the units."""
+
+    return shard_names(corpus, "unit", language)
+
+
+def profile_names(corpus: Corpus, language: str):
+    """Names of the unit profiles."""
+
+    return shard_names(corpus, "profile", language)
+
+
+def shard_names(corpus: Corpus, kind: str, language: str):
+    """Names of a kind of item found in the normalized sectorial rows."""
+
+    for _, _, _, names in corpus.sectorial_rows:
+        for name_kind, item_id, name_language, name in names:
+            if name_kind == kind and name_language == language:
+                yield item_id, name
+
+
+def load_sectorial(root: str, languages: tuple, sectorial: int) -> tuple:
+    """Loads a sectorial file in every language and normalizes it. This runs
+    in worker processes, so it reads the files on its own."""
+
+    units_by_language = {}
+    for language in languages:
+        units_by_language[language] = load_corpus_file(f"{root}/{language}",
+                                                       sectorial)
+    return parse_sectorial(sectorial, units_by_language)
+
+
+NAME_EXTRACTORS = {
+    "ammo": ammo_names, "ability": ability_names,
+    "ability_wiki": ability_wiki_names,
+    "characteristic": characteristic_names, "sectorial": sectorial_names,
+    "weapon": weapon_names, "weapon_wiki": weapon_wiki_names,
+    "weapon_property": weapon_property_names, "unit": unit_names,
+    "profile": profile_names}
@@ -0,0 +1,382 @@
+"""Files of the locally stored corpus, in either of its two formats: the
+indented JSON files the corpus used to be stored as, or compact packed
+files. Each language folder holds one file per payload, named after it, and
+packed files take precedence over JSON files with the same name.
+
+A packed file is versioned and holds the items of a JSON array, or the (key,
+value) pairs of a JSON object, as compact JSON records compressed in blocks,
+followed by an index of the blocks and of the key of every record. A single
+record, like a weapon, is read by decompressing only its block, and the
+records can be iterated a block at a time.
+
+    header: magic, format version, kind, record and block counts, and the
+            offset and size of the index
+    blocks: zlib compressed runs of comma separated records of up to
+            BLOCK_SIZE bytes, so a whole block is decoded at once
+    index: zlib compressed little-endian arrays of the offset and size of
+           every block, the block, start and end of every record and their
+           NUL separated keys, empty for items without one
+
+Every integer is stored little-endian, so files can be read on any host."""
+
+from json import JSONDecoder, JSONDecodeError, dumps, loads, load, dump
+from re import compile as compile_regex
+from itertools import accumulate
+from array import array
+from pathlib import Path
+from os import replace
+import struct
+import zlib
+import sys
+
+
+JSON_SUFFIX = ".json"
+PACKED_SUFFIX = ".pack"
+
+MAGIC = b"INFC"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHBxIIQI")
+
+# Index arrays are swapped to and from little-endian on big-endian hosts
+SWAP_BYTES = sys.byteorder != "little"
+
+# Kinds of top-level value a packed file can hold
+ARRAY, OBJECT = 0, 1
+
+# Uncompressed bytes of records per block. Smaller blocks are faster to read
+# a single record from, while larger ones compress better.
+BLOCK_SIZE = 32 * 1024
+COMPRESSION_LEVEL = 6
+
+# Fields holding the key of an array item, in the order they are tried
+KEY_FIELDS = ("id", "IDArmy")
+
+# Characters read from a JSON file at a time
+READ_SIZE = 64 * 1024
+
+WHITESPACE = compile_regex(r"[ \t\n\r]*")
+DELIMITERS = " \t\n\r,:]}"
+
+
+class CorpusFormatError(ValueError):
+    """Raised when a packed file isn't one, has an unknown version or a
+    broken index."""
+
+
+class JSONStream:
+    """Decodes the items of the top-level array of a JSON file, or the (key,
+    value) pairs of its top-level object, reading the file a block at a
+    time. Only the block and the item being decoded are held in memory."""
+
+    def __init__(self, json_file, read_size: int = READ_SIZE):
+        self.file = json_file
+        self.read_size = read_size
+        self.decoder = JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+
+    def read(self, size: int = None) -> bool:
+        """Appends the next characters of the file to the buffer, dropping
+        the ones already decoded. Returns False at the end of the file."""
+
+        block = self.file.read(size or self.read_size)
+        self.buffer = self.buffer[self.position:] + block
+        self.position = 0
+        return bool(block)
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character, or an empty
+        string at the end of the file."""
+
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        """Consumes the next character, which has to be one of some."""
+
+        character = self.peek()
+        if not character or character not in characters:
+            raise JSONDecodeError(f"Expecting one of {characters!r}",
+                                  self.buffer, self.position)
+        self.position += 1
+        return character
+
+    def value(self) -> object:
+        """Decodes the next value, reading until it's complete. Numbers cut
+        by the end of the buffer could be decoded as a shorter one, so they
+        are only complete once a delimiter follows them."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except JSONDecodeError:
+                # Reading as much as there is doubles the buffer every time,
+                # so long items aren't decoded over and over
+                if self.read(max(self.read_size, len(self.buffer))):
+                    continue
+                raise
+            if (end == len(self.buffer) or isinstance(value, (int, float))
+                    and self.buffer[end] not in DELIMITERS) and self.read():
+                continue
+            self.position = end
+            return value
+
+    def __iter__(self):
+        opening = self.expect("[{")
+        closing = "]" if opening == "[" else "}"
+        if self.peek() == closing:
+            self.position += 1
+            return
+        while True:
+            if opening == "{":
+                key = self.value()
+                self.expect(":")
+                yield key, self.value()
+            else:
+                yield self.value()
+            if self.expect("," + closing) == closing:
+                return
+
+
+def record_key(item) -> str:
+    """Returns the key of an array item, or an empty one if it has none."""
+
+    if isinstance(item, dict):
+        for field in KEY_FIELDS:
+            if field in item:
+                return str(item[field])
+    return ""
+
+
+def index_arrays() -> tuple:
+    """Returns the empty arrays of an index: block offsets and sizes, and
+    record blocks, starts and ends."""
+
+    return array("Q"), array("Q"), array("I"), array("I"), array("I")
+
+
+def little_endian(column: array) -> bytes:
+    """Returns the bytes of an index array in little-endian order."""
+
+    if SWAP_BYTES:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_packed(path: str, content) -> None:
+    """Writes a JSON array or object as a packed file. It's written aside and
+    moved in place once complete."""
+
+    if isinstance(content, dict):
+        kind, records = OBJECT, ((str(key), [key, value])
+                                 for key, value in content.items())
+    elif isinstance(content, list):
+        kind, records = ARRAY, ((record_key(item), item) for item in content)
+    else:
+        raise CorpusFormatError("Only JSON arrays and objects can be packed")
+
+    path = Path(path)
+    staged = path.with_name(f"{path.name}.tmp")
+    offsets, sizes, numbers, starts, ends = index_arrays()
+    keys, block = [], bytearray()
+
+    with open(staged, "wb") as packed_file:
+        packed_file.write(bytes(HEADER.size))
+
+        def write_block() -> None:
+            compressed = zlib.compress(bytes(block), COMPRESSION_LEVEL)
+            offsets.append(packed_file.tell())
+            sizes.append(len(compressed))
+            packed_file.write(compressed)
+            block.clear()
+
+        for key, record in records:
+            encoded = dumps(record, sort_keys=True, ensure_ascii=False,
+                            separators=(",", ":")).encode()
+            if block and len(block) + len(encoded) > BLOCK_SIZE:
+                write_block()
+            elif block:
+                block += b","
+            numbers.append(len(offsets))
+            starts.append(len(block))
+            ends.append(len(block) + len(encoded))
+            keys.append(key)
+            block += encoded
+        if block:
+            write_block()
+
+        index_offset = packed_file.tell()
+        packed_file.write(zlib.compress(
+            b"".join(little_endian(column) for column in
+                     (offsets, sizes, numbers, starts, ends)) +
+            "\0".join(keys).encode(), COMPRESSION_LEVEL))
+        index_size = packed_file.tell() - index_offset
+        packed_file.seek(0)
+        packed_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, kind, len(keys),
+                                      len(offsets), index_offset, index_size))
+    replace(staged, path)
+
+
+class PackedFile:
+    """Reads a packed file. Its header and index are read when it's opened,
+    and its blocks only when their records are needed."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        with open(self.path, "rb") as packed_file:
+            magic, version, self.kind, count, block_count, index_offset, \
+                index_size = HEADER.unpack(packed_file.read(HEADER.size))
+            if magic != MAGIC:
+                raise CorpusFormatError(f"{path} isn't a packed corpus file")
+            if version != FORMAT_VERSION:
+                raise CorpusFormatError(
+                    f"{path} has format version {version}, but only "
+                    f"{FORMAT_VERSION} can be read")
+            packed_file.seek(index_offset)
+            index = zlib.decompress(packed_file.read(index_size))
+
+        columns = index_arrays()
+        lengths = [block_count] * 2 + [count] * 3
+        bounds = list(accumulate(
+            (length * column.itemsize for length, column in
+             zip(lengths, columns)), initial=0))
+        if len(index) < bounds[-1]:
+            raise CorpusFormatError(f"{path} has a truncated index")
+        for column, start, end in zip(columns, bounds, bounds[1:]):
+            column.frombytes(index[start:end])
+            if SWAP_BYTES:
+                column.byteswap()
+        self.offsets, self.sizes, self.numbers, self.starts, self.ends = \
+            columns
+        self.positions = {}
+        if count:
+            for position, key in enumerate(
+                    index[bounds[-1]:].decode().split("\0")):
+                if key:
+                    self.positions.setdefault(key, position)
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def block(self, packed_file, number: int) -> bytes:
+        """Reads and decompresses a block from the open file."""
+
+        packed_file.seek(self.offsets[number])
+        return zlib.decompress(packed_file.read(self.sizes[number]))
+
+    def item(self, record: list) -> object:
+        """Returns a decoded record as a (key, value) tuple in objects."""
+
+        return tuple(record) if self.kind == OBJECT else record
+
+    def __iter__(self):
+        """Yields the items of the array, or the (key, value) pairs of the
+        object, decompressing a block at a time."""
+
+        with open(self.path, "rb") as packed_file:
+            for number in range(len(self.offsets)):
+                for record in loads(b"[" + self.block(packed_file, number) +
+                                    b"]"):
+                    yield self.item(record)
+
+    def get(self, key, default=None) -> object:
+        """Returns the first item with a key, or the value of a key of the
+        object, decompressing only its block."""
+
+        position = self.positions.get(str(key))
+        if position is None:
+            return default
+        with open(self.path, "rb") as packed_file:
+            record = loads(self.block(packed_file, self.numbers[position])
+                           [self.starts[position]:self.ends[position]])
+        return record[1] if self.kind == OBJECT else record
+
+    def load(self) -> object:
+        """Returns the whole array or object."""
+
+        return dict(self) if self.kind == OBJECT else list(self)
+
+
+def corpus_path(folder: str, name: str) -> Path:
+    """Returns the path of a corpus file: the packed one if there's one, or
+    else the JSON one, which may not exist either."""
+
+    packed = Path(folder) / f"{name}{PACKED_SUFFIX}"
+    return packed if packed.exists() else Path(folder) / f"{name}{JSON_SUFFIX}"
+
+
+def corpus_file_exists(folder: str, name: str) -> bool:
+    """Checks if a corpus file is stored in either format."""
+
+    return corpus_path(folder, name).exists()
+
+
+def corpus_files(folder: str) -> list:
+    """Returns the names of every corpus file of a folder, sorted."""
+
+    return sorted({path.stem for path in Path(folder).iterdir()
+                   if path.suffix in (JSON_SUFFIX, PACKED_SUFFIX)})
+
+
+def load_corpus_file(folder: str, name: str) -> object:
+    """Returns the contents of a corpus file."""
+
+    path = corpus_path(folder, name)
+    if path.suffix == PACKED_SUFFIX:
+        return PackedFile(path).load()
+    with open(path, encoding="utf-8") as json_file:
+        return load(json_file)
+
+
+def iter_corpus_file(folder: str, name: str):
+    """Yields the items of a corpus file, or its (key, value) pairs if it
+    holds an object, without decoding the whole file at once."""
+
+    path = corpus_path(folder, name)
+    if path.suffix == PACKED_SUFFIX:
+        yield from PackedFile(path)
+        return
+    with open(path, encoding="utf-8") as json_file:
+        yield from JSONStream(json_file)
+
+
+def write_corpus_file(folder: str, name: str, content,
+                      packed: bool = True) -> None:
+    """Writes a corpus file in one of the formats, and removes the file with
+    the same name in the other one so it doesn't shadow it."""
+
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    json_path = Path(folder) / f"{name}{JSON_SUFFIX}"
+    packed_path = Path(folder) / f"{name}{PACKED_SUFFIX}"
+    if packed:
+        write_packed(packed_path, content)
+        stale = json_path
+    else:
+        with open(json_path, "w", encoding="utf-8") as json_file:
+            dump(content, json_file, sort_keys=True, indent=4,
+                 separators=(",", ": "))
+        stale = packed_path
+    if stale.exists():
+        stale.unlink()
+
+
+def convert_corpus(source: str, target: str, packed: bool = True) -> int:
+    """Converts every file of every language folder of a corpus to one of
+    the formats, writing them into another folder, or the same one, with
+    the same layout. Returns the number of converted files."""
+
+    converted = 0
+    for language in sorted(path.name for path in Path(source).iterdir()
+                           if path.is_dir()):
+        for name in corpus_files(f"{source}/{language}"):
+            write_corpus_file(f"{target}/{language}", name,
+                              load_corpus_file(f"{source}/{language}", name),
+                              packed)
+            converted += 1
+    return converted
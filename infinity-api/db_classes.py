@@ -1,9 +1,55 @@
 from peewee import SqliteDatabase, Model, CharField, BooleanField, \
-    IntegerField, ForeignKeyField, FloatField
+    IntegerField, ForeignKeyField, FloatField, CompositeKey, BlobField
+from sqlite3 import sqlite_version_info
+from weakref import WeakSet
 
 
+# Pragmas for bulk loads: durability is traded for speed, since a failed
+# build is simply run again.
+IMPORT_PRAGMAS = {"journal_mode": "wal", "synchronous": 0,
+                  "cache_size": -256 * 1024, "temp_store": "memory"}
+
+# Pragmas for read-only serving: the file is memory mapped and writes are
+# rejected.
+SERVING_PRAGMAS = {"mmap_size": 256 * 1024 * 1024, "cache_size": -64 * 1024,
+                   "temp_store": "memory", "query_only": 1}
+
+# SQLite versions before 3.32 only allow 999 bound variables per statement
+MAX_VARIABLES = 32766 if sqlite_version_info >= (3, 32, 0) else 999
+
 db = SqliteDatabase("infinity.db")
 
+# Caches of the catalogue in this process, told whenever a version is bumped.
+# Each one needs a version_bumped(database) method.
+version_listeners = WeakSet()
+
+
+def use_pragmas(database: SqliteDatabase, pragmas: dict) -> None:
+    """Sets the pragmas applied to every new connection of a database. Any open
+    connection of the calling thread is closed so the new ones apply."""
+
+    if not database.is_closed():
+        database.close()
+    database.init(database.database, pragmas=pragmas)
+
+
+def catalogue_version(database: SqliteDatabase) -> int:
+    """Returns the version of the catalogue stored in a database, which every
+    build or sync that changes it increases."""
+
+    return database.pragma("user_version")
+
+
+def bump_catalogue_version(database: SqliteDatabase) -> int:
+    """Increases the catalogue version of a database and returns it, telling
+    the version listeners."""
+
+    version = catalogue_version(database) + 1
+    database.pragma("user_version", version)
+    for listener in list(version_listeners):
+        listener.version_bumped(database)
+    return version
+
 
 class BaseModel(Model):
 
@@ -12,12 +58,22 @@ class BaseModel(Model):
 
 
 class String(BaseModel):
-    """This class stores all the strings in their respective languages."""
+    """This class stores the ID of every string, whose text in each language
+    is kept in Translation."""
 
     string_id = CharField(primary_key=True)
-    spanish = CharField(null=True)
-    english = CharField(null=True)
-    french = CharField(null=True)
+
+
+class Translation(BaseModel):
+    """This class stores the text of every string in every language found in
+    the JSON folder, keyed by the folder name of the language (ENG, ESP...)."""
+
+    string = ForeignKeyField(String, backref="translations", index=False)
+    language = CharField()
+    text = CharField()
+
+    class Meta:
+        primary_key = CompositeKey("string", "language")
 
 
 class Ammo(BaseModel):
@@ -76,7 +132,7 @@ class Profile(BaseModel):
     """This class stores all the profiles of each unit."""
 
     profile_id = IntegerField(primary_key=True)
-    unit_id = IntegerField()
+    unit_id = IntegerField(index=True)
     cap = FloatField()
     point_cost = IntegerField()
     name = ForeignKeyField(String)
@@ -97,6 +153,16 @@ class Weapon(BaseModel):
     medium_range = CharField(null=True)
     long_range = CharField(null=True)
     maximum_range = CharField(null=True)
+    short_modifier = IntegerField(null=True)
+    short_distance = IntegerField(null=True)
+    medium_modifier = IntegerField(null=True)
+    medium_distance = IntegerField(null=True)
+    long_modifier = IntegerField(null=True)
+    long_distance = IntegerField(null=True)
+    maximum_modifier = IntegerField(null=True)
+    maximum_distance = IntegerField(null=True)
+    # Modifier at every distance, from 0 to the longest range, as signed bytes
+    range_modifiers = BlobField(null=True)
     ammo = ForeignKeyField(Ammo, null=True, backref="weapon_ammo")
     burst_melee = IntegerField(null=True)
     burst_range = IntegerField(null=True)
@@ -114,52 +180,140 @@ class ProfileWeapon(BaseModel):
     """This class stores the relations between an unit profile and
     all the weapons that profile has available."""
 
-    profile = ForeignKeyField(Profile)
-    weapon = ForeignKeyField(Weapon)
+    profile = ForeignKeyField(Profile, index=False)
+    weapon = ForeignKeyField(Weapon, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("profile", "weapon"), True),
+            (("weapon", "profile"), True))
 
 
 class WeaponProperty(BaseModel):
     """This class stores the relations between a weapon and
      all of it's properties."""
 
-    weapon = ForeignKeyField(Weapon)
-    weapon_property = ForeignKeyField(Property)
+    weapon = ForeignKeyField(Weapon, index=False)
+    weapon_property = ForeignKeyField(Property, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("weapon", "weapon_property"), True),
+            (("weapon_property", "weapon"), True))
 
 
 class ProfileCharacteristic(BaseModel):
     """This class stores the relations between an unit profile and
         all the characteristics that profile adds."""
 
-    profile = ForeignKeyField(Profile)
-    characteristic = ForeignKeyField(Characteristic)
+    profile = ForeignKeyField(Profile, index=False)
+    characteristic = ForeignKeyField(Characteristic, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("profile", "characteristic"), True),
+            (("characteristic", "profile"), True))
 
 
 class ProfileAbility(BaseModel):
     """This class stores the relations between an unit profile and
         all the abilities that profile adds."""
 
-    profile = ForeignKeyField(Profile)
-    ability = ForeignKeyField(Ability)
+    profile = ForeignKeyField(Profile, index=False)
+    ability = ForeignKeyField(Ability, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("profile", "ability"), True),
+            (("ability", "profile"), True))
 
 
 class UnitProfile(BaseModel):
     """This class stores the relations between an unit and all the profiles
     that unit has."""
 
-    unit = ForeignKeyField(Unit)
-    profile = ForeignKeyField(Profile)
+    unit = ForeignKeyField(Unit, index=False)
+    profile = ForeignKeyField(Profile, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("unit", "profile"), True),
+            (("profile", "unit"), True))
 
 
 class UnitCharacteristic(BaseModel):
     """This class stores the relations between an unit and all the
     characteristics that unit has."""
 
-    unit = ForeignKeyField(Unit)
-    characteristic = ForeignKeyField(Characteristic)
+    unit = ForeignKeyField(Unit, index=False)
+    characteristic = ForeignKeyField(Characteristic, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("unit", "characteristic"), True),
+            (("characteristic", "unit"), True))
 
 
 class UnitAbility(BaseModel):
     """This class stores the relations between an unit and all the abilities 
     that unit has."""
-    unit = ForeignKeyField(Unit)
-    ability = ForeignKeyField(Ability)
+
+    unit = ForeignKeyField(Unit, index=False)
+    ability = ForeignKeyField(Ability, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("unit", "ability"), True),
+            (("ability", "unit"), True))
+
+
+class UnitSectorial(BaseModel):
+    """This class stores the relations between an unit and all the sectorials
+    and factions that unit is available in."""
+
+    unit = ForeignKeyField(Unit, index=False)
+    sectorial = ForeignKeyField(Sectorial, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("unit", "sectorial"), True),
+            (("sectorial", "unit"), True))
+
+
+class WeaponAncestry(BaseModel):
+    """This class stores the closure of the weapon inheritance: every weapon
+    along with itself and each of its ancestors, and how many parents away
+    the ancestor is."""
+
+    weapon = ForeignKeyField(Weapon, index=False)
+    ancestor = ForeignKeyField(Weapon, index=False)
+    depth = IntegerField()
+
+    class Meta:
+        # Ancestors are read in order with a covering index, and descendants
+        # with the reverse one
+        indexes = (
+            (("weapon", "depth", "ancestor"), True),
+            (("ancestor", "weapon"), True))
+
+
+class WeaponInheritedProperty(BaseModel):
+    """This class stores the relations between a weapon and all the
+    properties it has or inherits from its ancestors."""
+
+    weapon = ForeignKeyField(Weapon, index=False)
+    weapon_property = ForeignKeyField(Property, index=False)
+
+    class Meta:
+        # Each pair is unique, and both directions have a covering index
+        indexes = (
+            (("weapon", "weapon_property"), True),
+            (("weapon_property", "weapon"), True))
@@ -1,431 +1,473 @@
-from db_classes import db, Unit, Weapon, Ammo, Ability, Characteristic, \
+from db_classes import Unit, Weapon, Ammo, Ability, Characteristic, \
     Sectorial, Profile, String, WeaponProperty, Property, ProfileWeapon, \
     ProfileCharacteristic, ProfileAbility, UnitProfile, UnitCharacteristic, \
-    UnitAbility
-from peewee import SqliteDatabase
-from json import load
-from os import listdir
+    UnitAbility, UnitSectorial, Translation, WeaponAncestry, \
+    WeaponInheritedProperty, IMPORT_PRAGMAS, MAX_VARIABLES, \
+    bump_catalogue_version
+from peewee import SqliteDatabase, Model, chunked
+from contextlib import contextmanager
+from typing import Callable
 from collections import defaultdict
-from fetcher import fetch_json
-from re import findall
-
-
-def generate_db(db: SqliteDatabase) -> None:
-    """Generates all the database tables."""
-    with db as open_db:
-        open_db.create_tables(
-            [Unit, Weapon, Ammo, Ability, Characteristic, Sectorial, Profile,
-             String, Property, WeaponProperty, ProfileWeapon,
-             ProfileCharacteristic, ProfileAbility, UnitProfile,
-             UnitCharacteristic, UnitAbility])
-
-
-def populate_ammo() -> None:
+from corpus import Corpus
+from key_map import KeyMap
+from localization import materialize_names
+from search import refresh_search_index
+from normalization import calculate_burst, validate_range, parse_range, \
+    range_lookup, ancestry, UNIT_ATTRIBUTES, RANGE_BANDS
+from instrumentation import Metrics
+
+
+MODELS = (Unit, Weapon, Ammo, Ability, Characteristic, Sectorial, Profile,
+          String, Translation, Property, WeaponProperty, ProfileWeapon,
+          ProfileCharacteristic, ProfileAbility, UnitProfile,
+          UnitCharacteristic, UnitAbility, UnitSectorial, WeaponAncestry,
+          WeaponInheritedProperty)
+
+
+def generate_db(db: SqliteDatabase, indexes: bool = True) -> None:
+    """Generates all the database tables. Without indexes, only the tables
+    are created, and create_indexes has to be called once they are loaded."""
+    with db:
+        for model in MODELS:
+            model._schema.create_table(safe=True)
+            if indexes:
+                model._schema.create_indexes(safe=True)
+
+
+def create_indexes(db: SqliteDatabase) -> None:
+    """Creates the indexes of every table, skipping the existing ones."""
+    with db:
+        for model in MODELS:
+            model._schema.create_indexes(safe=True)
+
+
+@contextmanager
+def import_mode(db: SqliteDatabase, pragmas: dict = IMPORT_PRAGMAS):
+    """Applies the import pragmas for the duration of a bulk load. Afterwards
+    the write-ahead log is merged back into the database file, which is
+    switched back to a rollback journal with full durability."""
+
+    # The journal mode can't be changed inside a transaction, so the
+    # connection is opened without the implicit one "with db" starts.
+    with db.connection_context():
+        for pragma, value in pragmas.items():
+            db.pragma(pragma, value)
+        try:
+            yield db
+        finally:
+            db.pragma("wal_checkpoint", "truncate")
+            db.pragma("journal_mode", "delete")
+            db.pragma("synchronous", "full")
+
+
+def bulk_insert(model: Model, rows: list) -> int:
+    """Inserts a list of row dicts in chunks inside a single transaction.
+    Rows that clash with an existing one are skipped, just like get_or_create
+    would, but without reading the table first. Returns the number of rows
+    actually inserted."""
+
+    if not rows:
+        return 0
+
+    database, inserted = model._meta.database, 0
+    batch_size = max(1, MAX_VARIABLES // len(rows[0]))
+    with database.atomic():
+        for batch in chunked(rows, batch_size):
+            inserted += database.execute(
+                model.insert_many(batch).on_conflict_ignore()).rowcount
+    return inserted
+
+
+def link_rows(first: str, second: str, pairs: set) -> list:
+    """Turns a set of pairs into the rows of a link table, in a stable order."""
+
+    return [{first: left, second: right} for left, right in sorted(pairs)]
+
+
+def populate_ammo(corpus: Corpus, keys: KeyMap,
+                  write: Callable = bulk_insert) -> None:
     """Populates the ammo types in it's database table."""
 
-    ammo_dict = defaultdict(dict)
+    ammo_dict = corpus.names("ammo")
 
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_MUNICION.json") as ammo_file:
-            for item in load(ammo_file):
-                ammo_dict[item["id"]][language] = item["nombre"]
-
-    populate_strings("ammo", ammo_dict)
+    populate_strings("ammo", ammo_dict, keys, write)
 
     print("Generating DB Ammo entries...", end=" ")
 
-    for ammo in ammo_dict.keys():
-        Ammo.get_or_create(ammo_id=ammo, name=String.get_by_id(
-            f"ammo_{ammo}"))
+    rows = [{"ammo_id": keys.register(Ammo, ammo), "name": keys.resolve(
+        String, f"ammo_{ammo}", f"Ammo {ammo}")} for ammo in ammo_dict.keys()]
+    keys.check()
+    write(Ammo, rows)
 
     print("Done.")
 
 
-def populate_strings(id_prefix: str, string_dict: tuple) -> None:
+def populate_strings(id_prefix: str, string_dict: tuple, keys: KeyMap,
+                     write: Callable = bulk_insert) -> None:
     """Generates the strings in the database. It needs a dict of dicts,
     with the key of each dict being the string id in the database,
     and the values being the strings in each language.
-    The key of each language has to be the three initials (ENG, ESP, FRA...)"""
-
-    # TODO: Make language recognition automated rather than hardcoded
+    The key of each language is the name of its folder (ENG, ESP, FRA...),
+    and every language gets a Translation."""
 
     print(f"Generating DB String entries for {id_prefix}...", end=" ")
 
-    for string_id, strings in string_dict.items():
+    write(String, [
+        {"string_id": keys.register(String, f"{id_prefix}_{string_id}")}
+        for string_id in string_dict.keys()])
 
-        String.get_or_create(
-            string_id=f"{id_prefix}_{string_id}",
-            english=strings["ENG"] if "ENG" in strings.keys() else None,
-            spanish=strings["ESP"] if "ESP" in strings.keys() else None,
-            french=strings["FRA"] if "FRA" in strings.keys() else None)
+    write(Translation, [
+        {"string": f"{id_prefix}_{string_id}", "language": language,
+         "text": text}
+        for string_id, strings in string_dict.items()
+        for language, text in sorted(strings.items()) if text is not None])
 
     print("Done.")
 
 
-def populate_units() -> None:
+def populate_units(corpus: Corpus, keys: KeyMap,
+                   write: Callable = bulk_insert) -> None:
     """Populates the database with the units and their profiles."""
 
-    strings = defaultdict(dict)
+    populate_unit_profiles(corpus, keys, write)
 
-    # 901 sectorial is an outlier that makes everything harder since it doesn't
-    # follow any structure, so we blacklist it.
-    sectorials = [item.sectorial_id for item in Sectorial.select()
-                  if item.sectorial_id != 901]
+    populate_strings("unit", corpus.names("unit"), keys, write)
 
-    populate_unit_profiles()
+    print("Generating DB Unit entries...", end=" ")
 
-    for language in listdir("JSON"):
-        for sectorial in sectorials:
-            with open(f"JSON/{language}/{sectorial}.json") as sectorial_json:
-                for unit in load(sectorial_json):
-                    for profile in unit["perfiles"]:
-                        unit_id = int(profile["id"])
-                        strings[unit_id][language] = profile["nombre"]
+    units, unit_profiles, unit_sectorials = {}, set(), set()
+    unit_characteristics, unit_abilities = set(), set()
 
-    populate_strings("unit", strings)
+    for sectorial, unit_rows, _, _ in corpus.sectorial_rows:
+        for unit_id, army_id, attributes, characteristic_ids, ability_ids \
+                in unit_rows:
+            unit_dict = unit_row(sectorial, unit_id, army_id, attributes,
+                                 keys.resolve(String, f"unit_{unit_id}",
+                                              f"Unit {unit_id}"))
 
-    print("Generating DB Unit entries...", end=" ")
+            if unit_id not in units:
+                units[unit_id] = unit_dict
+                keys.register(Unit, unit_id)
 
-    for sectorial in sectorials:
-        file_path = f"JSON/{listdir('JSON')[0]}/{sectorial}.json"
-        with open(file_path) as sectorial_json:
-            for unit in load(sectorial_json):
-                for profile in unit["perfiles"]:
-                    unit_id = int(profile["id"])
-                    unit_dict = {
-                        "unit_id": unit_id,
-                        "name": String.get_by_id(f"unit_{unit_id}"),
-                        "mov_1": int(profile["atributos"]["MOV1"]),
-                        "mov_2": int(profile["atributos"]["MOV2"]),
-                        "close_combat": int(profile["atributos"]["CC"]),
-                        "ballistic_skill": int(profile["atributos"]["CD"]),
-                        "phisique": int(profile["atributos"]["FIS"]),
-                        "willpower": int(profile["atributos"]["VOL"]),
-                        "armor": int(profile["atributos"]["BLI"]),
-                        "bts": int(profile["atributos"]["PB"]),
-                        "wounds": int(profile["atributos"]["H"]),
-                        "silhouette": int(profile["atributos"]["S"]),
-                        "availability": int(profile["atributos"]["Disp"]),
-                        "has_structure": bool(int(profile["atributos"]["EST"])),
-                        # TODO: Fix svg_icon to work with non-first profiles
-                        "svg_icon": f"https://assets.infinitythegame.net/infinityarmy/img/logos/logos_{sectorial}/logo_{unit['IDArmy']}.svg"
-                    }
-
-                    unit_item = Unit.get_or_create(**unit_dict)[0]
-
-                    for profile_item in Profile.select().where(Profile.unit_id == unit_id):
-                        UnitProfile.get_or_create(
-                            unit=unit_item, profile=profile_item)
-
-                    for characteristic_id in strip_separators(
-                            profile["caracteristicas"]):
-
-                        UnitCharacteristic.get_or_create(
-                            unit=unit_item,
-                            characteristic=Characteristic.get_by_id(
-                                characteristic_id))
-
-                    for ability_id in strip_separators(
-                            profile["equipo_habs"]):
-
-                        UnitAbility.get_or_create(
-                            unit=unit_item, ability=Ability.get_by_id(
-                                ability_id))
+            for profile_id in keys.profiles_by_unit[unit_id]:
+                unit_profiles.add((unit_id, profile_id))
 
-    print("Done.")
+            unit_sectorials.add((unit_id, keys.resolve(
+                Sectorial, sectorial, f"Unit {unit_id}")))
 
+            for characteristic_id in characteristic_ids:
+                unit_characteristics.add((unit_id, keys.resolve(
+                    Characteristic, characteristic_id, f"Unit {unit_id}")))
 
-def populate_unit_profiles() -> None:
-    """Populates each unit profile in the database."""
+            for ability_id in ability_ids:
+                unit_abilities.add((unit_id, keys.resolve(
+                    Ability, ability_id, f"Unit {unit_id}")))
 
-    strings = defaultdict(dict)
+    keys.check()
+    write(Unit, list(units.values()))
+    write(UnitProfile, link_rows("unit", "profile", unit_profiles))
+    write(UnitSectorial, link_rows("unit", "sectorial", unit_sectorials))
+    write(UnitCharacteristic, link_rows(
+        "unit", "characteristic", unit_characteristics))
+    write(UnitAbility, link_rows("unit", "ability", unit_abilities))
 
-    # 901 sectorial is an outlier that makes everything harder since it doesn't
-    # follow any structure, so we blacklist it.
-    sectorials = [item.sectorial_id for item in Sectorial.select()
-                  if item.sectorial_id != 901]
+    print("Done.")
 
-    for language in listdir("JSON"):
-        for sectorial in sectorials:
-            with open(f"JSON/{language}/{sectorial}.json") as sectorial_json:
-                for unit in load(sectorial_json):
-                    for unit_profile in unit["perfiles"]:
-                        for profile in unit_profile["opciones"]:
-                            profile_id = int(profile["id"])
-                            strings[profile_id][language] = profile["nombre"]
 
-    populate_strings("profile", strings)
+def unit_row(sectorial: int, unit_id: int, army_id: str, attributes: tuple,
+             name: str) -> dict:
+    """Returns the Unit row of a normalized unit row of a sectorial."""
 
-    print("Generating DB Profile entries...", end=" ")
+    unit_dict = dict(zip((field for field, _ in UNIT_ATTRIBUTES), attributes))
+    unit_dict.update({
+        "unit_id": unit_id,
+        "name": name,
+        "has_structure": bool(unit_dict["has_structure"]),
+        # TODO: Fix svg_icon to work with non-first profiles
+        "svg_icon": "https://assets.infinitythegame.net/infinityarmy/img/"
+                    f"logos/logos_{sectorial}/logo_{army_id}.svg"})
+    return unit_dict
 
-    for sectorial in sectorials:
-        file_path = f"JSON/{listdir('JSON')[0]}/{sectorial}.json"
-        with open(file_path) as sectorial_json:
-            for unit in load(sectorial_json):
-                for unit_profile in unit["perfiles"]:
-                    for profile in unit_profile["opciones"]:
-                        profile_id = int(profile["id"])
-                        reg, irreg, impetuous = get_orders(profile["ordenes"])
-                        profile_dict = {
-                            "profile_id": profile_id,
-                            "name": String.get_by_id(
-                                f"profile_{int(profile['id'])}"),
-                            "unit_id": int(profile["idPerfil"]),
-                            "cap": float(profile["CAP"])
-                            if profile["CAP"].replace("-", "") else 0.,
-                            "point_cost": int(profile["puntos"]),
-                            "regular_orders": reg,
-                            "irregular_orders": irreg,
-                            "impetuous_orders": impetuous}
-
-                        profile_item = Profile.get_or_create(**profile_dict)[0]
-
-                        for weapon_id in strip_separators(profile["armas"]):
-                            ProfileWeapon.get_or_create(
-                                weapon=Weapon.get_by_id(weapon_id),
-                                profile=profile_item)
-
-                        for characteristic_id in strip_separators(
-                                profile["caracteristicas"]):
-
-                            ProfileCharacteristic.get_or_create(
-                                characteristic=Characteristic.get_by_id(
-                                    characteristic_id), profile=profile_item)
-
-                        for ability_id in strip_separators(profile["extra"]):
-
-                            ProfileAbility.get_or_create(
-                                ability=Ability.get_by_id(ability_id),
-                                profile=profile_item)
 
-    print("Done.")
+def profile_row(profile_id: int, unit_id: int, cap: float, points: int,
+                reg: int, irreg: int, impetuous: int, name: str) -> dict:
+    """Returns the Profile row of a normalized profile row."""
 
+    return {"profile_id": profile_id,
+            "name": name,
+            "unit_id": unit_id,
+            "cap": cap,
+            "point_cost": points,
+            "regular_orders": reg,
+            "irregular_orders": irreg,
+            "impetuous_orders": impetuous}
 
-def strip_separators(raw_string: str, separator: str = "|") -> tuple:
-    """Given a string with numerical values separated by separators, 
-    it returns a tuple with it's contents."""
 
-    # TODO: Remove extra replace due to some scenarios where multiple
-    # separators are being used at once
-    return tuple(
-        int(value) for value in findall(r"(\d+)", raw_string)
-        if raw_string.strip("|"))
+def populate_unit_profiles(corpus: Corpus, keys: KeyMap,
+                           write: Callable = bulk_insert) -> None:
+    """Populates each unit profile in the database."""
 
+    populate_strings("profile", corpus.names("profile"), keys, write)
 
-def get_orders(raw_orders: str) -> tuple:
-    """Returns a tuple with the orders of an unit. They are, from left to right,
-    the regular, irregular, and impetuous orders."""
+    print("Generating DB Profile entries...", end=" ")
 
-    orders = [int(order) if int(order) else None
-              for order in raw_orders.split("%")]
+    profiles, profile_weapons = {}, set()
+    profile_characteristics, profile_abilities = set(), set()
+
+    for _, _, profile_rows, _ in corpus.sectorial_rows:
+        for profile_id, unit_id, cap, points, reg, irreg, impetuous, \
+                weapon_ids, characteristic_ids, ability_ids in profile_rows:
+            profile_dict = profile_row(
+                profile_id, unit_id, cap, points, reg, irreg, impetuous,
+                keys.resolve(String, f"profile_{profile_id}",
+                             f"Profile {profile_id}"))
+
+            if profile_id not in profiles:
+                profiles[profile_id] = profile_dict
+                keys.register(Profile, profile_id)
+                keys.profiles_by_unit[unit_id].append(profile_id)
+
+            for weapon_id in weapon_ids:
+                profile_weapons.add((profile_id, keys.resolve(
+                    Weapon, weapon_id, f"Profile {profile_id}")))
+
+            for characteristic_id in characteristic_ids:
+                profile_characteristics.add((profile_id, keys.resolve(
+                    Characteristic, characteristic_id, f"Profile {profile_id}")))
+
+            for ability_id in ability_ids:
+                profile_abilities.add((profile_id, keys.resolve(
+                    Ability, ability_id, f"Profile {profile_id}")))
+
+    keys.check()
+    write(Profile, list(profiles.values()))
+    write(ProfileWeapon, link_rows(
+        "profile", "weapon", profile_weapons))
+    write(ProfileCharacteristic, link_rows(
+        "profile", "characteristic", profile_characteristics))
+    write(ProfileAbility, link_rows(
+        "profile", "ability", profile_abilities))
 
-    return orders[0], orders[1], orders[2]
+    print("Done.")
 
 
-def populate_sectorials() -> None:
+def populate_sectorials(corpus: Corpus, keys: KeyMap,
+                        write: Callable = bulk_insert) -> None:
     """Populates the database with the sectorials and their respective ID's."""
 
-    sectorial_dict = defaultdict(dict)
-
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_SECTORIAL_NOMBRE.json") as ammo_file:
-            for sectorial, name in load(ammo_file)["nombresSectorial"].items():
-                sectorial_dict[int(sectorial.lstrip(
-                    "idSectorial_"))][language] = name
+    sectorial_dict = corpus.names("sectorial")
 
-    populate_strings("sectorial", sectorial_dict)
+    populate_strings("sectorial", sectorial_dict, keys, write)
 
     print("Generating DB Sectorial entries...", end=" ")
 
-    for sectorial in sectorial_dict.keys():
-        Sectorial.get_or_create(
-            sectorial_id=sectorial, name=String.get_by_id(
-                f"sectorial_{sectorial}"),
-            is_faction=True if sectorial % 100 == 1 else False)
+    rows = [{"sectorial_id": keys.register(Sectorial, sectorial),
+             "name": keys.resolve(String, f"sectorial_{sectorial}",
+                                  f"Sectorial {sectorial}"),
+             "is_faction": True if sectorial % 100 == 1 else False}
+            for sectorial in sectorial_dict.keys()]
+    keys.check()
+    write(Sectorial, rows)
 
     print("Done.")
 
 
-def populate_weapons() -> None:
-    """Populates the weapons and weapon characteristic tables."""
+def populate_weapons(corpus: Corpus, keys: KeyMap,
+                     write: Callable = bulk_insert) -> None:
+    """Populates the weapons and weapon characteristic tables, along with the
+    closure of the weapon inheritance and the properties every weapon
+    inherits. Inheritance cycles stop the build."""
 
-    populate_properties()
+    populate_properties(corpus, keys, write)
 
-    weapon_dict = defaultdict(dict)
+    populate_strings("weapon", corpus.names("weapon"), keys, write)
+    populate_strings("weapon_wiki", corpus.names("weapon_wiki"), keys, write)
 
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_ARMAS.json") as weapon_file:
-            for weapon in load(weapon_file):
-                weapon_dict[int(weapon["id"])
-                            ][language] = weapon["nombre_completo"]
-
-    populate_strings("weapon", weapon_dict)
+    print("Generating DB Weapon entries...", end=" ")
 
-    weapon_wiki_dict = defaultdict(dict)
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_ARMAS_WIKI_URLS.json") as weapon_wiki:
-            for weapon_id, weapon_wiki_link in load(weapon_wiki).items():
-                weapon_wiki_dict[int(weapon_id)][language] = weapon_wiki_link
+    weapons, weapon_properties = {}, set()
+
+    # Every weapon is registered first so parents can be resolved in any order
+    for weapon_id in corpus.weapons_by_id.keys():
+        keys.register(Weapon, weapon_id)
+
+    for weapon_id, weapon in corpus.weapons_by_id.items():
+        weapons[weapon_id] = weapon_row(
+            weapon_id, weapon,
+            keys.resolve(String, f"weapon_{weapon_id}", f"Weapon {weapon_id}"),
+            keys.resolve(Ammo, weapon["idMunicion"], f"Weapon {weapon_id}")
+            if int(weapon["idMunicion"]) else None,
+            keys.resolve(Weapon, weapon["parent"], f"Weapon {weapon_id}")
+            if int(weapon["parent"]) else None)
+
+        properties = [int(prop_id)
+                      for prop_id in weapon["propiedades"].split("|")
+                      if weapon["propiedades"]]
+        for property_id in properties:
+            weapon_properties.add((weapon_id, keys.resolve(
+                Property, property_id, f"Weapon {weapon_id}")))
+
+    keys.check()
+    chains = ancestry({weapon_id: weapon["parent_weapon"]
+                       for weapon_id, weapon in weapons.items()})
+    properties_by_weapon = defaultdict(set)
+    for weapon_id, property_id in weapon_properties:
+        properties_by_weapon[weapon_id].add(property_id)
+
+    write(Weapon, list(weapons.values()))
+    write(WeaponProperty, link_rows(
+        "weapon", "weapon_property", weapon_properties))
+    write(WeaponAncestry, [
+        {"weapon": weapon_id, "ancestor": ancestor, "depth": depth}
+        for weapon_id, chain in sorted(chains.items())
+        for depth, ancestor in enumerate(chain)])
+    write(WeaponInheritedProperty, link_rows(
+        "weapon", "weapon_property",
+        {(weapon_id, property_id) for weapon_id, chain in chains.items()
+         for ancestor in chain for property_id in properties_by_weapon[ancestor]}))
 
-    populate_strings("weapon_wiki", weapon_wiki_dict)
+    print("Done.")
 
-    print("Generating DB Weapon entries...", end=" ")
 
-    with open(f"JSON/{listdir('JSON')[0]}/JSON_ARMAS.json") as weapon_file:
-        # This has to be sorted, otherwise it may attempt to generate weapons
-        # with a parent that hasn't been generated yet
-        for weapon in sorted(load(weapon_file), key=lambda x: x["parent"]):
-            burst_range, burst_melee = calculate_burst(weapon)
-            weapon_stats = {
-                "weapon_id": int(weapon["id"]),
-                # TODO: Correct damage language by using JSON_ATRIBUTOS_ROT
-                "damage": weapon["dano"],
-                "name": String.get_by_id(f"weapon_{weapon['id']}"),
-                "is_melee": True if weapon["CC"] == "1" else False,
-                "short_range": validate_range(weapon["corta"]),
-                "medium_range": validate_range(weapon["media"]),
-                "long_range": validate_range(weapon["larga"]),
-                "maximum_range": validate_range(weapon["maxima"]),
-                "ammo": Ammo.get_by_id(int(weapon["idMunicion"]))
-                if int(weapon["idMunicion"]) else None,
-                "burst_range": burst_range,
-                "burst_melee": burst_melee,
-                "parent_weapon": Weapon.get_by_id(int(weapon["parent"]))
-                if int(weapon["parent"]) else None}
-            db_weapon = Weapon.get_or_create(**weapon_stats)
-
-            properties = [int(prop_id)
-                          for prop_id in weapon["propiedades"].split("|")
-                          if weapon["propiedades"]]
-            for property_id in properties:
-                WeaponProperty.get_or_create(
-                    weapon=db_weapon[0],
-                    weapon_property=Property.get_by_id(property_id))
-
-        print("Done.")
-
-
-def calculate_burst(weapon: dict) -> tuple:
-    """Get the burst values of a weapon depending if it's melee, ranged or both.
-    The first value is the ranged burst, while the second one is the CC burst.
-    If the weapon only has one type of burst, the other one will be None."""
-
-    burst = weapon["rafaga"]
-
-    if "(" in burst:
-        return tuple(int(char) for char in burst if char.isdigit())
-    if not [char for char in burst if char.isdigit()]:
-        return None, None
-    return (int(burst), None) if not int(weapon["CC"]) else (None, int(burst))
-
-
-def validate_range(weapon_range: str) -> str:
-    """Given a weapon value range, it checks if it's a valid range or not.
-     If it isn't, this returns Null."""
-
-    return weapon_range.replace("|", ",") if "|" in weapon_range else None
-
-
-def populate_properties() -> None:
+def weapon_row(weapon_id: int, weapon: dict, name: str, ammo: int,
+               parent_weapon: int) -> dict:
+    """Returns the Weapon row of a raw weapon, with its range bands parsed."""
+
+    burst_range, burst_melee = calculate_burst(weapon)
+    weapon_stats = {
+        "weapon_id": weapon_id,
+        # TODO: Correct damage language by using JSON_ATRIBUTOS_ROT
+        "damage": weapon["dano"],
+        "name": name,
+        "is_melee": True if weapon["CC"] == "1" else False,
+        "short_range": validate_range(weapon["corta"]),
+        "medium_range": validate_range(weapon["media"]),
+        "long_range": validate_range(weapon["larga"]),
+        "maximum_range": validate_range(weapon["maxima"]),
+        "ammo": ammo,
+        "burst_range": burst_range,
+        "burst_melee": burst_melee,
+        "parent_weapon": parent_weapon}
+
+    bands = [parse_range(weapon[raw_band]) for _, raw_band in RANGE_BANDS]
+    for (band, _), (modifier, distance) in zip(RANGE_BANDS, bands):
+        weapon_stats[f"{band}_modifier"] = modifier
+        weapon_stats[f"{band}_distance"] = distance
+    weapon_stats["range_modifiers"] = range_lookup(bands) or None
+    return weapon_stats
+
+
+def populate_properties(corpus: Corpus, keys: KeyMap,
+                        write: Callable = bulk_insert) -> None:
     """Based on the local weapons JSON, extracts all the weapon properties
     and populates the database with them.."""
 
-    weapon_properties = defaultdict(dict)
-
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_ARMAS.json") as weapon_file:
-            for weapon in load(weapon_file):
-                for property_id, property_name in zip(
-                    [int(identifier or -1)
-                     for identifier in weapon["propiedades"].split("|")],
-                        weapon["lista_propiedades"].split("|")):
-                    if property_id != -1:
-                        weapon_properties[property_id][language] = property_name
+    weapon_properties = corpus.names("weapon_property")
 
-    populate_strings("weapon_property", weapon_properties)
+    populate_strings("weapon_property", weapon_properties, keys, write)
 
     print("Generating DB Property entries...", end=" ")
 
-    for property_id in weapon_properties.keys():
-        Property.get_or_create(
-            weapon_property_id=property_id, name=String.get_by_id(
-                f"weapon_property_{property_id}"))
+    rows = [{"weapon_property_id": keys.register(Property, property_id),
+             "name": keys.resolve(String, f"weapon_property_{property_id}",
+                                  f"Property {property_id}")}
+            for property_id in weapon_properties.keys()]
+    keys.check()
+    write(Property, rows)
 
     print("Done.")
 
 
-def populate_abilities() -> None:
+def populate_abilities(corpus: Corpus, keys: KeyMap,
+                       write: Callable = bulk_insert) -> None:
     """Populates the database with the list of abilities."""
 
-    abilities = defaultdict(dict)
-    wiki_links = defaultdict(dict)
+    populate_strings("ability", corpus.names("ability"), keys, write)
+    populate_strings("ability_wiki", corpus.names("ability_wiki"), keys, write)
 
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_HABILIDADES.json") as abilities_file:
-            for ability in load(abilities_file):
-                abilities[ability["id"]][language] = ability["nombre"]
-
-    populate_strings("ability", abilities)
-
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_HABS_WIKI_URLS.json") as wiki_file:
-            for ability_id, name in load(wiki_file).items():
-                wiki_links[int(ability_id)][language] = name
+    print("Generating DB Ability entries...", end=" ")
 
-    populate_strings("ability_wiki", wiki_links)
+    ability_rows = {}
 
-    print("Generating DB Ability entries...", end=" ")
+    for ability in corpus.abilities_by_id.values():
+        ability_id = int(ability["id"])
+        ability_breakdown = {
+            "ability_id": keys.register(Ability, ability_id),
+            "name": keys.resolve(
+                String, f"ability_{ability_id}", f"Ability {ability_id}"),
+            "is_item": bool(int(ability["equipo"])),
+            "wiki_url": keys.get(String, f"ability_wiki_{ability_id}")}
 
-    with open(f"JSON/{listdir('JSON')[0]}/JSON_HABILIDADES.json") as skill_file:
-        for ability in load(skill_file):
-            ability_id = int(ability["id"])
-            ability_breakdown = {
-                "ability_id": ability_id, "name": String.get_by_id(
-                    f"ability_{ability_id}"),
-                "is_item": bool(int(ability["equipo"])),
-                "wiki_url": String.get_or_none(
-                    String.string_id == f"ability_wiki_{ability_id}")}
+        ability_rows.setdefault(ability_id, ability_breakdown)
 
-            Ability.get_or_create(**ability_breakdown)
+    keys.check()
+    write(Ability, list(ability_rows.values()))
 
     print("Done.")
 
 
-def populate_characteristics() -> None:
+def populate_characteristics(corpus: Corpus, keys: KeyMap,
+                             write: Callable = bulk_insert) -> None:
     """Populates the database with the list of characteristics."""
 
-    characteristics = defaultdict(dict)
+    characteristics = corpus.names("characteristic")
 
-    for language in listdir("JSON"):
-        with open(f"JSON/{language}/JSON_CARACTERISTICAS.json") as traits_file:
-            for item in load(traits_file):
-                characteristics[item["id"]][language] = item["nombre"]
-
-    populate_strings("characteristic", characteristics)
+    populate_strings("characteristic", characteristics, keys, write)
 
     print("Generating DB Characteristic entries...", end=" ")
 
-    for characteristic in characteristics.keys():
-        Characteristic.get_or_create(
-            characteristic_id=characteristic, name=String.get_by_id(
-                f"characteristic_{characteristic}"))
+    rows = [{"characteristic_id": keys.register(Characteristic, characteristic),
+             "name": keys.resolve(String, f"characteristic_{characteristic}",
+                                  f"Characteristic {characteristic}")}
+            for characteristic in characteristics.keys()]
+    keys.check()
+    write(Characteristic, rows)
 
     print("Done.")
 
 
-def populate_db(db: SqliteDatabase) -> None:
-    """Populates the database tables with the local JSON information."""
-    with db as open_db:
-        populate_ammo()
-        populate_abilities()
-        populate_characteristics()
-        populate_sectorials()
-        populate_weapons()
-        populate_units()
-
-
-if "infinity.db" not in listdir():
-    generate_db(db)
-    for language in ["ENG", "ESP", "FRA"]:
-        fetch_json(language)
-    populate_db(db)
+# Populate stages in the order they have to run, so keys are registered
+# before they are resolved
+POPULATE_STAGES = (("ammo", populate_ammo), ("abilities", populate_abilities),
+                   ("characteristics", populate_characteristics),
+                   ("sectorials", populate_sectorials),
+                   ("weapons", populate_weapons), ("units", populate_units))
+
+
+def populate_db(db: SqliteDatabase, corpus: Corpus = None,
+                workers: int = 1, metrics: Metrics = None) -> Metrics:
+    """Populates the database tables with the local JSON information.
+    Every file of the corpus is read a single time for the whole build, and
+    foreign keys are resolved in memory without querying the database.
+    With more than one worker, sectorial files are normalized in a process
+    pool while this process remains the only one writing.
+    The load runs in import mode, and the indexes are created after it.
+    The name tables of every language and the search index are rebuilt and
+    the catalogue version is bumped once it's done.
+    Every step is measured as a stage of the build in metrics (set up from
+    the environment by default), which is returned."""
+
+    metrics = metrics or Metrics.from_environment()
+    corpus = corpus or Corpus(metrics=metrics)
+    corpus.metrics = corpus.metrics or metrics
+    write = metrics.counted(bulk_insert)
+    keys = KeyMap()
+
+    with metrics.stage("build"):
+        if workers > 1:
+            with metrics.stage("parse_sectorials"):
+                corpus.parse_sectorials(workers)
+        with import_mode(db) as open_db:
+            with open_db.atomic():
+                for name, stage in POPULATE_STAGES:
+                    with metrics.stage(name):
+                        stage(corpus, keys, write)
+                with metrics.stage("names"):
+                    materialize_names(open_db, corpus.languages)
+                with metrics.stage("search_index"):
+                    refresh_search_index(open_db)
+                bump_catalogue_version(open_db)
+            with metrics.stage("indexes"):
+                create_indexes(open_db)
+
+    return metrics
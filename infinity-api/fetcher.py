@@ -1,67 +1,196 @@
-from requests import get
-from pathlib import Path
-from re import findall
-import json
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from typing import NamedTuple
+
+from http_cache import HTTPCache, content_hash
+from corpus_format import corpus_file_exists, load_corpus_file, \
+    write_corpus_file
+from js_parser import iter_assignments
+from instrumentation import Metrics
+
+
+class FetchReport(NamedTuple):
+    """Result of a fetch. changed maps each language to the names of the files
+    that were written (sectorial IDs or JSON_* names), and failed holds the
+    URLs that couldn't be fetched."""
+
+    changed: dict
+    failed: tuple
+
+
+BASE_URL = "https://army.infinitythegame.com/import"
+LANGUAGES = ("ENG", "ESP", "FRA")
 
 
 def generate_dict(object_string: str) -> dict:
-    """Modifies a JS object and returns a list with all valid python dictionaries on it."""
+    """Parses a JS payload and returns a dict with every JSON_xxx object on it."""
 
-    object_string = object_string.replace(r"\'", r"\"")
-    invalid_chars = ["'", "+", "\n", "\r", "//"]
-    for char in invalid_chars:
-        object_string = object_string.replace(char, "")
+    return dict(iter_assignments(object_string))
 
-    parsed_string = findall(r"(JSON_\w+)\s?=\s?(.*?[]}]);", object_string)
 
-    return {item[0]: json.loads(item[1]) for item in parsed_string}
+def create_session(max_per_host: int = 8, retries: int = 3,
+                   backoff: float = 0.5) -> Session:
+    """Returns a session with a pooled connection adapter. The pool blocks once
+    max_per_host connections to the same host are in use, and failed requests
+    are retried with an exponential backoff."""
 
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_per_host,
+                          pool_block=True, max_retries=retry)
 
-def store_remote_data(
-        url: str, file_name: str = "", file_path: str = "") -> None:
-    """Given an URL with a series of JS objects, it will attempt to fetch them and store them locally as JSON."""
+    session = Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    # TODO: Async requests to fetch multiple JSON?
-    request = get(url)
+
+def store_remote_data(
+        url: str, file_name: str = "", file_path: str = "",
+        session: Session = None, cache: HTTPCache = None,
+        metrics: Metrics = None, packed: bool = True) -> tuple:
+    """Given an URL with a series of JS objects, it will attempt to fetch them
+    and store them locally. Files are stored as packed corpus files, or as
+    indented JSON if packed is False. If a cache is given the request is
+    conditional, and only the files whose contents changed are written.
+    Returns a tuple with the changed file names. The bytes fetched and parsed
+    are counted in metrics, if given."""
+
+    headers = cache.headers(url, file_path) if cache else {}
+    request = (session or create_session()).get(
+        url, headers=headers, timeout=30)
+    if metrics:
+        metrics.add("bytes_fetched", len(request.content))
+    if request.status_code == 304:
+        return ()
     if request.status_code != 200:
-        raise ConnectionError
+        raise ConnectionError(f"{url} answered {request.status_code}")
 
-    # TODO: Change paths and don't store data in .json when the db is set up
-    Path(file_path).mkdir(parents=True, exist_ok=True)
+    payload_hash = content_hash(request.content)
+    if cache and headers and cache.is_fresh(url, payload_hash):
+        cache.update(url, request.headers, payload_hash,
+                     cache.entries[url]["files"])
+        return ()
 
     request_dict = generate_dict(request.text)
+    if metrics:
+        metrics.add("bytes_parsed", len(request.content))
+    files, changed = {}, []
     for item, content in request_dict.items():
-        with open(f"{file_path}/{file_name or item}.json", "w") as open_file:
-            print(f"Writting file {file_path}/{file_name or item}.json...")
-            json.dump(content, open_file, sort_keys=True,
-                      indent=4, separators=(',', ': '))
+        name = file_name or item
+        files[name] = content_hash(content)
+        if cache and not cache.file_changed(url, name, files[name]) and \
+                corpus_file_exists(file_path, name):
+            continue
+
+        changed.append(name)
+        print(f"Writting file {file_path}/{name}...")
+        write_corpus_file(file_path, name, content, packed)
+
+    if cache:
+        cache.update(url, request.headers, payload_hash, files)
+    return tuple(changed)
 
 
 def fetch_sectorial_list(path: str) -> tuple:
     """Returns a tuple with all the IDs of every sectorial.
     The data is read from the locally stored JSON folder passed as argument."""
 
-    with open(f"{path}/JSON_SECTORIAL_NOMBRE.json", "r") as local_json_file:
-        return tuple(int(sectorial.split("_")[-1])
-                     for sectorial in json.load(local_json_file)
-                     ["nombresSectorial"].keys())
+    return tuple(int(sectorial.split("_")[-1])
+                 for sectorial in load_corpus_file(
+                     path, "JSON_SECTORIAL_NOMBRE")["nombresSectorial"].keys())
+
+
+def language_url(lang: str, base_url: str = BASE_URL) -> str:
+    """Returns the URL of the language file, which also lists the sectorials."""
+
+    return f"{base_url}/idioma_{lang.upper()}.js"
 
 
-def fetch_json(lang: str) -> None:
+def sectorial_url(sectorial: int, lang: str, base_url: str = BASE_URL) -> str:
+    """Returns the URL with the units of a sectorial in a given language."""
+
+    return f"{base_url}/json_dataUnidades_{sectorial}_{lang.upper()}.js"
+
+
+def fetch_json(lang: str, session: Session = None,
+               base_url: str = BASE_URL) -> None:
     """Attempts to fetch the newest JSON files with the data from all the units in the game."""
 
+    session = session or create_session()
+
     try:
-        store_remote_data(
-            f"https://army.infinitythegame.com/import/idioma_{lang.upper()}.js",
-            file_path=f"JSON/{lang.upper()}")
+        store_remote_data(language_url(lang, base_url),
+                          file_path=f"JSON/{lang.upper()}", session=session)
 
-    except ConnectionError:
+    except (RequestException, ConnectionError):
         print(
-            f"There was an issue trying to connect to the URL https://army.infinitythegame.com/import/idioma_{lang.upper()}.js.")
+            f"There was an issue trying to connect to the URL {language_url(lang, base_url)}.")
         return
 
     for sectorial in fetch_sectorial_list(f"JSON/{lang.upper()}"):
-        store_remote_data(
-            f"https://army.infinitythegame.com/import/json_dataUnidades_{sectorial}_{lang.upper()}.js",
-            file_name=str(sectorial),
-            file_path=f"JSON/{lang.upper()}")
+        store_remote_data(sectorial_url(sectorial, lang, base_url),
+                          file_name=str(sectorial),
+                          file_path=f"JSON/{lang.upper()}", session=session)
+
+
+def fetch_all(languages: tuple = LANGUAGES, workers: int = 16,
+              max_per_host: int = 8, base_url: str = BASE_URL,
+              cache_path: str = "http_cache.json",
+              metrics: Metrics = None, packed: bool = True) -> FetchReport:
+    """Fetches every language and every sectorial concurrently through a single
+    pooled session, revalidating against the local HTTP cache. If a language
+    file can't be fetched, its previously stored sectorial list is used, and
+    languages with nothing stored locally are skipped. Files are stored as
+    packed corpus files unless packed is False.
+    The language and sectorial files are measured as stages of the fetch in
+    metrics (set up from the environment by default)."""
+
+    metrics = metrics or Metrics.from_environment()
+    session = create_session(max_per_host=max_per_host)
+    cache = HTTPCache(cache_path)
+    changed, failed = defaultdict(list), []
+
+    def download(url: str, file_name: str, lang: str) -> tuple:
+        return store_remote_data(url, file_name=file_name,
+                                 file_path=f"JSON/{lang.upper()}",
+                                 session=session, cache=cache,
+                                 metrics=metrics, packed=packed)
+
+    def run(jobs: list) -> None:
+        futures = {pool.submit(download, *job): job for job in jobs}
+        for future in as_completed(futures):
+            url, _, lang = futures[future]
+            try:
+                changed[lang].extend(future.result())
+            except (RequestException, ConnectionError) as error:
+                print(f"There was an issue trying to connect to the URL {url} ({error!r}).")
+                failed.append(url)
+            except ValueError as error:
+                print(f"The payload of the URL {url} couldn't be parsed ({error!r}).")
+                failed.append(url)
+            except OSError as error:
+                print(f"The files of the URL {url} couldn't be stored ({error!r}).")
+                failed.append(url)
+
+    with metrics.stage("fetch"), session, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        with metrics.stage("fetch_languages"):
+            run([(language_url(lang, base_url), "", lang)
+                 for lang in languages])
+
+        with metrics.stage("fetch_sectorials"):
+            run([(sectorial_url(sectorial, lang, base_url), str(sectorial),
+                  lang) for lang in languages
+                 if corpus_file_exists(f"JSON/{lang.upper()}",
+                                       "JSON_SECTORIAL_NOMBRE")
+                 for sectorial in fetch_sectorial_list(f"JSON/{lang.upper()}")])
+
+        cache.save()
+    return FetchReport({lang: tuple(sorted(names))
+                        for lang, names in changed.items() if names},
+                       tuple(sorted(failed)))
@@ -0,0 +1,237 @@
+"""Builds of the database as generations swapped in atomically.
+
+Each build is written to a shadow file in the generations folder next to the
+database, checked, and only then published by pointing the database path,
+a symbolic link, to it with a single rename. Readers keep using the file
+they opened until they reopen their connections, so they never see a half
+built catalogue, and the previous generations are kept around to roll back
+to.
+
+    infinity.db -> generations/infinity.3.db
+    generations/infinity.1.db
+    generations/infinity.2.db
+    generations/infinity.3.db"""
+
+from db_classes import db, catalogue_version
+from peewee import SqliteDatabase
+from threading import local
+from pathlib import Path
+from os import replace, symlink, link, stat, readlink
+from re import fullmatch
+
+
+# Generations kept around, the current one included
+KEEP_GENERATIONS = 3
+
+
+class GenerationError(Exception):
+    """Raised when a shadow build fails its checks, or when there's no such
+    generation to roll back to."""
+
+
+def generation_folder(database_path: str) -> Path:
+    """Returns the folder holding the generations of a database."""
+
+    return Path(database_path).parent / "generations"
+
+
+def generation_path(database_path: str, generation: int) -> Path:
+    """Returns the file of a generation of a database."""
+
+    name = Path(database_path)
+    return generation_folder(database_path) / \
+        f"{name.stem}.{generation}{name.suffix}"
+
+
+def generations(database_path: str) -> list:
+    """Returns the numbers of every stored generation, oldest first."""
+
+    name = Path(database_path)
+    folder = generation_folder(database_path)
+    if not folder.is_dir():
+        return []
+    return sorted(int(match.group(1)) for match in (
+        fullmatch(rf"{name.stem}\.(\d+){name.suffix}", file.name)
+        for file in folder.iterdir()) if match)
+
+
+def current_generation(database_path: str) -> int:
+    """Returns the generation the database path points to, or None if it
+    isn't a link to one."""
+
+    path = Path(database_path)
+    if not path.is_symlink():
+        return None
+    match = fullmatch(rf"{path.stem}\.(\d+){path.suffix}",
+                      Path(readlink(path)).name)
+    return int(match.group(1)) if match else None
+
+
+def publish(database_path: str, generation: int) -> None:
+    """Points the database path to a generation. The link is created aside
+    and renamed over the path, so readers opening it get either the old or
+    the new generation and never a missing file."""
+
+    path = Path(database_path)
+    target = generation_path(database_path, generation)
+    if not target.exists():
+        raise GenerationError(f"There's no generation {generation}")
+
+    # A database built in place becomes generation 0, keeping the same file
+    # so its open connections are unaffected
+    if path.exists() and not path.is_symlink():
+        generation_folder(database_path).mkdir(exist_ok=True)
+        link(path, generation_path(database_path, 0))
+
+    staged_link = path.with_name(f"{path.name}.link")
+    if staged_link.is_symlink():
+        staged_link.unlink()
+    symlink(target.relative_to(path.parent), staged_link)
+    replace(staged_link, path)
+
+
+def remove_database_files(path: Path) -> None:
+    """Deletes a database file along with its journal and WAL files."""
+
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        leftover = Path(f"{path}{suffix}")
+        if leftover.exists():
+            leftover.unlink()
+
+
+def check_database(database: SqliteDatabase) -> None:
+    """Raises a GenerationError unless a database passes the integrity and
+    foreign key checks of SQLite."""
+
+    with database:
+        integrity = [row for row, in database.execute_sql(
+            "PRAGMA integrity_check")]
+        if integrity != ["ok"]:
+            raise GenerationError(f"Integrity check failed: {integrity[:10]}")
+        dangling = database.execute_sql("PRAGMA foreign_key_check").fetchall()
+        if dangling:
+            raise GenerationError(
+                f"{len(dangling)} dangling foreign key(s): {dangling[:10]}")
+
+
+def prune(database_path: str, keep: int = KEEP_GENERATIONS) -> list:
+    """Deletes the oldest generations, keeping the newest ones and always the
+    current one. Returns the deleted generations."""
+
+    current = current_generation(database_path)
+    stored = generations(database_path)
+    deleted = [generation for generation in stored[:-keep or None]
+               if generation != current] if keep else []
+    for generation in deleted:
+        generation_path(database_path, generation).unlink()
+    return deleted
+
+
+def shadow_build(database_path: str = "infinity.db", corpus=None,
+                 workers: int = 1, metrics=None,
+                 keep: int = KEEP_GENERATIONS, stream: bool = False) -> int:
+    """Builds the corpus into a new generation and swaps it in once it passes
+    its checks, returning its number. Its catalogue version is set past the
+    one being replaced, so caches and ETags never mistake it for an older
+    one. If the build or its checks fail the shadow file is deleted and the
+    current generation is left in place. Streamed builds read the JSON
+    folder with stream_db instead, in bounded memory."""
+
+    from db_operations import MODELS, generate_db, populate_db
+    from streaming import stream_db
+
+    stored = generations(database_path)
+    generation = max(stored + [current_generation(database_path) or 0]) + 1
+    previous_version = 0
+    if Path(database_path).exists():
+        live = SqliteDatabase(database_path)
+        with live:
+            previous_version = catalogue_version(live)
+
+    target = generation_path(database_path, generation)
+    shadow_path = target.with_name(f"{target.name}.building")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    remove_database_files(shadow_path)
+
+    shadow = SqliteDatabase(str(shadow_path))
+    try:
+        with shadow.bind_ctx(MODELS):
+            if stream:
+                generate_db(shadow)
+                stream_db(shadow, metrics=metrics)
+            else:
+                generate_db(shadow, indexes=False)
+                populate_db(shadow, corpus, workers, metrics)
+        with shadow:
+            shadow.pragma("user_version",
+                          max(catalogue_version(shadow), previous_version + 1))
+        check_database(shadow)
+    except BaseException:
+        shadow.close()
+        remove_database_files(shadow_path)
+        raise
+    shadow.close()
+
+    replace(shadow_path, target)
+    publish(database_path, generation)
+    prune(database_path, keep)
+    return generation
+
+
+def rollback(database_path: str = "infinity.db",
+             generation: int = None) -> int:
+    """Points the database back to a generation, the newest one before the
+    current one by default, and returns it. Its catalogue version is bumped
+    past the current one, since readers have to drop what they cached from
+    the generation being replaced."""
+
+    current = current_generation(database_path)
+    stored = generations(database_path)
+    older = [number for number in stored if current is None or number < current]
+    if generation is None:
+        if not older:
+            raise GenerationError("There's no older generation to roll back to")
+        generation = older[-1]
+    elif generation not in stored:
+        # Opening it would create an empty database
+        raise GenerationError(f"There's no generation {generation}")
+
+    current_version = 0
+    if Path(database_path).exists():
+        live = SqliteDatabase(database_path)
+        with live:
+            current_version = catalogue_version(live)
+    restored = SqliteDatabase(str(generation_path(database_path, generation)))
+    with restored:
+        restored.pragma("user_version", max(catalogue_version(restored),
+                                            current_version + 1))
+
+    publish(database_path, generation)
+    return generation
+
+
+class ConnectionRefresher:
+    """Reopens the connection of each thread to a database once its path
+    points to another generation. Connections opened on the old one keep
+    reading it until then, even after it's replaced or deleted. Threads have
+    to call refresh before opening their first connection."""
+
+    def __init__(self, database: SqliteDatabase = db):
+        self.database = database
+        self.opened = local()
+
+    def refresh(self) -> bool:
+        """Closes the connection of the calling thread if the database path
+        was swapped since it was opened, so the next query opens the new
+        generation. Returns whether it was closed."""
+
+        status = stat(self.database.database)
+        identity = (status.st_dev, status.st_ino)
+        if getattr(self.opened, "identity", identity) == identity:
+            self.opened.identity = identity
+            return False
+
+        self.opened.identity = identity
+        if not self.database.is_closed():
+            self.database.close()
+        return True
@@ -0,0 +1,76 @@
+from threading import Lock
+from pathlib import Path
+from hashlib import sha256
+import json
+
+from corpus_format import corpus_file_exists
+
+
+def content_hash(content) -> str:
+    """Returns the hash of a payload, or of a parsed object in its canonical
+    JSON form."""
+
+    if not isinstance(content, (str, bytes)):
+        content = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    if isinstance(content, str):
+        content = content.encode()
+    return sha256(content).hexdigest()
+
+
+class HTTPCache:
+    """Persistent revalidation cache keyed by URL. Each entry stores the ETag,
+    Last-Modified and content hash of the last payload, along with the hash
+    of every local file written from it."""
+
+    def __init__(self, path: str = "http_cache.json"):
+        self.path = Path(path)
+        self.lock = Lock()
+        try:
+            with open(self.path) as cache_file:
+                self.entries = json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def headers(self, url: str, file_path: str) -> dict:
+        """Returns the conditional headers for an URL. Nothing is sent if any
+        of the files stored from it has gone missing."""
+
+        entry = self.entries.get(url)
+        if not entry or not all(corpus_file_exists(file_path, name)
+                                for name in entry["files"]):
+            return {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_fresh(self, url: str, payload_hash: str) -> bool:
+        """Checks if a payload is the same one that was stored last time."""
+
+        entry = self.entries.get(url)
+        return bool(entry) and entry["sha256"] == payload_hash
+
+    def file_changed(self, url: str, name: str, file_hash: str) -> bool:
+        """Checks if a file parsed from an URL differs from the stored one."""
+
+        return self.entries.get(url, {}).get("files", {}).get(name) != file_hash
+
+    def update(self, url: str, response_headers, payload_hash: str,
+               files: dict) -> None:
+        """Stores the validators of a response and the hashes of its files."""
+
+        with self.lock:
+            self.entries[url] = {
+                "etag": response_headers.get("ETag"),
+                "last_modified": response_headers.get("Last-Modified"),
+                "sha256": payload_hash,
+                "files": files}
+
+    def save(self) -> None:
+        """Writes the cache to disk."""
+
+        with self.lock, open(self.path, "w") as cache_file:
+            json.dump(self.entries, cache_file, sort_keys=True)
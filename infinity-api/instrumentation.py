@@ -0,0 +1,176 @@
+"""Per stage measurements of fetches and builds: wall and CPU time, rows
+written per table, SQL statements run through peewee, bytes fetched and
+parsed and memory, reported as JSON. Stages can also be run under cProfile,
+dumping a .prof file per stage.
+
+Memory is read from the peak resident size of the process, which never goes
+down: process_peak_rss_kb is the peak of the whole process when the stage
+ended, earlier stages included, and peak_rss_growth_kb is how much the stage
+raised it. A stage that frees what it allocates before the peak was reached
+grows it by 0, so only the stages setting a new peak show up there.
+
+Stages nest, and whatever is counted while a stage is open is added to it
+and to every stage around it. Counters can be added to from any thread.
+
+Builds and fetches started without a Metrics read these environment
+variables:
+    INFINITY_METRICS: file the JSON report is written to after each stage
+    INFINITY_PROFILE: comma separated stages to profile, or "all"
+    INFINITY_PROFILE_DIR: folder of the .prof files (profiles by default)"""
+
+from contextlib import contextmanager
+from collections import Counter
+from time import perf_counter, process_time
+from threading import Lock
+from typing import Callable
+from pathlib import Path
+from os import environ
+import cProfile
+import logging
+import json
+
+
+# Counters every stage reports, even when nothing was counted
+COUNTERS = ("statements", "bytes_fetched", "bytes_parsed")
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    # Not available on Windows, where peak memory isn't reported
+    getrusage = None
+
+
+class StatementCounter(logging.Handler):
+    """Counts the statements peewee logs while it's attached."""
+
+    def __init__(self, metrics):
+        super().__init__(logging.DEBUG)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.metrics.add("statements")
+
+
+def process_peak_rss_kb() -> int:
+    """Returns the peak resident memory of the process so far, in KB."""
+
+    return getrusage(RUSAGE_SELF).ru_maxrss if getrusage else None
+
+
+class Metrics:
+    """Measurements of every stage run with it, in the order they started."""
+
+    def __init__(self, path: str = None, profile: tuple = (),
+                 profile_directory: str = "profiles"):
+        self.path = path
+        self.profile = set(profile)
+        self.profile_directory = profile_directory
+        self.stages = []
+        self.open_stages = []
+        self.profiling = False
+        self.lock = Lock()
+        self.statement_counter = StatementCounter(self)
+
+    @classmethod
+    def from_environment(cls) -> "Metrics":
+        """Returns a Metrics set up from the environment variables."""
+
+        return cls(environ.get("INFINITY_METRICS"),
+                   tuple(stage.strip() for stage in
+                         environ.get("INFINITY_PROFILE", "").split(",")
+                         if stage.strip()),
+                   environ.get("INFINITY_PROFILE_DIR", "profiles"))
+
+    def add(self, counter: str, amount: int = 1) -> None:
+        """Adds to a counter of every open stage."""
+
+        with self.lock:
+            for stage in self.open_stages:
+                stage["counters"][counter] += amount
+
+    def add_rows(self, table: str, rows: int) -> None:
+        """Adds to the rows written to a table by every open stage."""
+
+        with self.lock:
+            for stage in self.open_stages:
+                stage["rows"][table] += rows
+
+    def counted(self, write: Callable) -> Callable:
+        """Wraps a write function of the populate stages, which returns the
+        number of rows it wrote, so the rows skipped as duplicates aren't
+        counted."""
+
+        def counted_write(model, rows: list) -> int:
+            written = write(model, rows)
+            self.add_rows(model.__name__, written)
+            return written
+
+        return counted_write
+
+    def profiles(self, name: str) -> bool:
+        """Checks if a stage has to be profiled."""
+
+        return not self.profiling and bool(self.profile & {name, "all"})
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measures the code run inside as a stage with the given name."""
+
+        stage = {"stage": name, "depth": len(self.open_stages),
+                 "rows": Counter(),
+                 "counters": Counter(dict.fromkeys(COUNTERS, 0))}
+        with self.lock:
+            self.stages.append(stage)
+            self.open_stages.append(stage)
+
+        logger = logging.getLogger("peewee")
+        level = logger.level
+        if len(self.open_stages) == 1:
+            logger.addHandler(self.statement_counter)
+            logger.setLevel(logging.DEBUG)
+
+        profiler = None
+        if self.profiles(name):
+            profiler, self.profiling = cProfile.Profile(), True
+            profiler.enable()
+
+        wall, cpu = perf_counter(), process_time()
+        peak_rss = process_peak_rss_kb()
+        try:
+            yield stage
+        finally:
+            stage["wall_seconds"] = round(perf_counter() - wall, 6)
+            stage["cpu_seconds"] = round(process_time() - cpu, 6)
+            stage["process_peak_rss_kb"] = process_peak_rss_kb()
+            stage["peak_rss_growth_kb"] = peak_rss and \
+                stage["process_peak_rss_kb"] - peak_rss
+            if profiler:
+                profiler.disable()
+                self.profiling = False
+                Path(self.profile_directory).mkdir(parents=True, exist_ok=True)
+                stage["profile"] = f"{self.profile_directory}/{name}.prof"
+                profiler.dump_stats(stage["profile"])
+
+            with self.lock:
+                self.open_stages.remove(stage)
+            if not self.open_stages:
+                logger.removeHandler(self.statement_counter)
+                logger.setLevel(level)
+                if self.path:
+                    self.save(self.path)
+
+    def report(self) -> list:
+        """Returns the measurements of every finished stage as JSON ready
+        dicts."""
+
+        with self.lock:
+            return [{**{key: value for key, value in stage.items()
+                        if key not in ("rows", "counters")},
+                     **stage["counters"], "rows": dict(stage["rows"])}
+                    for stage in self.stages if "wall_seconds" in stage]
+
+    def save(self, path: str) -> None:
+        """Writes the report to a JSON file."""
+
+        with open(path, "w") as report_file:
+            json.dump({"stages": self.report()}, report_file, indent=2)
@@ -0,0 +1,157 @@
+"""Single pass scanner for the JS payloads served by the army site.
+
+The payloads are a series of `var JSON_xxx = <value>;` assignments, where the
+value is either a JS literal or a chain of single quoted strings joined with
+`+` that together hold a JSON document. Every value is decoded straight from
+its position in the payload, so the text is never copied or rewritten.
+Comparisons with JSON_xxx names, and assignments of anything else, like a
+variable or a call, are skipped."""
+
+from json import JSONDecoder
+from re import compile, DOTALL
+
+
+ASSIGNMENT = compile(r"\b(JSON_\w+)\s*=(?!=)\s*")
+LITERAL_START = compile(r"['\"{\[\d.-]|(?:true|false|null)\b")
+SKIPPABLE = compile(r"(?:\s+|//[^\n]*|/\*.*?\*/)*", DOTALL)
+SINGLE_QUOTED = compile(r"'([^'\\\n]*(?:\\.[^'\\\n]*)*)'", DOTALL)
+DOUBLE_QUOTED = compile(r'"([^"\\\n]*(?:\\.[^"\\\n]*)*)"', DOTALL)
+JS_ESCAPE = compile(r"\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|[\s\S])")
+NUMBER = compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+IDENTIFIER = compile(r"[A-Za-z_$][\w$]*")
+
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f",
+           "v": "\v", "0": "\0", "\n": "", "\r\n": ""}
+CONSTANTS = {"true": True, "false": False, "null": None}
+
+json_decoder = JSONDecoder()
+
+
+def iter_assignments(text: str):
+    """Yields a (name, value) tuple for every JSON_xxx assignment of a literal
+    or a string concatenation found in a JS payload, decoding each value as
+    soon as it is reached."""
+
+    position = 0
+    while True:
+        match = ASSIGNMENT.search(text, position)
+        if not match:
+            return
+
+        position = SKIPPABLE.match(text, match.end()).end()
+        if not LITERAL_START.match(text, position):
+            continue
+
+        value, position = parse_value(text, position)
+        position = SKIPPABLE.match(text, position).end()
+        if position < len(text) and text[position] == ";":
+            position += 1
+
+        yield match.group(1), value
+
+
+def parse_value(text: str, position: int) -> tuple:
+    """Decodes the value that starts at a given position. Returns the value
+    and the position right after it."""
+
+    position = SKIPPABLE.match(text, position).end()
+
+    if text.startswith("'", position):
+        document, position = parse_concatenation(text, position)
+        return json_decoder.decode(document), position
+
+    try:
+        return json_decoder.raw_decode(text, position)
+    except ValueError:
+        return parse_literal(text, position)
+
+
+def parse_concatenation(text: str, position: int) -> tuple:
+    """Joins a chain of quoted strings like 'a' + 'b' into a single string."""
+
+    pieces = []
+    while True:
+        string, position = parse_string(text, position)
+        pieces.append(string)
+
+        following = SKIPPABLE.match(text, position).end()
+        if not text.startswith("+", following):
+            return "".join(pieces), position
+        position = SKIPPABLE.match(text, following + 1).end()
+
+
+def parse_string(text: str, position: int) -> tuple:
+    """Decodes the JS string literal, single or double quoted, starting at a
+    given position."""
+
+    pattern = SINGLE_QUOTED if text.startswith("'", position) else DOUBLE_QUOTED
+    match = pattern.match(text, position)
+    if not match:
+        raise ValueError(f"Unterminated string at position {position}")
+
+    raw = match.group(1)
+    if "\\" in raw:
+        raw = JS_ESCAPE.sub(unescape, raw)
+    return raw, match.end()
+
+
+def unescape(match) -> str:
+    """Returns the character a JS escape sequence stands for."""
+
+    sequence = match.group(1)
+    if sequence[0] in "ux" and len(sequence) > 1:
+        return chr(int(sequence[1:], 16))
+    return ESCAPES.get(sequence, sequence)
+
+
+def parse_literal(text: str, position: int) -> tuple:
+    """Decodes a JS literal that isn't valid JSON (single quoted strings,
+    unquoted keys, comments or trailing commas)."""
+
+    position = SKIPPABLE.match(text, position).end()
+    char = text[position:position + 1]
+
+    if char in ("'", '"'):
+        return parse_concatenation(text, position)
+
+    if char in ("{", "["):
+        closing = "}" if char == "{" else "]"
+        container = {} if char == "{" else []
+        position += 1
+        while True:
+            position = SKIPPABLE.match(text, position).end()
+            if text.startswith(closing, position):
+                return container, position + 1
+
+            if char == "{":
+                key_match = IDENTIFIER.match(text, position)
+                if key_match:
+                    key, position = key_match.group(), key_match.end()
+                else:
+                    key, position = parse_string(text, position)
+                position = SKIPPABLE.match(text, position).end()
+                if not text.startswith(":", position):
+                    raise ValueError(f"Expected ':' at position {position}")
+                value, position = parse_literal(text, position + 1)
+                container[key] = value
+            else:
+                value, position = parse_literal(text, position)
+                container.append(value)
+
+            position = SKIPPABLE.match(text, position).end()
+            if text.startswith(",", position):
+                position += 1
+            elif not text.startswith(closing, position):
+                raise ValueError(f"Expected ',' or '{closing}' at position {position}")
+
+    number = NUMBER.match(text, position)
+    if number:
+        value = number.group()
+        return (float(value) if any(c in value for c in ".eE")
+                else int(value)), number.end()
+
+    constant = IDENTIFIER.match(text, position)
+    if constant and constant.group() in CONSTANTS:
+        return CONSTANTS[constant.group()], constant.end()
+
+    raise ValueError(f"Unexpected character {char!r} at position {position}")
@@ -0,0 +1,56 @@
+from collections import defaultdict
+from peewee import Model
+
+
+class DanglingReferenceError(LookupError):
+    """Raised when staged rows reference keys that were never staged."""
+
+
+class KeyMap:
+    """Identity map of every primary key staged during a build. Foreign keys
+    are resolved against it in memory instead of querying the database, and
+    references to unknown keys are gathered so they can be reported at once."""
+
+    def __init__(self):
+        self.keys = defaultdict(set)
+        self.dangling = []
+        self.profiles_by_unit = defaultdict(list)
+
+    def register(self, model: Model, key) -> object:
+        """Stores a primary key of a model and returns it normalized."""
+
+        key = model._meta.primary_key.adapt(key)
+        self.keys[model].add(key)
+        return key
+
+    def register_stored(self, model: Model) -> None:
+        """Registers every primary key of a model already in the database."""
+
+        for key, in model._meta.database.execute(
+                model.select(model._meta.primary_key)):
+            self.register(model, key)
+
+    def get(self, model: Model, key) -> object:
+        """Returns the normalized key if it has been registered, or None."""
+
+        key = model._meta.primary_key.adapt(key)
+        return key if key in self.keys[model] else None
+
+    def resolve(self, model: Model, key, referrer: str) -> object:
+        """Returns the normalized key, recording a dangling reference if it
+        hasn't been registered."""
+
+        key = model._meta.primary_key.adapt(key)
+        if key not in self.keys[model]:
+            self.dangling.append(
+                f"{referrer} references unknown {model.__name__} {key!r}")
+            return None
+        return key
+
+    def check(self) -> None:
+        """Raises a DanglingReferenceError listing every dangling reference."""
+
+        if self.dangling:
+            dangling, self.dangling = self.dangling, []
+            raise DanglingReferenceError(
+                f"{len(dangling)} dangling reference(s):\n" + "\n".join(dangling))
@@ -0,0 +1,130 @@
+"""Localized names in any number of languages. Names are resolved in bulk for
+a single language, falling back through a chain of languages for the strings
+that aren't translated, with one query per call."""
+
+from db_classes import Translation
+from peewee import SqliteDatabase, Model, Table
+
+
+# Languages tried, in order, when a string isn't available in the requested one
+FALLBACK_LANGUAGES = ("ENG", "ESP")
+
+
+class UnknownLanguageError(LookupError):
+    """Raised when names are asked for in a language that has none."""
+
+
+def fallback_chain(language: str, fallback: tuple = FALLBACK_LANGUAGES) -> tuple:
+    """Returns the requested language followed by the fallback ones."""
+
+    return tuple(dict.fromkeys((language.upper(),) + tuple(fallback)))
+
+
+def name_table(language: str) -> Table:
+    """Returns the denormalized name table of a language."""
+
+    return Table(f"name_{language.lower()}", ("string_id", "text"))
+
+
+def name_languages(db: SqliteDatabase = None) -> tuple:
+    """Returns every language with a denormalized name table."""
+
+    db = db or Translation._meta.database
+    return tuple(sorted(table[len("name_"):].upper()
+                        for table in db.get_tables()
+                        if table.startswith("name_")))
+
+
+def serving_languages(language: str, available: tuple,
+                      fallback: tuple = FALLBACK_LANGUAGES) -> dict:
+    """Returns the language names are served in and the available one they
+    are taken from: every available language when none is requested, or the
+    requested one, taken from the first language of its fallback chain that
+    is available. Raises an UnknownLanguageError if none of them is."""
+
+    if language is None:
+        return {code: code for code in available}
+    for code in fallback_chain(language, fallback):
+        if code in available:
+            return {language.upper(): code}
+    raise UnknownLanguageError(f"There are no names in {language.upper()}")
+
+
+def first_in_chain(rows, chain: tuple) -> dict:
+    """Keeps, for every key, the text of the earliest language in the chain
+    out of a series of (key, language, text) rows."""
+
+    names, ranks = {}, {}
+    for key, language, text in rows:
+        rank = chain.index(language)
+        if key not in ranks or rank < ranks[key]:
+            names[key], ranks[key] = text, rank
+    return names
+
+
+def resolve_strings(string_ids, language: str,
+                    fallback: tuple = FALLBACK_LANGUAGES) -> dict:
+    """Returns a dict with the text of every string ID in a language, or in
+    the first language of the fallback chain that has it."""
+
+    chain = fallback_chain(language, fallback)
+    return first_in_chain(
+        Translation
+        .select(Translation.string, Translation.language, Translation.text)
+        .where(Translation.string.in_(list(set(string_ids))) &
+               Translation.language.in_(chain))
+        .tuples(), chain)
+
+
+def entity_names(model: Model, ids, language: str,
+                 fallback: tuple = FALLBACK_LANGUAGES,
+                 materialized: bool = False) -> dict:
+    """Returns a dict with the name of every item of a model in a list of
+    IDs, joining its name straight to the translations. If materialized, the
+    denormalized name table of the language is joined instead, which already
+    has the default fallback chain applied."""
+
+    primary_key = model._meta.primary_key
+    ids = list(set(ids))
+
+    if materialized:
+        names = name_table(language)
+        return dict(model
+                    .select(primary_key, names.text)
+                    .join(names, on=(model.name == names.string_id))
+                    .where(primary_key.in_(ids))
+                    .tuples())
+
+    chain = fallback_chain(language, fallback)
+    return first_in_chain(
+        model
+        .select(primary_key, Translation.language, Translation.text)
+        .join(Translation, on=(model.name == Translation.string))
+        .where(primary_key.in_(ids) & Translation.language.in_(chain))
+        .tuples(), chain)
+
+
+def stored_languages() -> tuple:
+    """Returns every language with at least one translation."""
+
+    return tuple(language for language, in Translation
+                 .select(Translation.language).distinct()
+                 .order_by(Translation.language).tuples())
+
+
+def materialize_names(db: SqliteDatabase, languages: tuple = None) -> None:
+    """Rebuilds the denormalized name table of every language (every stored
+    one by default): one row per string with the text of the language or of
+    its fallback chain, so hot reads need a single primary key lookup."""
+
+    for language in languages or stored_languages():
+        table = name_table(language).__name__
+        db.execute_sql(f'DROP TABLE IF EXISTS "{table}"')
+        db.execute_sql(f'CREATE TABLE "{table}" (string_id VARCHAR(255) '
+                       'PRIMARY KEY, text VARCHAR(255)) WITHOUT ROWID')
+        # Inserted from the last language of the chain to the first, so
+        # every language overwrites the ones it takes precedence over
+        for code in reversed(fallback_chain(language)):
+            db.execute_sql(
+                f'INSERT OR REPLACE INTO "{table}" SELECT string_id, text '
+                'FROM translation WHERE language = ?', (code,))
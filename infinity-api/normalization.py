@@ -0,0 +1,193 @@
+"""Pure helpers turning the raw values of the JSON corpus into row values.
+They don't touch the database, so they can run in worker processes."""
+
+from re import findall
+from array import array
+
+
+def strip_separators(raw_string: str, separator: str = "|") -> tuple:
+    """Given a string with numerical values separated by separators, 
+    it returns a tuple with it's contents."""
+
+    # TODO: Remove extra replace due to some scenarios where multiple
+    # separators are being used at once
+    return tuple(
+        int(value) for value in findall(r"(\d+)", raw_string)
+        if raw_string.strip("|"))
+
+
+def get_orders(raw_orders: str) -> tuple:
+    """Returns a tuple with the orders of an unit. They are, from left to right,
+    the regular, irregular, and impetuous orders."""
+
+    orders = [int(order) if int(order) else None
+              for order in raw_orders.split("%")]
+
+    return orders[0], orders[1], orders[2]
+
+
+def calculate_burst(weapon: dict) -> tuple:
+    """Get the burst values of a weapon depending if it's melee, ranged or both.
+    The first value is the ranged burst, while the second one is the CC burst.
+    If the weapon only has one type of burst, the other one will be None."""
+
+    burst = weapon["rafaga"]
+
+    if "(" in burst:
+        return tuple(int(char) for char in burst if char.isdigit())
+    if not [char for char in burst if char.isdigit()]:
+        return None, None
+    return (int(burst), None) if not int(weapon["CC"]) else (None, int(burst))
+
+
+def validate_range(weapon_range: str) -> str:
+    """Given a weapon value range, it checks if it's a valid range or not.
+     If it isn't, this returns Null."""
+
+    return weapon_range.replace("|", ",") if "|" in weapon_range else None
+
+
+# Range bands of a weapon, from the shortest to the longest, with the name of
+# their fields and of their raw values
+RANGE_BANDS = (("short", "corta"), ("medium", "media"), ("long", "larga"),
+               ("maximum", "maxima"))
+
+
+def parse_range(weapon_range: str) -> tuple:
+    """Given a raw weapon range like "-3|24", it returns a tuple with its
+    modifier and the longest distance it covers, or (None, None) if the
+    weapon doesn't have that range band."""
+
+    if not validate_range(weapon_range):
+        return None, None
+    modifier, distance = weapon_range.split("|")[:2]
+    return int(modifier), int(distance)
+
+
+def range_lookup(bands: list) -> bytes:
+    """Given the (modifier, distance) of every range band of a weapon, it
+    returns the modifier at each distance from 0 to the longest one, packed
+    as signed bytes. Each band covers the distances up to its own, starting
+    after the previous one."""
+
+    lookup = array("b")
+    for modifier, distance in sorted(
+            (band for band in bands if band[1] is not None),
+            key=lambda band: band[1]):
+        lookup.extend([modifier] * (distance + 1 - len(lookup)))
+    return lookup.tobytes()
+
+
+class InheritanceCycleError(ValueError):
+    """Raised when items turn out to be their own ancestors."""
+
+
+def ancestry(parents: dict) -> dict:
+    """Given a dict with the parent of every item, or None, it returns a dict
+    with the chain of every item: the item itself followed by its ancestors,
+    from the nearest to the root. Parents missing from the dict are left out.
+    Raises an InheritanceCycleError listing every item in a cycle."""
+
+    chains, cycles = {}, set()
+    for item in parents:
+        path, current = [], item
+        while current in parents and current not in chains:
+            if current in path:
+                cycles.update(path[path.index(current):])
+                break
+            path.append(current)
+            current = parents.get(current)
+        else:
+            chain = chains.get(current, ())
+            for ancestor in reversed(path):
+                chain = (ancestor,) + chain
+                chains[ancestor] = chain
+
+    if cycles:
+        raise InheritanceCycleError(
+            f"{len(cycles)} item(s) in an inheritance cycle: "
+            + ", ".join(map(str, sorted(cycles))))
+    return chains
+
+
+UNIT_ATTRIBUTES = (
+    ("mov_1", "MOV1"), ("mov_2", "MOV2"), ("close_combat", "CC"),
+    ("ballistic_skill", "CD"), ("phisique", "FIS"), ("willpower", "VOL"),
+    ("armor", "BLI"), ("bts", "PB"), ("wounds", "H"), ("silhouette", "S"),
+    ("availability", "Disp"), ("has_structure", "EST"))
+
+
+def parse_unit(unit: dict) -> tuple:
+    """Normalizes a single army unit into its unit rows and profile rows, as
+    described in parse_sectorial."""
+
+    units, profiles = [], []
+    for unit_profile in unit["perfiles"]:
+        attributes = unit_profile["atributos"]
+        units.append((
+            int(unit_profile["id"]), unit["IDArmy"],
+            tuple(int(attributes[key]) for _, key in UNIT_ATTRIBUTES),
+            strip_separators(unit_profile["caracteristicas"]),
+            strip_separators(unit_profile["equipo_habs"])))
+
+        for profile in unit_profile["opciones"]:
+            profiles.append((
+                int(profile["id"]), int(profile["idPerfil"]),
+                float(profile["CAP"])
+                if profile["CAP"].replace("-", "") else 0.,
+                int(profile["puntos"]), *get_orders(profile["ordenes"]),
+                strip_separators(profile["armas"]),
+                strip_separators(profile["caracteristicas"]),
+                strip_separators(profile["extra"])))
+
+    return units, profiles
+
+
+def unit_names(unit: dict, language: str) -> list:
+    """Returns the (kind, ID, language, name) names of the unit profiles and
+    profile options of an army unit in a language."""
+
+    names = []
+    for unit_profile in unit["perfiles"]:
+        names.append(("unit", int(unit_profile["id"]), language,
+                      unit_profile["nombre"]))
+        for profile in unit_profile["opciones"]:
+            names.append(("profile", int(profile["id"]), language,
+                          profile["nombre"]))
+    return names
+
+
+def property_names(weapon: dict):
+    """Yields the (ID, name) pairs of the properties of a raw weapon."""
+
+    for property_id, property_name in zip(
+        [int(identifier or -1)
+         for identifier in weapon["propiedades"].split("|")],
+            weapon["lista_propiedades"].split("|")):
+        if property_id != -1:
+            yield property_id, property_name
+
+
+def parse_sectorial(sectorial: int, units_by_language: dict) -> tuple:
+    """Normalizes the units of a sectorial file, given in every language, into
+    compact tuples. Stats are read from the first language. Returns a tuple
+    with the sectorial ID, the unit rows, the profile rows and the names.
+
+    Unit rows are (unit ID, army ID, attribute values, characteristic IDs,
+    ability IDs), profile rows are (profile ID, unit ID, cap, points, regular,
+    irregular and impetuous orders, weapon IDs, characteristic IDs, ability
+    IDs) and names are (kind, ID, language, name)."""
+
+    languages = sorted(units_by_language)
+    units, profiles, names = [], [], []
+
+    for unit in units_by_language[languages[0]]:
+        unit_rows, profile_rows = parse_unit(unit)
+        units.extend(unit_rows)
+        profiles.extend(profile_rows)
+
+    for language in languages:
+        for unit in units_by_language[language]:
+            names.extend(unit_names(unit, language))
+
+    return sectorial, tuple(units), tuple(profiles), tuple(names)
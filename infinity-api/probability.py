@@ -0,0 +1,287 @@
+"""Exact d20 face to face odds, computed with NumPy over whole arrays of
+attackers, weapons, range bands and defenders at once.
+
+Rolls follow these rules: a die succeeds when it's equal to or lower than the
+success value (SV), and a die equal to the SV is a critical. An SV over 20
+adds the excess to every die, and any result reaching 20 is a critical. In a
+face to face roll the highest success of each side cancels every success of
+the other side that isn't higher, criticals being higher than any other
+success, so a critical is only cancelled by another critical. Every hit left
+forces a saving roll that fails on a d20 result equal to or lower than the
+damage minus the armor, and criticals wound without a saving roll.
+
+Nothing is sampled: the distribution of a die and of the highest of several
+dice are enumerated face by face, and the number of hits left is binomial
+given the highest success of the other side. Every combination of SVs and
+bursts is enumerated once into lookup tables, which are then indexed with
+whole arrays of rolls."""
+
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+
+
+FACES = 20
+
+# Scores of a die: 0 is a failure, 1 to 20 a success of that value and 21 a
+# critical
+CRITICAL = FACES + 1
+SCORES = FACES + 2
+
+# Highest SV that changes the odds: from 40 on every die is a critical
+MAX_SV = 2 * FACES
+
+MAX_BURST = 6
+
+# Range bands, in the same order as the Weapon fields
+BANDS = ("short_modifier", "medium_modifier", "long_modifier",
+         "maximum_modifier")
+
+
+class FaceToFace(NamedTuple):
+    """Outcome of face to face rolls. Arrays have the broadcast shape of the
+    inputs, and hit distributions an extra last axis with the probability of
+    leaving each number of hits, from 0 to MAX_BURST."""
+
+    active_wins: np.ndarray
+    reactive_wins: np.ndarray
+    active_hits: np.ndarray
+    reactive_hits: np.ndarray
+    active_expected_hits: np.ndarray
+    reactive_expected_hits: np.ndarray
+    active_criticals: np.ndarray
+    reactive_criticals: np.ndarray
+
+
+@lru_cache(maxsize=None)
+def die_distributions() -> np.ndarray:
+    """Returns the score distribution of a single die for every SV from 0 to
+    MAX_SV, with shape (MAX_SV + 1, SCORES)."""
+
+    table = np.zeros((MAX_SV + 1, SCORES))
+    for sv in range(MAX_SV + 1):
+        for face in range(1, FACES + 1):
+            if sv > FACES:
+                result = face + sv - FACES
+                score = CRITICAL if result >= FACES else result
+            elif face < sv:
+                score = face
+            elif face == sv:
+                score = CRITICAL
+            else:
+                score = 0
+            table[sv, score] += 1 / FACES
+    return table
+
+
+@lru_cache(maxsize=None)
+def highest_distributions() -> np.ndarray:
+    """Returns the distribution of the highest score out of a burst of dice
+    for every SV and burst from 0 to MAX_BURST, with shape
+    (MAX_SV + 1, MAX_BURST + 1, SCORES). A burst of 0 always scores 0."""
+
+    cumulative = np.cumsum(die_distributions(), axis=-1)
+    bursts = np.arange(MAX_BURST + 1)[None, :, None]
+    highest_cumulative = cumulative[:, None, :] ** bursts
+    return np.diff(highest_cumulative, axis=-1, prepend=0)
+
+
+@lru_cache(maxsize=None)
+def binomial_coefficients() -> np.ndarray:
+    """Returns the binomial coefficients C(n, k) for n and k up to MAX_BURST."""
+
+    table = np.zeros((MAX_BURST + 1, MAX_BURST + 1))
+    for n in range(MAX_BURST + 1):
+        table[n, 0] = 1
+        for k in range(1, n + 1):
+            table[n, k] = table[n - 1, k - 1] + table[n - 1, k]
+    return table
+
+
+def surviving_hits(sv: np.ndarray, burst: np.ndarray,
+                   other_highest: np.ndarray) -> tuple:
+    """Returns the distribution of the hits one side keeps and their expected
+    number of criticals, given the distribution of the highest score of the
+    other side."""
+
+    die = die_distributions()[sv]
+    # Chance of a single die beating each possible highest score of the
+    # other side: the sum of the probabilities of every higher score
+    beats = np.cumsum(die[..., ::-1], axis=-1)[..., ::-1]
+    beats = np.concatenate([beats[..., 1:], np.zeros(beats.shape[:-1] + (1,))],
+                           axis=-1)
+
+    hits = np.arange(MAX_BURST + 1)
+    coefficients = binomial_coefficients()[burst]
+    remaining = np.clip(burst[..., None] - hits, 0, None)
+    # Binomial pmf of the hits for each highest score of the other side, with
+    # shape (..., SCORES, MAX_BURST + 1)
+    pmf = coefficients[..., None, :] * beats[..., :, None] ** hits * \
+        (1 - beats[..., :, None]) ** remaining[..., None, :]
+    distribution = np.einsum("...s,...sk->...k", other_highest, pmf)
+
+    criticals = burst * die[..., CRITICAL] * (1 - other_highest[..., CRITICAL])
+    return distribution, criticals
+
+
+def exact_face_to_face(active_sv: np.ndarray, active_burst: np.ndarray,
+                       reactive_sv: np.ndarray,
+                       reactive_burst: np.ndarray) -> FaceToFace:
+    """Enumerates the odds of face to face rolls for arrays of SVs and bursts
+    already within range and broadcast to the same shape."""
+
+    highest = highest_distributions()
+    active_hits, active_criticals = surviving_hits(
+        active_sv, active_burst, highest[reactive_sv, reactive_burst])
+    reactive_hits, reactive_criticals = surviving_hits(
+        reactive_sv, reactive_burst, highest[active_sv, active_burst])
+
+    hits = np.arange(MAX_BURST + 1)
+    return FaceToFace(active_hits[..., 1:].sum(axis=-1),
+                      reactive_hits[..., 1:].sum(axis=-1),
+                      active_hits, reactive_hits,
+                      active_hits @ hits, reactive_hits @ hits,
+                      active_criticals, reactive_criticals)
+
+
+@lru_cache(maxsize=None)
+def outcome_tables() -> FaceToFace:
+    """Returns the odds of every possible face to face roll, indexed by the
+    active SV and burst and the reactive SV and burst. There are few enough
+    of them to enumerate them all once and look them up afterwards. They are
+    enumerated one active SV at a time to keep the intermediate arrays small."""
+
+    grid = np.meshgrid(np.arange(MAX_BURST + 1), np.arange(MAX_SV + 1),
+                       np.arange(MAX_BURST + 1), indexing="ij")
+    slices = [exact_face_to_face(np.full_like(grid[0], sv), *grid)
+              for sv in range(MAX_SV + 1)]
+    return FaceToFace(*(np.stack(tables) for tables in zip(*slices)))
+
+
+def table_index(active_sv, active_burst, reactive_sv, reactive_burst) -> tuple:
+    """Returns the index of some face to face rolls in the outcome tables."""
+
+    return (np.clip(active_sv, 0, MAX_SV).astype(np.intp),
+            np.clip(active_burst, 0, MAX_BURST).astype(np.intp),
+            np.clip(reactive_sv, 0, MAX_SV).astype(np.intp),
+            np.clip(reactive_burst, 0, MAX_BURST).astype(np.intp))
+
+
+def face_to_face(active_sv, active_burst, reactive_sv=0,
+                 reactive_burst=0) -> FaceToFace:
+    """Returns the odds of face to face rolls. Every argument is an array (or
+    a number) of integers, and they are broadcast against each other. An SV
+    or a burst of 0 means that side doesn't roll, making it a normal roll."""
+
+    index = table_index(active_sv, active_burst, reactive_sv, reactive_burst)
+    return FaceToFace(*(table[index] for table in outcome_tables()))
+
+
+def expected_wounds(expected_hits, criticals, damage, armor) -> np.ndarray:
+    """Returns the expected wounds of the hits left by the active side, given
+    the damage of its weapon and the armor (or BTS) of the target."""
+
+    failed_save = np.clip(np.asarray(damage) - np.asarray(armor), 0, FACES) / FACES
+    return (expected_hits - criticals) * failed_save + criticals
+
+
+def parse_damage(damage: str) -> tuple:
+    """Returns the fixed damage of a weapon and whether the attacker's PH is
+    added to it, since melee weapons often deal PH based damage."""
+
+    damage = damage.strip().upper()
+    if damage.startswith("PH"):
+        return int(damage[2:] or 0), True
+    return (int(damage) if damage.lstrip("-").isdigit() else 0), False
+
+
+class Matchups(NamedTuple):
+    """Expected wounds and win chances of every attacker and weapon, in every
+    range band, against every defender. Arrays have the shape (attackers,
+    weapons, bands, defenders), and are NaN where a weapon has no such band."""
+
+    expected_wounds: np.ndarray
+    active_wins: np.ndarray
+    reactive_wins: np.ndarray
+
+
+def matchups(attackers: dict, weapons: dict, defenders: dict,
+             dodge: bool = True) -> Matchups:
+    """Computes every matchup at once. attackers and defenders are dicts of
+    arrays with the close_combat, ballistic_skill, phisique and armor of each
+    unit, and weapons a dict of arrays with the modifier of each range band
+    (NaN if the weapon doesn't have it), damage, whether it adds the PH, the
+    burst and whether it's a melee weapon. Melee weapons use the CC and a
+    single band. Defenders dodge with their PH, or don't react at all."""
+
+    melee = np.asarray(weapons["is_melee"], dtype=bool)[None, :, None]
+    skill = np.where(melee, np.asarray(attackers["close_combat"])[:, None, None],
+                     np.asarray(attackers["ballistic_skill"])[:, None, None])
+    modifiers = np.asarray(weapons["modifiers"], dtype=float)[None, :, :]
+    valid = ~np.isnan(modifiers)
+    active_sv = np.where(valid, skill + np.nan_to_num(modifiers), 0)
+
+    burst = np.asarray(weapons["burst"])[None, :, None]
+    reactive_sv = np.asarray(defenders["phisique"]) if dodge else 0
+    # Only the tables needed are looked up, leaving the hit distributions out
+    index = table_index(active_sv[..., None], burst[..., None],
+                        reactive_sv, 1 if dodge else 0)
+    tables = outcome_tables()
+
+    damage = np.asarray(weapons["damage"])[None, :] + np.where(
+        np.asarray(weapons["adds_ph"], dtype=bool)[None, :],
+        np.asarray(attackers["phisique"])[:, None], 0)
+    wounds = expected_wounds(tables.active_expected_hits[index],
+                             tables.active_criticals[index],
+                             damage[:, :, None, None],
+                             np.asarray(defenders["armor"]))
+
+    mask = np.where(valid[..., None], 1.0, np.nan)
+    return Matchups(wounds * mask, tables.active_wins[index] * mask,
+                    tables.reactive_wins[index] * mask)
+
+
+def load_units(unit_ids: list = None) -> tuple:
+    """Returns the IDs of some units (every unit by default) and a dict with
+    the arrays matchups expects for them."""
+
+    from db_classes import Unit
+
+    query = Unit.select(Unit.unit_id, Unit.close_combat, Unit.ballistic_skill,
+                        Unit.phisique, Unit.armor).order_by(Unit.unit_id)
+    if unit_ids is not None:
+        query = query.where(Unit.unit_id.in_(unit_ids))
+    rows = np.array(list(query.tuples()), dtype=np.intp).reshape(-1, 5)
+    return rows[:, 0], {"close_combat": rows[:, 1], "ballistic_skill": rows[:, 2],
+                        "phisique": rows[:, 3], "armor": rows[:, 4]}
+
+
+def load_weapons(weapon_ids: list = None) -> tuple:
+    """Returns the IDs of some weapons (every weapon by default) and a dict
+    with the arrays matchups expects for them."""
+
+    from db_classes import Weapon
+
+    query = Weapon.select().order_by(Weapon.weapon_id)
+    if weapon_ids is not None:
+        query = query.where(Weapon.weapon_id.in_(weapon_ids))
+    weapons = list(query)
+
+    modifiers = np.full((len(weapons), len(BANDS)), np.nan)
+    for row, weapon in enumerate(weapons):
+        if weapon.is_melee:
+            modifiers[row, 0] = 0
+            continue
+        for column, band in enumerate(BANDS):
+            modifier = getattr(weapon, band)
+            if modifier is not None:
+                modifiers[row, column] = modifier
+
+    damages = [parse_damage(weapon.damage) for weapon in weapons]
+    return np.array([weapon.weapon_id for weapon in weapons]), {
+        "modifiers": modifiers,
+        "damage": np.array([damage for damage, _ in damages]),
+        "adds_ph": np.array([adds_ph for _, adds_ph in damages]),
+        "burst": np.array([(weapon.burst_melee if weapon.is_melee
+                            else weapon.burst_range) or 1 for weapon in weapons]),
+        "is_melee": np.array([weapon.is_melee for weapon in weapons])}
@@ -0,0 +1,289 @@
+"""Read side of the database. Every function returns fully hydrated items as
+plain dicts, ready to be serialized, and runs a fixed number of joined queries
+per call no matter how many IDs are asked for. IDs are bound MAX_VARIABLES at
+a time, so asking for more than that repeats each query once per batch.
+
+Names are joined from the denormalized name table of every language, so they
+come with the fallback chain of the language applied. They are dicts keyed by
+language, holding every language with a name table, or only the requested
+one. Listing the name tables takes one more query per call."""
+
+from db_classes import Unit, Weapon, Ammo, Ability, Characteristic, Profile, \
+    String, Property, WeaponProperty, ProfileWeapon, ProfileCharacteristic, \
+    ProfileAbility, UnitCharacteristic, UnitAbility, WeaponAncestry, \
+    WeaponInheritedProperty, MAX_VARIABLES
+from localization import name_table, name_languages, serving_languages
+from peewee import JOIN, Field
+from collections import defaultdict
+
+
+UNIT_STATS = ("svg_icon", "mov_1", "mov_2", "close_combat", "ballistic_skill",
+              "phisique", "willpower", "armor", "bts", "wounds", "silhouette",
+              "availability", "has_structure")
+
+WEAPON_STATS = ("damage", "is_melee", "short_range", "medium_range",
+                "long_range", "maximum_range", "burst_melee", "burst_range")
+
+
+def served_languages(language: str = None) -> dict:
+    """Returns the languages names are served in, and the name table each
+    one is taken from, for the requested language or for every one."""
+
+    return serving_languages(language, name_languages())
+
+
+def with_names(query, name_field: Field, languages: dict, prefix: str = ""):
+    """Joins the name table of every served language to a query, on the
+    string ID of a field, selecting each name as the language code with a
+    prefix."""
+
+    for language, table in languages.items():
+        names = name_table(table).alias(f"{prefix}names_{language.lower()}")
+        query = query.join(names, JOIN.LEFT_OUTER, on=(
+            name_field == names.string_id)).select_extend(
+            names.text.alias(f"{prefix}{language}"))
+    return query
+
+
+def localized(row: dict, languages: dict, prefix: str = "") -> dict:
+    """Returns the names with_names selected in a row, keyed by language."""
+
+    return {language: row[f"{prefix}{language}"] for language in languages}
+
+
+def in_batches(query, field: Field, ids) -> list:
+    """Returns the rows of a query for the items whose field is in a list of
+    IDs, running it once per batch of IDs that fits in a statement. IDs are
+    sorted first, so queries ordered by the same field keep their order.
+    Batches are sliced rather than chunked, since peewee pads every chunk to
+    its full size before trimming it."""
+
+    ids = sorted(set(ids))
+    return [row for start in range(0, len(ids), MAX_VARIABLES)
+            for row in query.where(field.in_(ids[start:start + MAX_VARIABLES]))]
+
+
+def linked_items(owner: Field, owner_ids: list, item_field: Field,
+                 name_field: Field, languages: dict) -> dict:
+    """Returns a dict with the named items a link table holds for each owner
+    in a list of IDs, gathered in a single query."""
+
+    item = item_field.rel_model
+    item_key = item._meta.primary_key
+    query = with_names(owner.model
+                       .select(owner, item_key)
+                       .join(item, on=(item_field == item_key)),
+                       name_field, languages).order_by(owner, item_key).tuples()
+
+    items = defaultdict(list)
+    for owner_id, item_id, *names in in_batches(query, owner, owner_ids):
+        items[owner_id].append({"id": item_id,
+                                "name": dict(zip(languages, names))})
+    return items
+
+
+def get_strings(string_ids: list, language: str = None) -> dict:
+    """Returns a dict with the localized strings found in a list of IDs.
+    Takes one query."""
+
+    languages = served_languages(language)
+    query = with_names(String.select(String.string_id), String.string_id,
+                       languages).tuples()
+    return {string_id: dict(zip(languages, names)) for string_id, *names in
+            in_batches(query, String.string_id, string_ids)}
+
+
+def get_abilities(ability_ids: list, language: str = None) -> dict:
+    """Returns a dict with every ability found in a list of IDs, along with
+    its localized name and wiki URL. Takes one query."""
+
+    languages = served_languages(language)
+    query = (Ability
+             .select(Ability.ability_id, Ability.is_item, Ability.wiki_url)
+             .join(String, on=(Ability.name == String.string_id)))
+    query = with_names(with_names(query, Ability.name, languages),
+                       Ability.wiki_url, languages, "wiki_")
+    query = query.order_by(Ability.ability_id).dicts()
+
+    return {row["ability_id"]: {
+        "id": row["ability_id"],
+        "name": localized(row, languages),
+        "is_item": row["is_item"],
+        "wiki_url": row["wiki_url"] and localized(row, languages, "wiki_")}
+        for row in in_batches(query, Ability.ability_id, ability_ids)}
+
+
+def get_weapons(weapon_ids: list, language: str = None) -> dict:
+    """Returns a dict with every weapon found in a list of IDs, along with its
+    localized name, ammo and properties. Takes two queries."""
+
+    weapon_ids = list(set(weapon_ids))
+    languages = served_languages(language)
+    query = (Weapon
+             .select(Weapon)
+             .join(String, on=(Weapon.name == String.string_id))
+             .switch(Weapon)
+             .join(Ammo, JOIN.LEFT_OUTER, on=(Weapon.ammo == Ammo.ammo_id)))
+    query = with_names(with_names(query, Weapon.name, languages),
+                       Ammo.name, languages, "ammo_")
+    query = query.order_by(Weapon.weapon_id).dicts()
+
+    properties = linked_items(WeaponProperty.weapon, weapon_ids,
+                              WeaponProperty.weapon_property, Property.name,
+                              languages)
+
+    weapons = {}
+    for row in in_batches(query, Weapon.weapon_id, weapon_ids):
+        weapon_id = row["weapon_id"]
+        weapons[weapon_id] = {
+            "id": weapon_id,
+            "name": localized(row, languages),
+            **{stat: row[stat] for stat in WEAPON_STATS},
+            "ammo": row["ammo"] and {
+                "id": row["ammo"],
+                "name": localized(row, languages, "ammo_")},
+            "parent_weapon": row["parent_weapon"],
+            "properties": properties.get(weapon_id, [])}
+    return weapons
+
+
+def get_lineages(weapon_ids: list, language: str = None) -> dict:
+    """Returns a dict with the inheritance of every weapon found in a list of
+    IDs: its ancestors, from its parent to the root, and every property it
+    has or inherits from them. Takes two queries."""
+
+    weapon_ids = list(set(weapon_ids))
+    ancestors = defaultdict(list)
+    for weapon_id, ancestor in in_batches(
+            WeaponAncestry
+            .select(WeaponAncestry.weapon, WeaponAncestry.ancestor)
+            .order_by(WeaponAncestry.weapon, WeaponAncestry.depth)
+            .tuples(), WeaponAncestry.weapon, weapon_ids):
+        ancestors[weapon_id].append(ancestor)
+
+    properties = linked_items(
+        WeaponInheritedProperty.weapon, weapon_ids,
+        WeaponInheritedProperty.weapon_property, Property.name,
+        served_languages(language))
+
+    # Every weapon is its own ancestor at depth 0, which is left out
+    return {weapon_id: {"ancestors": chain[1:],
+                        "properties": properties.get(weapon_id, [])}
+            for weapon_id, chain in ancestors.items()}
+
+
+def get_profiles(profile_ids: list = None, unit_ids: list = None,
+                 language: str = None) -> dict:
+    """Returns a dict with every profile found in a list of profile IDs, or
+    with every profile of a list of unit IDs, along with its localized name,
+    characteristics, abilities and hydrated weapons. Takes six queries."""
+
+    if profile_ids is None and unit_ids is None:
+        raise ValueError("Either profile IDs or unit IDs must be given")
+
+    languages = served_languages(language)
+    query = with_names(Profile
+                       .select(Profile)
+                       .join(String, on=(Profile.name == String.string_id)),
+                       Profile.name, languages)
+    query = query.order_by(Profile.profile_id).dicts()
+    if unit_ids is None:
+        rows = in_batches(query, Profile.profile_id, profile_ids)
+    else:
+        rows = sorted(in_batches(query, Profile.unit_id, unit_ids),
+                      key=lambda row: row["profile_id"])
+    profile_ids = [row["profile_id"] for row in rows]
+
+    weapon_links = defaultdict(list)
+    for profile_id, weapon_id in in_batches(
+            ProfileWeapon
+            .select(ProfileWeapon.profile, ProfileWeapon.weapon)
+            .order_by(ProfileWeapon.profile, ProfileWeapon.weapon)
+            .tuples(), ProfileWeapon.profile, profile_ids):
+        weapon_links[profile_id].append(weapon_id)
+    weapons = get_weapons([weapon_id for weapon_ids in weapon_links.values()
+                           for weapon_id in weapon_ids], language)
+
+    characteristics = linked_items(
+        ProfileCharacteristic.profile, profile_ids,
+        ProfileCharacteristic.characteristic, Characteristic.name, languages)
+    abilities = linked_items(ProfileAbility.profile, profile_ids,
+                             ProfileAbility.ability, Ability.name, languages)
+
+    profiles = {}
+    for row in rows:
+        profile_id = row["profile_id"]
+        profiles[profile_id] = {
+            "id": profile_id,
+            "unit_id": row["unit_id"],
+            "name": localized(row, languages),
+            "cap": row["cap"],
+            "point_cost": row["point_cost"],
+            "regular_orders": row["regular_orders"],
+            "irregular_orders": row["irregular_orders"],
+            "impetuous_orders": row["impetuous_orders"],
+            "characteristics": characteristics.get(profile_id, []),
+            "abilities": abilities.get(profile_id, []),
+            "weapons": [weapons[weapon_id]
+                        for weapon_id in weapon_links[profile_id]]}
+    return profiles
+
+
+def get_units(unit_ids: list, language: str = None) -> dict:
+    """Returns a dict with every unit found in a list of IDs, along with its
+    localized name, stats, characteristics, abilities and hydrated profiles.
+    Takes nine queries."""
+
+    unit_ids = list(set(unit_ids))
+    languages = served_languages(language)
+    query = with_names(Unit
+                       .select(Unit)
+                       .join(String, on=(Unit.name == String.string_id)),
+                       Unit.name, languages)
+    query = query.order_by(Unit.unit_id).dicts()
+
+    characteristics = linked_items(
+        UnitCharacteristic.unit, unit_ids,
+        UnitCharacteristic.characteristic, Characteristic.name, languages)
+    abilities = linked_items(UnitAbility.unit, unit_ids,
+                             UnitAbility.ability, Ability.name, languages)
+    profiles = defaultdict(list)
+    for profile in get_profiles(unit_ids=unit_ids,
+                                language=language).values():
+        profiles[profile["unit_id"]].append(profile)
+
+    units = {}
+    for row in in_batches(query, Unit.unit_id, unit_ids):
+        unit_id = row["unit_id"]
+        units[unit_id] = {
+            "id": unit_id,
+            "name": localized(row, languages),
+            **{stat: row[stat] for stat in UNIT_STATS},
+            "characteristics": characteristics.get(unit_id, []),
+            "abilities": abilities.get(unit_id, []),
+            "profiles": profiles[unit_id]}
+    return units
+
+
+def get_ability(ability_id: int, language: str = None) -> dict:
+    """Returns a hydrated ability, or None if it doesn't exist."""
+
+    return get_abilities([ability_id], language).get(ability_id)
+
+
+def get_weapon(weapon_id: int, language: str = None) -> dict:
+    """Returns a hydrated weapon, or None if it doesn't exist."""
+
+    return get_weapons([weapon_id], language).get(weapon_id)
+
+
+def get_profile(profile_id: int, language: str = None) -> dict:
+    """Returns a hydrated profile, or None if it doesn't exist."""
+
+    return get_profiles([profile_id], language=language).get(profile_id)
+
+
+def get_unit(unit_id: int, language: str = None) -> dict:
+    """Returns a hydrated unit, or None if it doesn't exist."""
+
+    return get_units([unit_id], language).get(unit_id)
@@ -0,0 +1,371 @@
+"""Name search over units, weapons and abilities in every language.
+
+Names live in an FTS5 table, queried by word prefixes, and in a second FTS5
+table using the trigram tokenizer, which finds misspelled names by the
+trigrams they share with the query. Both tables share their rowids, so the
+kind, language and sectorial filters are applied on the first one. Matches
+are ranked inside SQLite, by functions registered on the connection for
+each search, so only the best ones are ever returned to Python."""
+
+from db_classes import db, Unit, Weapon, Ability, Profile, Translation, \
+    UnitSectorial, ProfileWeapon, UnitAbility, ProfileAbility, MAX_VARIABLES
+from peewee import SqliteDatabase, chunked
+from sqlite3 import sqlite_version_info
+from collections import defaultdict
+from itertools import combinations
+from typing import NamedTuple
+from math import ceil
+from re import findall
+
+
+SEARCH_TABLE = "search_index"
+TRIGRAM_TABLE = "search_trigram"
+TRIGRAM_VOCABULARY = "search_trigram_vocabulary"
+
+# The trigram tokenizer is only available since SQLite 3.34
+HAS_TRIGRAMS = sqlite_version_info >= (3, 34, 0)
+
+# Share of the query trigrams a name needs to have to be a fuzzy match
+FUZZY_THRESHOLD = 0.4
+
+# Fuzzy matches are looked up by the rarest trigrams of the query only, and
+# only the names having FUZZY_LOOKUP_MATCHES of them are scored. The names are
+# narrowed down by FTS5 on its own index, before any of them is read.
+FUZZY_TRIGRAMS = 3
+FUZZY_LOOKUP_MATCHES = 2
+
+# Functions ranking the matches of a search, registered on the connection
+STARTS_WITH = "search_starts_with"
+SHARED_TRIGRAMS = "search_shared_trigrams"
+
+
+class SearchResult(NamedTuple):
+    """A name matching a search."""
+
+    kind: str
+    item_id: int
+    language: str
+    name: str
+    fuzzy: bool
+
+
+def only(query, field, item_ids: list = None):
+    """Narrows a query to the rows whose field is one of the item IDs, if
+    any are given."""
+
+    return query if item_ids is None else query.where(field.in_(item_ids))
+
+
+def unit_sectorials(item_ids: list = None):
+    """Returns a query of the (unit ID, sectorial ID) pair of every unit, or
+    of the given units only."""
+
+    return only(UnitSectorial.select(
+        UnitSectorial.unit, UnitSectorial.sectorial),
+        UnitSectorial.unit, item_ids).tuples()
+
+
+def weapon_sectorials(item_ids: list = None):
+    """Returns a query of the (weapon ID, sectorial ID) pair of every weapon,
+    or of the given weapons only, carried by a profile of a unit of the
+    sectorial."""
+
+    return only(ProfileWeapon
+                .select(ProfileWeapon.weapon, UnitSectorial.sectorial)
+                .join(Profile,
+                      on=(ProfileWeapon.profile == Profile.profile_id))
+                .join(UnitSectorial,
+                      on=(Profile.unit_id == UnitSectorial.unit)),
+                ProfileWeapon.weapon, item_ids).tuples()
+
+
+def ability_sectorials(item_ids: list = None):
+    """Returns a query of the (ability ID, sectorial ID) pair of every
+    ability, or of the given abilities only, of a unit of the sectorial, or
+    of one of its profiles."""
+
+    return (only(UnitAbility
+                 .select(UnitAbility.ability, UnitSectorial.sectorial)
+                 .join(UnitSectorial,
+                       on=(UnitAbility.unit == UnitSectorial.unit)),
+                 UnitAbility.ability, item_ids)
+            + only(ProfileAbility
+                   .select(ProfileAbility.ability, UnitSectorial.sectorial)
+                   .join(Profile,
+                         on=(ProfileAbility.profile == Profile.profile_id))
+                   .join(UnitSectorial,
+                         on=(Profile.unit_id == UnitSectorial.unit)),
+                   ProfileAbility.ability, item_ids)).tuples()
+
+
+# Every searchable kind, its model and the source of its sectorials
+SEARCH_KINDS = {"unit": (Unit, unit_sectorials),
+                "weapon": (Weapon, weapon_sectorials),
+                "ability": (Ability, ability_sectorials)}
+
+
+def create_search_index(database: SqliteDatabase = db) -> None:
+    """Creates the search tables if they don't exist yet."""
+
+    database.execute_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, sectorials, kind UNINDEXED, item_id UNINDEXED, "
+        "language UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', "
+        "prefix = '1 2 3')")
+    if HAS_TRIGRAMS:
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_TABLE} USING fts5("
+            "name, tokenize = 'trigram')")
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_VOCABULARY} USING "
+            f"fts5vocab({TRIGRAM_TABLE}, 'row')")
+
+
+def indexed_rows(kind: str, item_ids: list = None) -> dict:
+    """Returns the rows the search index should hold for a kind, or for the
+    given items of the kind only, as a dict mapping (kind, item ID, language)
+    to (name, sectorials)."""
+
+    model, sectorial_pairs = SEARCH_KINDS[kind]
+    sectorials = defaultdict(set)
+    for item_id, sectorial in sectorial_pairs(item_ids):
+        sectorials[item_id].add(sectorial)
+
+    primary_key = model._meta.primary_key
+    return {(kind, item_id, language): (name, " ".join(
+        str(sectorial) for sectorial in sorted(sectorials[item_id])))
+        for item_id, language, name in only(
+            model.select(primary_key, Translation.language, Translation.text)
+            .join(Translation, on=(model.name == Translation.string)),
+            primary_key, item_ids).tuples()}
+
+
+def indexed_batches(kinds: tuple, items: dict = None):
+    """Yields the kinds to refresh along with a batch of their item IDs, or
+    None for every item. The ability sectorials bind the IDs twice, so
+    batches take half the bound variables of a statement."""
+
+    for kind in kinds if items is None else items:
+        if items is None:
+            yield kind, None
+            continue
+        item_ids = sorted(set(items[kind]))
+        for start in range(0, len(item_ids), MAX_VARIABLES // 2):
+            yield kind, item_ids[start:start + MAX_VARIABLES // 2]
+
+
+def refresh_search_index(database: SqliteDatabase = db,
+                         kinds: tuple = tuple(SEARCH_KINDS),
+                         items: dict = None) -> int:
+    """Brings the search index of some kinds in line with the database,
+    rewriting only the names that were added, changed or removed. If items
+    maps kinds to item IDs, only the rows of those items are compared, which
+    is how a sync refreshes the index. Returns the number of rewritten
+    rows."""
+
+    create_search_index(database)
+    wanted, current = {}, {}
+    for kind, item_ids in indexed_batches(kinds, items):
+        wanted.update(indexed_rows(kind, item_ids))
+        condition, parameters = "kind = ?", [kind]
+        if item_ids is not None:
+            condition += f" AND item_id IN ({', '.join('?' * len(item_ids))})"
+            parameters.extend(item_ids)
+        for rowid, _, item_id, language, name, sectorials in \
+                database.execute_sql(
+                    f"SELECT rowid, kind, item_id, language, name, "
+                    f"sectorials FROM {SEARCH_TABLE} WHERE {condition}",
+                    parameters):
+            current[(kind, item_id, language)] = (rowid, (name, sectorials))
+
+    stale = [rowid for key, (rowid, row) in current.items()
+             if wanted.get(key) != row]
+    fresh = [(*row, *key) for key, row in wanted.items()
+             if key not in current or current[key][1] != row]
+
+    for table in (SEARCH_TABLE, TRIGRAM_TABLE) if HAS_TRIGRAMS else (SEARCH_TABLE,):
+        for batch in chunked(stale, 999):
+            database.execute_sql(
+                f"DELETE FROM {table} WHERE rowid IN "
+                f"({', '.join('?' * len(batch))})", batch)
+
+    for name, sectorials, kind, item_id, language in fresh:
+        rowid = database.execute_sql(
+            f"INSERT INTO {SEARCH_TABLE} (name, sectorials, kind, item_id, "
+            "language) VALUES (?, ?, ?, ?, ?)",
+            (name, sectorials, kind, item_id, language)).lastrowid
+        if HAS_TRIGRAMS:
+            database.execute_sql(f"INSERT INTO {TRIGRAM_TABLE} (rowid, name) "
+                                 "VALUES (?, ?)", (rowid, name))
+
+    return len(stale) + len(fresh)
+
+
+def rebuild_search_index(database: SqliteDatabase = db,
+                         kinds: tuple = tuple(SEARCH_KINDS)) -> int:
+    """Fills the search index of some kinds from scratch within SQLite,
+    without loading every name like refresh_search_index does, so it's meant
+    for freshly built databases. The sectorials of every item are gathered
+    in a temporary table first. Returns the number of indexed names."""
+
+    create_search_index(database)
+    database.execute_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS search_sectorials (item_id INTEGER, "
+        "sectorial INTEGER, PRIMARY KEY (item_id, sectorial)) WITHOUT ROWID")
+    translations = Translation._meta.table_name
+    indexed = 0
+
+    for kind in kinds:
+        model, sectorial_pairs = SEARCH_KINDS[kind]
+        table, key = model._meta.table_name, model._meta.primary_key.column_name
+        database.execute_sql("DELETE FROM temp.search_sectorials")
+        pairs, params = sectorial_pairs().sql()
+        database.execute_sql(
+            f"INSERT OR IGNORE INTO temp.search_sectorials {pairs}", params)
+        sectorials = (f'SELECT sectorial FROM temp.search_sectorials WHERE '
+                      f'item_id = item."{key}" ORDER BY sectorial')
+        indexed += database.execute_sql(
+            f'INSERT INTO {SEARCH_TABLE} (name, sectorials, kind, item_id, '
+            f'language) SELECT names.text, COALESCE((SELECT group_concat('
+            f"sectorial, ' ') FROM ({sectorials})), ''), ?, item.\"{key}\", "
+            f'names.language FROM "{table}" AS item JOIN "{translations}" AS '
+            f'names ON names."{Translation.string.column_name}" = '
+            f'item."{model.name.column_name}"', (kind,)).rowcount
+        if HAS_TRIGRAMS:
+            database.execute_sql(
+                f"INSERT INTO {TRIGRAM_TABLE} (rowid, name) SELECT rowid, name "
+                f"FROM {SEARCH_TABLE} WHERE kind = ?", (kind,))
+
+    database.execute_sql("DROP TABLE temp.search_sectorials")
+    return indexed
+
+
+def quoted(token: str) -> str:
+    """Returns a token as an FTS5 string."""
+
+    return '"' + token.replace('"', '""') + '"'
+
+
+def filters(kinds: tuple, language: str) -> tuple:
+    """Returns the SQL conditions on the search table for the given filters,
+    and their parameters."""
+
+    conditions, parameters = [], []
+    if kinds:
+        conditions.append(f"{SEARCH_TABLE}.kind IN ({', '.join('?' * len(kinds))})")
+        parameters.extend(kinds)
+    if language:
+        conditions.append(f"{SEARCH_TABLE}.language = ?")
+        parameters.append(language.upper())
+    return "".join(f" AND {condition}" for condition in conditions), parameters
+
+
+def prefix_search(text: str, kinds: tuple = (), sectorial: int = None,
+                  language: str = "", limit: int = 10,
+                  database: SqliteDatabase = db) -> list:
+    """Returns the names with a word starting with each word of the text.
+    Names starting with the whole text come first, then shorter names."""
+
+    tokens = findall(r"\w+", text)
+    if not tokens:
+        return []
+
+    # Names starting with the text have the words of the text as their first
+    # ones, which FTS5 finds on its own, so they're read first and the other
+    # names are only read when they don't fill the limit
+    starting = f"name : (^ {quoted(' '.join(tokens))}*)"
+    matching = "name : (" + " AND ".join(
+        f"{quoted(token)}*" for token in tokens) + ")"
+    if sectorial is not None:
+        in_sectorial = f" AND sectorials : {quoted(str(sectorial))}"
+        starting, matching = starting + in_sectorial, matching + in_sectorial
+    conditions, parameters = filters(kinds, language)
+
+    text = text.lower()
+    database.connection().create_function(
+        STARTS_WITH, 1, lambda name: name.lower().startswith(text),
+        deterministic=True)
+    results = []
+    for query, negation in ((starting, ""), (matching, "NOT ")):
+        if len(results) >= limit:
+            break
+        results += [SearchResult(*row, False) for row in database.execute_sql(
+            f"SELECT kind, item_id, language, name FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH ?{conditions} AND "
+            f"{negation}{STARTS_WITH}(name) ORDER BY length(name), name, "
+            "rowid LIMIT ?", (query, *parameters, limit - len(results)))]
+    return results
+
+
+def trigrams(text: str) -> set:
+    """Returns the lowercased trigrams of a text."""
+
+    text = text.lower()
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+def rarest_trigrams(query_trigrams: set, database: SqliteDatabase) -> list:
+    """Returns the FUZZY_TRIGRAMS trigrams of a query found in the fewest
+    names, leaving out the ones no name has."""
+
+    counts = database.execute_sql(
+        f"SELECT term, doc FROM {TRIGRAM_VOCABULARY} WHERE term IN "
+        f"({', '.join('?' * len(query_trigrams))})", tuple(query_trigrams))
+    return [term for term, _ in sorted(counts, key=lambda count: count[1])
+            ][:FUZZY_TRIGRAMS]
+
+
+def fuzzy_search(text: str, kinds: tuple = (), sectorial: int = None,
+                 language: str = "", limit: int = 10,
+                 database: SqliteDatabase = db) -> list:
+    """Returns the names sharing the most trigrams with the text, as long as
+    they have at least FUZZY_THRESHOLD of them. Candidates are the names with
+    two of the rarest trigrams of the text, or one for texts too short to
+    need more, so a typo only drops the few trigrams around it."""
+
+    query_trigrams = trigrams(text)
+    if not HAS_TRIGRAMS or not query_trigrams:
+        return []
+    lookup = rarest_trigrams(query_trigrams, database)
+    if not lookup:
+        return []
+    threshold = FUZZY_THRESHOLD * len(query_trigrams)
+    required = min(FUZZY_LOOKUP_MATCHES, len(lookup), ceil(threshold))
+    candidates = " OR ".join(
+        "(" + " AND ".join(map(quoted, group)) + ")"
+        for group in combinations(lookup, required))
+
+    conditions, parameters = filters(kinds, language)
+    if sectorial is not None:
+        conditions += f" AND {SEARCH_TABLE}.rowid IN (SELECT rowid FROM " \
+            f"{SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ?)"
+        parameters.append(f"sectorials : {quoted(str(sectorial))}")
+
+    # Candidates are scored on the trigram table, which only holds the name,
+    # and the ones above the threshold are joined for their kind and language
+    terms = tuple(query_trigrams)
+    database.connection().create_function(
+        SHARED_TRIGRAMS, 1, lambda name: sum(
+            trigram in name.lower() for trigram in terms),
+        deterministic=True)
+    return [SearchResult(*row, True) for row in database.execute_sql(
+        f"SELECT kind, item_id, language, candidate FROM (SELECT rowid AS "
+        f"candidate_id, name AS candidate, {SHARED_TRIGRAMS}(name) AS shared "
+        f"FROM {TRIGRAM_TABLE} WHERE {TRIGRAM_TABLE} MATCH ?) JOIN "
+        f"{SEARCH_TABLE} ON {SEARCH_TABLE}.rowid = candidate_id WHERE "
+        f"shared >= ?{conditions} ORDER BY shared DESC, length(candidate), "
+        "candidate, candidate_id LIMIT ?",
+        (candidates, threshold, *parameters, limit))]
+
+
+def search(text: str, kinds: tuple = (), sectorial: int = None,
+           language: str = "", limit: int = 10, fuzzy: bool = True,
+           database: SqliteDatabase = db) -> list:
+    """Searches names by word prefixes, falling back to fuzzy matches when
+    nothing starts with the text. Results can be filtered by kind (unit,
+    weapon, ability), sectorial and language."""
+
+    results = prefix_search(text, kinds, sectorial, language, limit, database)
+    if fuzzy and not results:
+        results = fuzzy_search(text, kinds, sectorial, language, limit, database)
+    return results
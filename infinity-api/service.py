@@ -0,0 +1,338 @@
+"""Asynchronous HTTP read service over the catalogue.
+
+Requests are parsed on an asyncio event loop, while lookups run in a pool of
+threads, each one with its own read-only connection to the database. Every
+response carries the catalogue version in its ETag, along with the encoding
+for gzip responses, so clients revalidating an unchanged catalogue get a 304
+for the items that exist, without their body being sent again. Encoded
+responses are cached per catalogue version, compressed with gzip when the
+client accepts it. Lookups can be answered from a catalogue snapshot instead
+of the database, for as long as the catalogue version matches the
+snapshot's.
+
+Routes:
+    /units/<id>, /profiles/<id>, /weapons/<id>, /abilities/<id>
+    /units?ids=1,2,3 (and so on), returning {"items": [...]}
+    /version
+Item routes take a lang parameter (/units/1?lang=ESP) to return names in a
+single language, or in its fallback chain, instead of every language."""
+
+from db_classes import db, use_pragmas, SERVING_PRAGMAS
+from catalogue_cache import CatalogueCache
+from generations import ConnectionRefresher
+from snapshot import Snapshot
+from localization import UnknownLanguageError
+from queries import get_units, get_profiles, get_weapons, get_abilities
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from peewee import SqliteDatabase
+from http import HTTPStatus
+from typing import NamedTuple
+import asyncio
+import json
+import zlib
+
+
+# Every item kind served, and the function loading a list of them
+LOOKUPS = {"units": get_units, "profiles": get_profiles,
+           "weapons": get_weapons, "abilities": get_abilities}
+
+# Most IDs a batch request can ask for
+MAX_BATCH = 100
+
+# Bodies shorter than this aren't worth compressing
+MIN_COMPRESSED_SIZE = 512
+
+COMPRESSION_LEVEL = 6
+
+# Largest request body read before the connection is closed
+MAX_REQUEST_BODY = 64 * 1024
+
+
+class NotFoundError(LookupError):
+    """Raised when a request asks for a route or a language that doesn't
+    exist."""
+
+
+class Response(NamedTuple):
+    """A response ready to be written: its status, body and extra headers."""
+
+    status: HTTPStatus
+    body: bytes = b""
+    headers: tuple = ()
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Checks if an Accept-Encoding header allows gzip responses."""
+
+    for coding in accept_encoding.lower().split(","):
+        name, _, quality = coding.partition(";")
+        if name.strip() in ("gzip", "*"):
+            quality = quality.strip()
+            try:
+                return not quality.startswith("q=") or float(quality[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def gzipped(body: bytes) -> bytes:
+    """Compresses a body in the gzip format."""
+
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def entity_tag(version: int, compress: bool) -> str:
+    """Returns the strong ETag of the responses of a catalogue version. The
+    responses a client accepting gzip gets are tagged apart, since they may
+    be compressed."""
+
+    return f'"{version}-gzip"' if compress else f'"{version}"'
+
+
+def matches(if_none_match: str, etag: str) -> bool:
+    """Checks if an If-None-Match header matches an ETag, with the weak
+    comparison it calls for. Doesn't handle "*", which matches any item that
+    exists."""
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+
+def error(status: HTTPStatus, message: str) -> Response:
+    """Returns a JSON error response."""
+
+    return Response(status, json.dumps({"error": message}).encode())
+
+
+def parse_target(target: str) -> tuple:
+    """Splits a request target into its kind, the IDs asked for, whether a
+    single item was asked for and the language asked for, if any. Raises
+    NotFoundError if there's no such route and ValueError if the IDs or the
+    language aren't valid."""
+
+    url = urlsplit(target)
+    parts = [part for part in url.path.split("/") if part]
+    if not parts or parts[0] not in LOOKUPS or len(parts) > 2:
+        raise NotFoundError(f"No route for {url.path}")
+    parameters = parse_qs(url.query)
+    language = parameters.get("lang", [None])[-1]
+    if language is not None:
+        if not language.isalpha():
+            raise ValueError(f"{language!r} isn't a language code")
+        language = language.upper()
+    if len(parts) == 2:
+        return parts[0], (int(parts[1]),), True, language
+
+    ids = tuple(int(item_id) for value in parameters.get("ids", ())
+                for item_id in value.split(",") if item_id)
+    if not ids or len(ids) > MAX_BATCH:
+        raise ValueError(f"Between 1 and {MAX_BATCH} IDs must be given")
+    return parts[0], ids, False, language
+
+
+class CatalogueService:
+    """Serves the catalogue of a database. Lookups run in a pool of worker
+    threads, and the encoded bodies are kept in a CatalogueCache, so they
+    are dropped as soon as the catalogue version changes. When the database
+    path is swapped to a new generation, each thread reopens its connection
+    before its next lookup, while the lookups already running finish on the
+    old one. A Snapshot, if given, answers the lookups of its catalogue
+    version without touching the database."""
+
+    def __init__(self, database: SqliteDatabase = db, workers: int = 4,
+                 cache_size: int = 4096, snapshot: Snapshot = None):
+        self.database = database
+        self.snapshot = snapshot
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix="catalogue")
+        self.bodies = CatalogueCache(database, max_size=cache_size)
+        self.refresher = ConnectionRefresher(database)
+
+    def encoded_bodies(self, keys: list) -> dict:
+        """Loads and encodes the bodies of a list of (kind, IDs, single,
+        language, gzip) keys, as (body, whether it's compressed) tuples.
+        Single items that don't exist are None. Raises NotFoundError if the
+        language asked for has no names."""
+
+        lookups = LOOKUPS
+        if self.snapshot is not None and \
+                self.snapshot.version == self.bodies.version:
+            lookups = self.snapshot.lookups
+
+        bodies = {}
+        for key in keys:
+            kind, ids, single, language, compress = key
+            try:
+                items = lookups[kind](list(ids), language=language)
+            except UnknownLanguageError as exception:
+                raise NotFoundError(str(exception)) from exception
+            content = items.get(ids[0]) if single else \
+                {"items": [items[item_id] for item_id in dict.fromkeys(ids)
+                           if item_id in items]}
+            if content is None:
+                bodies[key] = None
+                continue
+            body = json.dumps(content, separators=(",", ":")).encode()
+            compressed = compress and len(body) >= MIN_COMPRESSED_SIZE
+            bodies[key] = (gzipped(body) if compressed else body, compressed)
+        return bodies
+
+    def lookup(self, target: str, headers: dict) -> Response:
+        """Answers a request for a target with the given headers. Runs in a
+        worker thread."""
+
+        if self.refresher.refresh():
+            self.bodies.invalidate()
+        version = self.bodies.check_version()
+        compress = accepts_gzip(headers.get("accept-encoding", ""))
+        validators = (("ETag", entity_tag(version, compress)),
+                      ("Cache-Control", "no-cache"),
+                      ("Vary", "Accept-Encoding"))
+
+        try:
+            if target.split("?")[0].rstrip("/") == "/version":
+                return Response(HTTPStatus.OK, json.dumps(
+                    {"version": version}).encode())
+            kind, ids, single, language = parse_target(target)
+        except NotFoundError as exception:
+            return error(HTTPStatus.NOT_FOUND, str(exception))
+        except ValueError as exception:
+            return error(HTTPStatus.BAD_REQUEST, str(exception))
+
+        key = (kind, ids, single, language, compress)
+        try:
+            encoded_body = self.bodies.get_many(
+                "body", [key], self.encoded_bodies)[key]
+        except NotFoundError as exception:
+            return error(HTTPStatus.NOT_FOUND, str(exception))
+        if encoded_body is None:
+            return error(HTTPStatus.NOT_FOUND, f"No {kind} with ID {ids[0]}")
+        # Only items that exist are revalidated, and "*" matches any of them
+        if_none_match = headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or \
+                matches(if_none_match, entity_tag(version, compress)):
+            return Response(HTTPStatus.NOT_MODIFIED, headers=validators)
+        body, compressed = encoded_body
+        if compressed:
+            validators += (("Content-Encoding", "gzip"),)
+        return Response(HTTPStatus.OK, body, validators)
+
+    async def respond(self, method: str, target: str,
+                      headers: dict) -> Response:
+        """Answers a request, handing the lookup to a worker thread."""
+
+        if method not in ("GET", "HEAD"):
+            return error(HTTPStatus.METHOD_NOT_ALLOWED,
+                         f"{method} isn't allowed")
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.lookup, target, headers)
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Serves the requests of a connection until the client closes it or
+        asks to. Connections are kept alive by default in HTTP/1.1."""
+
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ConnectionError):
+                    break
+
+                request_line, *header_lines = \
+                    head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                # Bodies aren't used, but are read so the next request starts
+                # where it should. The connection is closed after bodies that
+                # can't be read, since the next request can't be found.
+                content_length = headers.get("content-length", "0")
+                readable = content_length.isdigit() and \
+                    int(content_length) <= MAX_REQUEST_BODY
+                if readable:
+                    await reader.readexactly(int(content_length))
+
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    method, target, version = "", "", "HTTP/1.0"
+                    response = error(HTTPStatus.BAD_REQUEST,
+                                     "Malformed request line")
+                else:
+                    if not content_length.isdigit():
+                        response = error(HTTPStatus.BAD_REQUEST,
+                                         "Malformed Content-Length")
+                    elif not readable:
+                        response = error(
+                            HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                            f"Bodies can't be over {MAX_REQUEST_BODY} bytes")
+                    else:
+                        response = await self.respond(method, target, headers)
+
+                keep_alive = readable and version == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+                writer.write(encoded(response, keep_alive, method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1",
+                    port: int = 8000) -> asyncio.AbstractServer:
+        """Starts listening, with the serving pragmas applied to every
+        connection the worker threads open."""
+
+        use_pragmas(self.database, SERVING_PRAGMAS)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self) -> None:
+        """Stops the worker threads."""
+
+        self.executor.shutdown()
+
+
+def encoded(response: Response, keep_alive: bool, head: bool = False) -> bytes:
+    """Returns the bytes of a response, leaving the body out for HEAD."""
+
+    lines = [f"HTTP/1.1 {response.status.value} {response.status.phrase}"]
+    if response.status is not HTTPStatus.NOT_MODIFIED:
+        lines += ["Content-Type: application/json",
+                  f"Content-Length: {len(response.body)}"]
+    lines += [f"{name}: {value}" for name, value in response.headers]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    head_bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+    return head_bytes if head else head_bytes + response.body
+
+
+def run(host: str = "127.0.0.1", port: int = 8000, workers: int = 4,
+        database: SqliteDatabase = db, snapshot: Snapshot = None) -> None:
+    """Serves the catalogue until interrupted."""
+
+    async def main() -> None:
+        service = CatalogueService(database, workers, snapshot=snapshot)
+        server = await service.serve(host, port)
+        address = server.sockets[0].getsockname()
+        print(f"Serving {database.database} on http://{address[0]}:{address[1]}",
+              flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
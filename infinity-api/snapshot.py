@@ -0,0 +1,386 @@
+"""Frozen in-memory snapshot of the catalogue, for lookups that don't touch
+the database. Every unit, profile, weapon and ability is compiled into an
+immutable record, and the links between them into adjacency tuples of IDs:
+the profiles of every unit, the weapons of every profile and the properties
+of every weapon. Localized names are stored once, as tuples with the text
+of every language of the snapshot, taken from the name tables so the fallback
+chain of each language is already applied, and shared by every record using
+them.
+
+Snapshots are pickled to a single file, which loads in milliseconds, so
+every worker can hold its own copy. Only load snapshots you exported, since
+unpickling runs whatever the file says. The lookups return the same items
+as the ones in queries, built from the records without running any query."""
+
+from db_classes import db, Unit, Weapon, Ammo, Ability, Characteristic, \
+    Profile, String, Property, WeaponProperty, ProfileWeapon, \
+    ProfileCharacteristic, ProfileAbility, UnitCharacteristic, UnitAbility, \
+    catalogue_version
+from queries import UNIT_STATS, WEAPON_STATS
+from localization import name_table, name_languages, serving_languages
+from peewee import SqliteDatabase, Field
+from collections import defaultdict
+from typing import NamedTuple
+from pathlib import Path
+from os import replace
+import pickle
+
+
+SNAPSHOT_FILE = "catalogue.snapshot"
+
+# Bumped whenever the records change, so older files aren't misread
+SNAPSHOT_FORMAT = 2
+
+
+class SnapshotError(ValueError):
+    """Raised when a file isn't a snapshot of the current format."""
+
+
+class AbilityRecord(NamedTuple):
+    """An ability, with the name of its wiki URL if it has one."""
+
+    ability_id: int
+    name: tuple
+    is_item: bool
+    wiki_url: tuple
+
+
+class WeaponRecord(NamedTuple):
+    """A weapon, with its stats in the same order as WEAPON_STATS and the IDs
+    of its properties."""
+
+    weapon_id: int
+    name: tuple
+    damage: str
+    is_melee: bool
+    short_range: str
+    medium_range: str
+    long_range: str
+    maximum_range: str
+    burst_melee: int
+    burst_range: int
+    ammo: int
+    parent_weapon: int
+    properties: tuple
+
+
+class ProfileRecord(NamedTuple):
+    """A profile, with the IDs of its characteristics, abilities and
+    weapons."""
+
+    profile_id: int
+    unit_id: int
+    name: tuple
+    cap: float
+    point_cost: int
+    regular_orders: int
+    irregular_orders: int
+    impetuous_orders: int
+    characteristics: tuple
+    abilities: tuple
+    weapons: tuple
+
+
+class UnitRecord(NamedTuple):
+    """A unit, with its stats in the same order as UNIT_STATS and the IDs of
+    its characteristics, abilities and profiles."""
+
+    unit_id: int
+    name: tuple
+    svg_icon: str
+    mov_1: int
+    mov_2: int
+    close_combat: int
+    ballistic_skill: int
+    phisique: int
+    willpower: int
+    armor: int
+    bts: int
+    wounds: int
+    silhouette: int
+    availability: int
+    has_structure: bool
+    characteristics: tuple
+    abilities: tuple
+    profiles: tuple
+
+
+class Snapshot(NamedTuple):
+    """Records of every item kind keyed by ID, the names of the items they
+    link to, the languages of the names and the catalogue version they were
+    exported from. The lookups take the language to return names in, or
+    return them in every language, like the ones in queries."""
+
+    version: int
+    languages: tuple
+    units: dict
+    profiles: dict
+    weapons: dict
+    abilities: dict
+    ammo_names: dict
+    characteristic_names: dict
+    ability_names: dict
+    property_names: dict
+
+    @property
+    def lookups(self) -> dict:
+        """Every item kind and the method loading a list of them, like the
+        LOOKUPS of the service."""
+
+        return {"units": self.get_units, "profiles": self.get_profiles,
+                "weapons": self.get_weapons, "abilities": self.get_abilities}
+
+    def served(self, language: str = None) -> tuple:
+        """Returns the languages names are served in, each with the position
+        of the language of the snapshot it's taken from."""
+
+        return tuple((served, self.languages.index(code)) for served, code in
+                     serving_languages(language, self.languages).items())
+
+    def get_abilities(self, ability_ids: list, language: str = None) -> dict:
+        """Returns a dict with every ability found in a list of IDs."""
+
+        served = self.served(language)
+        abilities = {}
+        for ability_id in sorted(set(ability_ids)):
+            record = self.abilities.get(ability_id)
+            if record is not None:
+                abilities[ability_id] = {
+                    "id": ability_id, "name": localized(record.name, served),
+                    "is_item": record.is_item,
+                    "wiki_url": record.wiki_url and localized(record.wiki_url,
+                                                              served)}
+        return abilities
+
+    def weapon(self, record: WeaponRecord, served: tuple) -> dict:
+        """Hydrates a weapon record, with its names in the served
+        languages."""
+
+        return {
+            "id": record.weapon_id, "name": localized(record.name, served),
+            **dict(zip(WEAPON_STATS, record[2:10])),
+            "ammo": record.ammo and {
+                "id": record.ammo,
+                "name": localized(self.ammo_names.get(record.ammo), served)},
+            "parent_weapon": record.parent_weapon,
+            "properties": linked(record.properties, self.property_names,
+                                 served)}
+
+    def get_weapons(self, weapon_ids: list, language: str = None) -> dict:
+        """Returns a dict with every weapon found in a list of IDs."""
+
+        served = self.served(language)
+        return {weapon_id: self.weapon(self.weapons[weapon_id], served)
+                for weapon_id in sorted(set(weapon_ids))
+                if weapon_id in self.weapons}
+
+    def profile(self, record: ProfileRecord, weapons: dict,
+                served: tuple) -> dict:
+        """Hydrates a profile record, with its names in the served languages,
+        taking its weapons from a dict of hydrated ones."""
+
+        return {
+            "id": record.profile_id, "unit_id": record.unit_id,
+            "name": localized(record.name, served), "cap": record.cap,
+            "point_cost": record.point_cost,
+            "regular_orders": record.regular_orders,
+            "irregular_orders": record.irregular_orders,
+            "impetuous_orders": record.impetuous_orders,
+            "characteristics": linked(record.characteristics,
+                                      self.characteristic_names, served),
+            "abilities": linked(record.abilities, self.ability_names, served),
+            "weapons": [weapons[weapon_id] for weapon_id in record.weapons]}
+
+    def get_profiles(self, profile_ids: list = None, unit_ids: list = None,
+                     language: str = None) -> dict:
+        """Returns a dict with every profile found in a list of profile IDs,
+        or with every profile of a list of unit IDs. Weapons are hydrated
+        once and shared by every profile holding them, like in queries."""
+
+        if profile_ids is None and unit_ids is None:
+            raise ValueError("Either profile IDs or unit IDs must be given")
+        if unit_ids is not None:
+            profile_ids = [profile_id for unit_id in set(unit_ids)
+                           if unit_id in self.units
+                           for profile_id in self.units[unit_id].profiles]
+        records = [self.profiles[profile_id]
+                   for profile_id in sorted(set(profile_ids))
+                   if profile_id in self.profiles]
+        served = self.served(language)
+        weapons = self.get_weapons([weapon_id for record in records
+                                    for weapon_id in record.weapons], language)
+        return {record.profile_id: self.profile(record, weapons, served)
+                for record in records}
+
+    def get_units(self, unit_ids: list, language: str = None) -> dict:
+        """Returns a dict with every unit found in a list of IDs, along with
+        its hydrated profiles."""
+
+        served = self.served(language)
+        profiles = self.get_profiles(unit_ids=unit_ids, language=language)
+        units = {}
+        for unit_id in sorted(set(unit_ids)):
+            record = self.units.get(unit_id)
+            if record is not None:
+                units[unit_id] = {
+                    "id": unit_id, "name": localized(record.name, served),
+                    **dict(zip(UNIT_STATS, record[2:15])),
+                    "characteristics": linked(record.characteristics,
+                                              self.characteristic_names,
+                                              served),
+                    "abilities": linked(record.abilities, self.ability_names,
+                                        served),
+                    "profiles": [profiles[profile_id]
+                                 for profile_id in record.profiles]}
+        return units
+
+
+def localized(names: tuple, served: tuple) -> dict:
+    """Returns the names of an item in the served languages, keyed by
+    language. Items without names get None in every language."""
+
+    return {language: names and names[index] for language, index in served}
+
+
+def linked(item_ids: tuple, names: dict, served: tuple) -> list:
+    """Returns the named items of an adjacency tuple, like linked_items."""
+
+    return [{"id": item_id, "name": localized(names[item_id], served)}
+            for item_id in item_ids]
+
+
+def adjacency(owner: Field, item: Field, items: dict = None) -> dict:
+    """Returns a dict with the tuple of item IDs a link table holds for each
+    owner, sorted, leaving out the items missing from a dict if given."""
+
+    linked_ids = defaultdict(list)
+    for owner_id, item_id in (owner.model.select(owner, item)
+                              .order_by(owner, item).tuples()):
+        if items is None or item_id in items:
+            linked_ids[owner_id].append(item_id)
+    return {owner_id: tuple(item_ids)
+            for owner_id, item_ids in linked_ids.items()}
+
+
+def build_snapshot(database: SqliteDatabase = db) -> Snapshot:
+    """Compiles the catalogue of a database into a Snapshot, reading every
+    table once."""
+
+    with database:
+        languages = name_languages(database)
+        texts = []
+        for language in languages:
+            names = name_table(language)
+            texts.append(dict(database.execute(
+                names.select(names.string_id, names.text))))
+        strings = {string_id: tuple(text.get(string_id) for text in texts)
+                   for string_id, in String.select(String.string_id).tuples()}
+        no_name = (None,) * len(languages)
+
+        def names_of(model, key: Field) -> dict:
+            return {item_id: strings[name] for item_id, name in
+                    model.select(key, model.name).tuples() if name in strings}
+
+        ammo_names = names_of(Ammo, Ammo.ammo_id)
+        characteristic_names = names_of(Characteristic,
+                                        Characteristic.characteristic_id)
+        ability_names = names_of(Ability, Ability.ability_id)
+        property_names = names_of(Property, Property.weapon_property_id)
+
+        abilities = {
+            ability_id: AbilityRecord(
+                ability_id, strings[name], is_item,
+                wiki_url and strings.get(wiki_url, no_name))
+            for ability_id, name, is_item, wiki_url in Ability.select(
+                Ability.ability_id, Ability.name, Ability.is_item,
+                Ability.wiki_url).tuples()
+            if name in strings}
+
+        weapon_properties = adjacency(WeaponProperty.weapon,
+                                      WeaponProperty.weapon_property,
+                                      property_names)
+        weapons = {
+            weapon_id: WeaponRecord(weapon_id, strings[name], *stats,
+                                    ammo, parent_weapon,
+                                    weapon_properties.get(weapon_id, ()))
+            for weapon_id, name, *stats, ammo, parent_weapon in Weapon.select(
+                Weapon.weapon_id, Weapon.name,
+                *(getattr(Weapon, stat) for stat in WEAPON_STATS),
+                Weapon.ammo, Weapon.parent_weapon).tuples()
+            if name in strings}
+
+        profile_weapons = adjacency(ProfileWeapon.profile,
+                                    ProfileWeapon.weapon, weapons)
+        profile_characteristics = adjacency(
+            ProfileCharacteristic.profile, ProfileCharacteristic.characteristic,
+            characteristic_names)
+        profile_abilities = adjacency(ProfileAbility.profile,
+                                      ProfileAbility.ability, ability_names)
+        profiles = {}
+        unit_profiles = defaultdict(list)
+        for profile_id, unit_id, name, *columns in Profile.select(
+                Profile.profile_id, Profile.unit_id, Profile.name, Profile.cap,
+                Profile.point_cost, Profile.regular_orders,
+                Profile.irregular_orders, Profile.impetuous_orders
+        ).order_by(Profile.profile_id).tuples():
+            if name in strings:
+                profiles[profile_id] = ProfileRecord(
+                    profile_id, unit_id, strings[name], *columns,
+                    profile_characteristics.get(profile_id, ()),
+                    profile_abilities.get(profile_id, ()),
+                    profile_weapons.get(profile_id, ()))
+                unit_profiles[unit_id].append(profile_id)
+
+        unit_characteristics = adjacency(
+            UnitCharacteristic.unit, UnitCharacteristic.characteristic,
+            characteristic_names)
+        unit_abilities = adjacency(UnitAbility.unit, UnitAbility.ability,
+                                   ability_names)
+        units = {
+            unit_id: UnitRecord(unit_id, strings[name], *stats,
+                                unit_characteristics.get(unit_id, ()),
+                                unit_abilities.get(unit_id, ()),
+                                tuple(unit_profiles[unit_id]))
+            for unit_id, name, *stats in Unit.select(
+                Unit.unit_id, Unit.name,
+                *(getattr(Unit, stat) for stat in UNIT_STATS)).tuples()
+            if name in strings}
+
+        return Snapshot(catalogue_version(database), languages, units,
+                        profiles, weapons, abilities, ammo_names,
+                        characteristic_names, ability_names, property_names)
+
+
+def export_snapshot(path: str = SNAPSHOT_FILE,
+                    database: SqliteDatabase = db) -> Snapshot:
+    """Builds the snapshot of a database and pickles it to a file, written
+    aside and moved in place."""
+
+    print("Exporting catalogue snapshot...", end=" ")
+
+    snapshot = build_snapshot(database)
+    staged = Path(f"{path}.tmp")
+    with open(staged, "wb") as snapshot_file:
+        pickle.dump((SNAPSHOT_FORMAT, snapshot), snapshot_file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    replace(staged, path)
+
+    print("Done.")
+    return snapshot
+
+
+def load_snapshot(path: str = SNAPSHOT_FILE) -> Snapshot:
+    """Loads an exported snapshot. Raises a SnapshotError if it was exported
+    in another format."""
+
+    with open(path, "rb") as snapshot_file:
+        try:
+            snapshot_format, snapshot = pickle.load(snapshot_file)
+        except (pickle.UnpicklingError, AttributeError, EOFError,
+                TypeError, ValueError) as exception:
+            raise SnapshotError(f"{path} isn't a catalogue snapshot") \
+                from exception
+    if snapshot_format != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{path} has snapshot format {snapshot_format}, "
+                            f"but only {SNAPSHOT_FORMAT} can be loaded")
+    return snapshot
@@ -0,0 +1,408 @@
+"""Streaming ingestion of the JSON folder, for corpora too large to be held in
+memory. Files are decoded an item at a time, whatever their corpus format,
+and rows are written in batches of a fixed size as soon as they are
+produced, so memory doesn't grow with the corpus. Whatever needs the whole
+corpus at once (the wiki URLs that exist, the profiles of every unit, the
+closure of the weapon inheritance, the name tables and the search index) is
+derived inside SQLite once every item is loaded, and foreign keys are
+checked there instead of in a KeyMap.
+
+The tables have to be created with their indexes, since their constraints
+are what drop repeated rows: repeated items and links keep their first row,
+like in populate_db, and names keep the last one of every language. Unlike
+populate_db, the properties of repeated weapons are linked as well."""
+
+from db_classes import Unit, Weapon, Ammo, Ability, Characteristic, \
+    Sectorial, Profile, String, WeaponProperty, Property, ProfileWeapon, \
+    ProfileCharacteristic, ProfileAbility, UnitProfile, UnitCharacteristic, \
+    UnitAbility, UnitSectorial, Translation, WeaponAncestry, \
+    WeaponInheritedProperty, IMPORT_PRAGMAS, bump_catalogue_version
+from db_operations import MAX_VARIABLES, bulk_insert, import_mode, unit_row, \
+    profile_row, weapon_row
+from peewee import SqliteDatabase, Model, chunked
+from collections import defaultdict
+from typing import Callable
+from os import listdir, path
+from corpus import BLACKLISTED_SECTORIALS
+from key_map import DanglingReferenceError
+from localization import materialize_names
+from search import rebuild_search_index
+from normalization import parse_unit, unit_names, property_names, \
+    InheritanceCycleError
+from corpus_format import corpus_path, iter_corpus_file
+from instrumentation import Metrics
+
+
+# Rows buffered per table before they are written
+BATCH_SIZE = 1000
+
+# The import pragmas with a page cache that doesn't grow with the database,
+# and temporary tables kept on disk
+STREAMING_PRAGMAS = dict(IMPORT_PRAGMAS, cache_size=-4 * 1024,
+                         temp_store="default")
+
+
+def replace_rows(model: Model, rows: list) -> int:
+    """Inserts a list of row dicts in chunks, replacing the rows they clash
+    with, so the last row of every key is kept. Returns the number of rows
+    written."""
+
+    if not rows:
+        return 0
+
+    database, written = model._meta.database, 0
+    batch_size = max(1, MAX_VARIABLES // len(rows[0]))
+    with database.atomic():
+        for batch in chunked(rows, batch_size):
+            written += database.execute(
+                model.insert_many(batch).on_conflict_replace()).rowcount
+    return written
+
+
+class BatchWriter:
+    """Buffers the rows of every model and writes them with a write function
+    each time a model has a batch of them."""
+
+    def __init__(self, write: Callable, batch_size: int = BATCH_SIZE):
+        self.write = write
+        self.batch_size = batch_size
+        self.pending = defaultdict(list)
+
+    def add(self, model: Model, row: dict) -> None:
+        """Buffers a row, writing the rows of its model if they make a
+        batch."""
+
+        rows = self.pending[model]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.write(model, rows)
+            self.pending[model] = []
+
+    def flush(self) -> None:
+        """Writes the buffered rows of every model."""
+
+        for model, rows in self.pending.items():
+            self.write(model, rows)
+        self.pending.clear()
+
+
+class StreamingBuild:
+    """The corpus folder being streamed, the writers of its rows and the
+    Metrics the bytes read are counted in. Stats are read from the first
+    language, while names are read from every language."""
+
+    def __init__(self, root: str = "JSON", batch_size: int = BATCH_SIZE,
+                 metrics: Metrics = None):
+        self.root = root
+        self.metrics = metrics or Metrics()
+        self.languages = tuple(sorted(
+            language for language in listdir(root)
+            if path.isdir(f"{root}/{language}")))
+        self.rows = BatchWriter(self.metrics.counted(bulk_insert), batch_size)
+        self.translations = BatchWriter(self.metrics.counted(replace_rows),
+                                        batch_size)
+
+    def items(self, name: str, language: str = ""):
+        """Yields the items of a corpus file, decoded by a JSONStream or, if
+        it's packed, a block at a time."""
+
+        folder = f"{self.root}/{language or self.languages[0]}"
+        self.metrics.add("bytes_parsed",
+                         corpus_path(folder, name).stat().st_size)
+        yield from iter_corpus_file(folder, name)
+
+    def name(self, prefix: str, item_id, language: str, text: str) -> str:
+        """Writes the name of an item in a language and returns its string
+        ID. Its name tables are built once every name is written."""
+
+        string_id = f"{prefix}_{item_id}"
+        self.rows.add(String, {"string_id": string_id})
+        if text is not None:
+            self.translations.add(Translation, {
+                "string": string_id, "language": language, "text": text})
+        return string_id
+
+    def unit_sectorials(self) -> tuple:
+        """IDs of the sectorials whose unit files can be ingested."""
+
+        return tuple(sectorial for sectorial in (
+            int(key.split("_")[-1]) for _, sectorial_names in
+            self.items("JSON_SECTORIAL_NOMBRE") for key in sectorial_names)
+            if sectorial not in BLACKLISTED_SECTORIALS)
+
+    def flush(self) -> None:
+        """Writes every buffered row."""
+
+        self.rows.flush()
+        self.translations.flush()
+
+
+def stream_ammo(build: StreamingBuild) -> None:
+    """Streams the ammo types of every language."""
+
+    print("Streaming DB Ammo entries...", end=" ")
+
+    for language in build.languages:
+        for item in build.items("JSON_MUNICION", language):
+            build.rows.add(Ammo, {"ammo_id": int(item["id"]), "name": build.name(
+                "ammo", item["id"], language, item["nombre"])})
+
+    print("Done.")
+
+
+def stream_abilities(build: StreamingBuild) -> None:
+    """Streams the abilities, their names and their wiki URLs. Wiki URLs are
+    cleared afterwards for the abilities that have none."""
+
+    print("Streaming DB Ability entries...", end=" ")
+
+    for language in build.languages:
+        for ability in build.items("JSON_HABILIDADES", language):
+            name = build.name("ability", ability["id"], language,
+                              ability["nombre"])
+            if language == build.languages[0]:
+                ability_id = int(ability["id"])
+                build.rows.add(Ability, {
+                    "ability_id": ability_id, "name": name,
+                    "is_item": bool(int(ability["equipo"])),
+                    "wiki_url": f"ability_wiki_{ability_id}"})
+        for ability_id, link in build.items("JSON_HABS_WIKI_URLS", language):
+            build.name("ability_wiki", int(ability_id), language, link)
+
+    print("Done.")
+
+
+def stream_characteristics(build: StreamingBuild) -> None:
+    """Streams the characteristics of every language."""
+
+    print("Streaming DB Characteristic entries...", end=" ")
+
+    for language in build.languages:
+        for item in build.items("JSON_CARACTERISTICAS", language):
+            build.rows.add(Characteristic, {
+                "characteristic_id": int(item["id"]), "name": build.name(
+                    "characteristic", item["id"], language, item["nombre"])})
+
+    print("Done.")
+
+
+def stream_sectorials(build: StreamingBuild) -> None:
+    """Streams the sectorials and factions of every language."""
+
+    print("Streaming DB Sectorial entries...", end=" ")
+
+    # The names are nested in a single object, which is small enough to be
+    # decoded at once
+    for language in build.languages:
+        for _, sectorial_names in build.items("JSON_SECTORIAL_NOMBRE", language):
+            for key, text in sectorial_names.items():
+                sectorial = int(key.lstrip("idSectorial_"))
+                build.rows.add(Sectorial, {
+                    "sectorial_id": sectorial,
+                    "name": build.name("sectorial", sectorial, language, text),
+                    "is_faction": sectorial % 100 == 1})
+
+    print("Done.")
+
+
+def stream_weapons(build: StreamingBuild) -> None:
+    """Streams the weapons, their properties and their names. The closure of
+    the inheritance is derived afterwards."""
+
+    print("Streaming DB Weapon entries...", end=" ")
+
+    for language in build.languages:
+        for weapon in build.items("JSON_ARMAS", language):
+            weapon_id = int(weapon["id"])
+            name = build.name("weapon", weapon_id, language,
+                              weapon["nombre_completo"])
+            for property_id, property_name in property_names(weapon):
+                build.rows.add(Property, {
+                    "weapon_property_id": property_id, "name": build.name(
+                        "weapon_property", property_id, language,
+                        property_name)})
+
+            if language == build.languages[0]:
+                build.rows.add(Weapon, weapon_row(
+                    weapon_id, weapon, name,
+                    int(weapon["idMunicion"]) or None,
+                    int(weapon["parent"]) or None))
+                for property_id in weapon["propiedades"].split("|"):
+                    if property_id:
+                        build.rows.add(WeaponProperty, {
+                            "weapon": weapon_id,
+                            "weapon_property": int(property_id)})
+
+        for weapon_id, link in build.items("JSON_ARMAS_WIKI_URLS", language):
+            build.name("weapon_wiki", int(weapon_id), language, link)
+
+    print("Done.")
+
+
+def stream_units(build: StreamingBuild) -> None:
+    """Streams the units of every sectorial along with their profiles. The
+    links between both are derived afterwards."""
+
+    print("Streaming DB Unit and Profile entries...", end=" ")
+
+    for sectorial in build.unit_sectorials():
+        for language in build.languages:
+            for unit in build.items(str(sectorial), language):
+                for kind, item_id, _, text in unit_names(unit, language):
+                    build.name(kind, item_id, language, text)
+                if language != build.languages[0]:
+                    continue
+
+                unit_rows, profile_rows = parse_unit(unit)
+                for unit_id, army_id, attributes, characteristic_ids, \
+                        ability_ids in unit_rows:
+                    build.rows.add(Unit, unit_row(
+                        sectorial, unit_id, army_id, attributes,
+                        f"unit_{unit_id}"))
+                    build.rows.add(UnitSectorial, {
+                        "unit": unit_id, "sectorial": sectorial})
+                    for characteristic_id in characteristic_ids:
+                        build.rows.add(UnitCharacteristic, {
+                            "unit": unit_id,
+                            "characteristic": characteristic_id})
+                    for ability_id in ability_ids:
+                        build.rows.add(UnitAbility, {
+                            "unit": unit_id, "ability": ability_id})
+
+                for profile_id, unit_id, cap, points, reg, irreg, impetuous, \
+                        weapon_ids, characteristic_ids, ability_ids \
+                        in profile_rows:
+                    build.rows.add(Profile, profile_row(
+                        profile_id, unit_id, cap, points, reg, irreg,
+                        impetuous, f"profile_{profile_id}"))
+                    for weapon_id in weapon_ids:
+                        build.rows.add(ProfileWeapon, {
+                            "profile": profile_id, "weapon": weapon_id})
+                    for characteristic_id in characteristic_ids:
+                        build.rows.add(ProfileCharacteristic, {
+                            "profile": profile_id,
+                            "characteristic": characteristic_id})
+                    for ability_id in ability_ids:
+                        build.rows.add(ProfileAbility, {
+                            "profile": profile_id, "ability": ability_id})
+
+    print("Done.")
+
+
+def derive_weapon_ancestry(database: SqliteDatabase) -> None:
+    """Writes the closure of the weapon inheritance with a recursive query,
+    and the properties every weapon inherits from it. Chains stop at parents
+    that don't exist, and at most at as many steps as there are weapons, so
+    they end in cycles too, which raise an InheritanceCycleError."""
+
+    weapon = Weapon._meta.table_name
+    key, parent = Weapon.weapon_id.column_name, Weapon.parent_weapon.column_name
+    chains = (
+        f"WITH RECURSIVE chain (weapon, ancestor, depth) AS ("
+        f'SELECT "{key}", "{key}", 0 FROM "{weapon}" UNION ALL '
+        f'SELECT chain.weapon, parent."{key}", chain.depth + 1 FROM chain '
+        f'JOIN "{weapon}" AS item ON item."{key}" = chain.ancestor '
+        f'JOIN "{weapon}" AS parent ON parent."{key}" = item."{parent}" '
+        f"WHERE chain.depth < ? AND (chain.depth = 0 OR "
+        f"chain.ancestor != chain.weapon)) ")
+    steps = (Weapon.select().count(),)
+
+    cycles = [weapon_id for weapon_id, in database.execute_sql(
+        f"{chains} SELECT DISTINCT weapon FROM chain WHERE depth > 0 AND "
+        f"ancestor = weapon ORDER BY weapon", steps)]
+    if cycles:
+        raise InheritanceCycleError(
+            f"{len(cycles)} item(s) in an inheritance cycle: "
+            + ", ".join(map(str, cycles)))
+
+    database.execute_sql(
+        f'INSERT INTO "{WeaponAncestry._meta.table_name}" '
+        f'("{WeaponAncestry.weapon.column_name}", '
+        f'"{WeaponAncestry.ancestor.column_name}", depth) '
+        f"{chains} SELECT weapon, ancestor, depth FROM chain", steps)
+
+    WeaponInheritedProperty.insert_from(
+        WeaponAncestry
+        .select(WeaponAncestry.weapon, WeaponProperty.weapon_property)
+        .join(WeaponProperty,
+              on=(WeaponProperty.weapon == WeaponAncestry.ancestor)),
+        [WeaponInheritedProperty.weapon,
+         WeaponInheritedProperty.weapon_property]) \
+        .on_conflict_ignore().execute()
+
+
+def derive_tables(database: SqliteDatabase) -> None:
+    """Fills everything that depends on the whole corpus: the wiki URLs that
+    exist, the profiles of every unit and the weapon inheritance."""
+
+    print("Deriving DB links...", end=" ")
+
+    Ability.update(wiki_url=None).where(
+        Ability.wiki_url.not_in(String.select(String.string_id))).execute()
+
+    UnitProfile.insert_from(
+        Profile.select(Profile.unit_id, Profile.profile_id)
+        .join(Unit, on=(Profile.unit_id == Unit.unit_id)),
+        [UnitProfile.unit, UnitProfile.profile]).on_conflict_ignore().execute()
+
+    derive_weapon_ancestry(database)
+
+    print("Done.")
+
+
+def check_references(database: SqliteDatabase) -> None:
+    """Raises a DanglingReferenceError listing every row referencing an item
+    that was never written."""
+
+    dangling = [f"{table} row {rowid} references unknown {parent}"
+                for table, rowid, parent, _ in
+                database.execute_sql("PRAGMA foreign_key_check")]
+    dangling += [f"Unit {unit_id} references unknown String {name!r}"
+                 for unit_id, name in Unit
+                 .select(Unit.unit_id, Unit.name)
+                 .where(Unit.name.not_in(String.select(String.string_id)))
+                 .tuples()]
+    if dangling:
+        raise DanglingReferenceError(
+            f"{len(dangling)} dangling reference(s):\n" + "\n".join(dangling))
+
+
+# Stream stages in the order they run. References are only checked at the
+# end, so the order doesn't matter for them.
+STREAM_STAGES = (("ammo", stream_ammo), ("abilities", stream_abilities),
+                 ("characteristics", stream_characteristics),
+                 ("sectorials", stream_sectorials),
+                 ("weapons", stream_weapons), ("units", stream_units))
+
+
+def stream_db(db: SqliteDatabase, root: str = "JSON",
+              batch_size: int = BATCH_SIZE, metrics: Metrics = None) -> Metrics:
+    """Populates the database tables, created along with their indexes, by
+    streaming the JSON folder. Every stage writes its rows as it reads them
+    and flushes the rest once it's done, so only a batch of rows per table
+    is held at a time. The name tables of every language and the search
+    index are then built within SQLite and the catalogue version is bumped.
+    Every step is measured as a stage of the build in metrics (set up from
+    the environment by default), which is returned."""
+
+    metrics = metrics or Metrics.from_environment()
+    build = StreamingBuild(root, batch_size, metrics)
+
+    with metrics.stage("build"):
+        with import_mode(db, STREAMING_PRAGMAS) as open_db:
+            with open_db.atomic():
+                for name, stage in STREAM_STAGES:
+                    with metrics.stage(name):
+                        stage(build)
+                        build.flush()
+                with metrics.stage("derived"):
+                    derive_tables(open_db)
+                with metrics.stage("check"):
+                    check_references(open_db)
+                with metrics.stage("names"):
+                    materialize_names(open_db, build.languages)
+                with metrics.stage("search_index"):
+                    rebuild_search_index(open_db)
+                bump_catalogue_version(open_db)
+
+    return metrics
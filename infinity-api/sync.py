@@ -0,0 +1,400 @@
+from db_classes import String, Translation, Ammo, Ability, Characteristic, \
+    Sectorial, Property, Weapon, Profile, Unit, UnitProfile, UnitSectorial, \
+    UnitCharacteristic, UnitAbility, ProfileWeapon, ProfileCharacteristic, \
+    ProfileAbility, bump_catalogue_version
+from db_operations import populate_ammo, populate_abilities, \
+    populate_characteristics, populate_sectorials, populate_weapons, \
+    populate_units, bulk_insert, MAX_VARIABLES
+from peewee import SqliteDatabase, Model, Tuple, chunked
+from collections import defaultdict
+from typing import NamedTuple
+from functools import reduce
+from corpus import Corpus
+from key_map import KeyMap, DanglingReferenceError
+from localization import materialize_names
+from search import refresh_search_index, SEARCH_KINDS
+import operator
+
+
+class TableChanges(NamedTuple):
+    """Number of rows a sync inserted, updated and deleted in a table."""
+
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
+def is_sectorial_file(name: str) -> bool:
+    """Checks if a corpus file name is one of the sectorial unit files."""
+
+    return name.isdigit() or name == "JSON_SECTORIAL_NOMBRE"
+
+
+# Every stage, the corpus files it is built from, the prefixes of the strings
+# it owns and the models whose keys it registers. Stages run in the same order
+# populate_db uses.
+SYNC_STAGES = (
+    (populate_ammo, ("JSON_MUNICION",).__contains__, ("ammo",), (Ammo,)),
+    (populate_abilities, ("JSON_HABILIDADES", "JSON_HABS_WIKI_URLS").__contains__,
+     ("ability", "ability_wiki"), (Ability,)),
+    (populate_characteristics, ("JSON_CARACTERISTICAS",).__contains__,
+     ("characteristic",), (Characteristic,)),
+    (populate_sectorials, ("JSON_SECTORIAL_NOMBRE",).__contains__,
+     ("sectorial",), (Sectorial,)),
+    (populate_weapons, ("JSON_ARMAS", "JSON_ARMAS_WIKI_URLS").__contains__,
+     ("weapon_property", "weapon", "weapon_wiki"), (Property, Weapon)),
+    (populate_units, is_sectorial_file, ("profile", "unit"), (Profile, Unit)))
+
+# Field every table written by populate_units is scoped by, when only some
+# sectorial files changed, and whether it holds a unit or a profile ID
+UNIT_SCOPES = {
+    Unit: (Unit.unit_id, "unit"), UnitProfile: (UnitProfile.unit, "unit"),
+    UnitSectorial: (UnitSectorial.unit, "unit"),
+    UnitCharacteristic: (UnitCharacteristic.unit, "unit"),
+    UnitAbility: (UnitAbility.unit, "unit"),
+    Profile: (Profile.profile_id, "profile"),
+    ProfileWeapon: (ProfileWeapon.profile, "profile"),
+    ProfileCharacteristic: (ProfileCharacteristic.profile, "profile"),
+    ProfileAbility: (ProfileAbility.profile, "profile"),
+    String: (String.string_id, "string"),
+    Translation: (Translation.string, "string")}
+
+
+def sync_db(db: SqliteDatabase, corpus: Corpus = None,
+            changed: dict = None) -> dict:
+    """Brings the database in line with the local JSON corpus, applying only
+    the inserts, updates and deletes needed inside a single transaction.
+    changed is the dict of changed files per language from a FetchReport.
+    Stages whose files didn't change don't run, and their keys are read from
+    the database instead. If only some sectorial files changed, only those
+    are read, along with the other sectorials of their units, and only the
+    rows of those units and their profiles are compared. Returns a dict with
+    the TableChanges of every modified table. Rows of the stages that didn't
+    run still referencing deleted rows raise a DanglingReferenceError,
+    rolling the whole sync back. If any translation changed the name tables
+    are rebuilt, and if anything changed the search index of the changed
+    items is refreshed and the catalogue version is bumped so cached lookups
+    are invalidated."""
+
+    changed_files = None if changed is None else {
+        name for names in changed.values() for name in names}
+    if changed_files is not None and not changed_files:
+        return {}
+
+    corpus = corpus or Corpus()
+    keys = KeyMap()
+    changeset, edited = {}, defaultdict(list)
+
+    with db as open_db, open_db.atomic():
+        for stage, is_source, string_prefixes, models in SYNC_STAGES:
+            if changed_files is not None and \
+                    not any(is_source(name) for name in changed_files):
+                for model in models:
+                    keys.register_stored(model)
+                continue
+
+            scopes, stage_corpus = {}, corpus
+            if stage is populate_units and changed_files is not None and \
+                    "JSON_SECTORIAL_NOMBRE" not in changed_files:
+                stage_corpus, scoped_keys = unit_scope(corpus, {
+                    int(name) for name in changed_files if name.isdigit()})
+                scopes = {model: (field, scoped_keys[kind])
+                          for model, (field, kind) in UNIT_SCOPES.items()}
+
+            staged = defaultdict(list)
+
+            def collect(model: Model, rows: list) -> None:
+                staged[model].extend(rows)
+
+            quiet_stage(stage, stage_corpus, keys, collect)
+
+            for model, rows in staged.items():
+                field, scope = scopes.get(model, (None, None))
+                if scope is not None:
+                    rows = [row for row in rows if row[field.name] in scope]
+                if model is String:
+                    changes = sync_strings(rows, string_prefixes, scope,
+                                           edited[model])
+                elif model is Translation:
+                    changes = sync_translations(rows, string_prefixes, scope,
+                                                edited[model])
+                elif model._meta.primary_key.name == "id":
+                    changes = sync_links(model, rows, field, scope,
+                                         edited[model])
+                else:
+                    changes = sync_table(model, rows, None if scope is None
+                                         else stored_rows(model.select(),
+                                                          field, scope),
+                                         edited[model])
+                if any(changes):
+                    previous = changeset.get(model.__name__, TableChanges())
+                    changeset[model.__name__] = TableChanges(
+                        *(old + new for old, new in zip(previous, changes)))
+
+        check_deleted_references(edited)
+        if "Translation" in changeset:
+            materialize_names(open_db)
+        if changeset:
+            refresh_search_index(open_db, items=search_items(edited))
+            bump_catalogue_version(open_db)
+
+    return changeset
+
+
+def check_deleted_references(edited: dict) -> None:
+    """Raises a DanglingReferenceError listing every row still referencing a
+    row the sync deleted, which is left behind when the stage writing it
+    didn't run, such as a profile carrying a weapon removed from JSON_ARMAS
+    alone. A full build of the same corpus would fail just the same."""
+
+    dangling = []
+    for model, rows in edited.items():
+        if not rows or not model._meta.backrefs:
+            continue
+        primary_key = model._meta.primary_key
+        keys = {primary_key.db_value(row[primary_key.name]) for row in rows}
+        deleted = keys - {key for key, in stored_rows(
+            model.select(primary_key), primary_key, keys)}
+        for field in model._meta.backrefs:
+            dangling += [f"{field.model.__name__} references unknown "
+                         f"{model.__name__} {key!r}" for key, in stored_rows(
+                             field.model.select(field).distinct(), field,
+                             deleted)]
+    if dangling:
+        raise DanglingReferenceError(
+            f"{len(dangling)} dangling reference(s):\n" + "\n".join(dangling))
+
+
+def search_items(edited: dict) -> dict:
+    """Returns the IDs of the items of every searchable kind whose name or
+    sectorials the edited rows of a sync may have changed, for the search
+    index to refresh only those."""
+
+    strings = {row["string"] for row in edited[Translation]}
+    units = {row["unit"] for row in edited[UnitSectorial]}
+    profiles = {row["profile_id"] for row in edited[Profile]}
+    profiles.update(profile for profile, in stored_rows(
+        Profile.select(Profile.profile_id), Profile.unit_id, units))
+
+    items = {}
+    for kind, (model, _) in SEARCH_KINDS.items():
+        primary_key = model._meta.primary_key
+        items[kind] = {row[primary_key.name] for row in edited[model]}
+        items[kind].update(item for item, in stored_rows(
+            model.select(primary_key), model.name, strings))
+
+    items["unit"].update(units)
+    items["weapon"].update(row["weapon"] for row in edited[ProfileWeapon])
+    items["weapon"].update(weapon for weapon, in stored_rows(
+        ProfileWeapon.select(ProfileWeapon.weapon), ProfileWeapon.profile,
+        profiles))
+    items["ability"].update(row["ability"] for model in
+                            (UnitAbility, ProfileAbility)
+                            for row in edited[model])
+    items["ability"].update(ability for ability, in stored_rows(
+        UnitAbility.select(UnitAbility.ability), UnitAbility.unit, units))
+    items["ability"].update(ability for ability, in stored_rows(
+        ProfileAbility.select(ProfileAbility.ability), ProfileAbility.profile,
+        profiles))
+    return items
+
+
+def unit_scope(corpus: Corpus, sectorials: set) -> tuple:
+    """Returns the part of the corpus needed to rebuild the units of the
+    given sectorials, which are the ones in their files now or linked to them
+    in the database, and a dict with the IDs of those units, their profiles
+    and their strings. The other sectorials of those units are read too, as
+    the first one a unit shows up in has its stats."""
+
+    changed = corpus.subset(sectorials)
+    units = {int(unit_profile["id"])
+             for _, _, unit_profile in changed.unit_entries()}
+    units.update(unit for unit, in UnitSectorial._meta.database.execute(
+        UnitSectorial.select(UnitSectorial.unit).where(
+            UnitSectorial.sectorial.in_(changed.unit_sectorials))))
+
+    scoped = corpus.subset(set(changed.unit_sectorials) | {
+        sectorial for sectorial, in stored_rows(
+            UnitSectorial.select(UnitSectorial.sectorial).distinct(),
+            UnitSectorial.unit, units)})
+    profiles = {profile_row[0] for _, _, profile_rows, _ in scoped.sectorial_rows
+                for profile_row in profile_rows if profile_row[1] in units}
+    profiles.update(profile for profile, in stored_rows(
+        Profile.select(Profile.profile_id), Profile.unit_id, units))
+
+    return scoped, {
+        "unit": units, "profile": profiles,
+        "string": {f"unit_{unit}" for unit in units} |
+        {f"profile_{profile}" for profile in profiles}}
+
+
+def stored_rows(query, field=None, keys: set = None):
+    """Yields the rows of a query straight from the cursor. If keys are given,
+    only the rows whose field is one of them are read, in batches that fit
+    in the bound variables of a statement."""
+
+    database = query.model._meta.database
+    if keys is None:
+        yield from database.execute(query)
+        return
+    for batch in chunked(sorted(keys), MAX_VARIABLES):
+        yield from database.execute(query.where(field.in_(batch)))
+
+
+def quiet_stage(stage, corpus: Corpus, keys: KeyMap, write) -> None:
+    """Runs a populate stage without its progress output."""
+
+    from contextlib import redirect_stdout
+    from io import StringIO
+
+    with redirect_stdout(StringIO()):
+        stage(corpus, keys, write)
+
+
+def normalized(model: Model, row: dict) -> tuple:
+    """Returns the values of a row in field order, as the database stores them."""
+
+    return tuple(field.db_value(row.get(field.name))
+                 for field in model._meta.sorted_fields)
+
+
+def sync_table(model: Model, rows: list, current_rows=None,
+               edited: list = None) -> TableChanges:
+    """Diffs the staged rows of a table with a primary key against the given
+    rows of the database (the whole table by default) and applies the
+    differences. The rows it changes are added to edited, if given, both as
+    they were and as they are now."""
+
+    primary_key = model._meta.primary_key
+    fields = model._meta.sorted_fields
+    key_index = fields.index(primary_key)
+    wanted = {}
+    for row in rows:
+        wanted.setdefault(primary_key.db_value(row[primary_key.name]), row)
+
+    # Rows are read straight from the cursor, skipping peewee's conversions,
+    # since the staged rows are compared in their database form anyway.
+    if current_rows is None:
+        current_rows = model._meta.database.execute(model.select())
+    current = {values[key_index]: values for values in current_rows}
+
+    inserts = [row for key, row in wanted.items() if key not in current]
+    updated = [key for key, row in wanted.items() if key in current and
+               normalized(model, row) != current[key]]
+    updates = [wanted[key] for key in updated]
+    deletes = [key for key in current if key not in wanted]
+
+    bulk_insert(model, inserts)
+    for row in updates:
+        model.update({field: row[field.name] for field in fields
+                      if field is not primary_key}).where(
+            primary_key == row[primary_key.name]).execute()
+    for batch in chunked(deletes, MAX_VARIABLES):
+        model.delete().where(primary_key.in_(batch)).execute()
+
+    if edited is not None:
+        names = [field.name for field in fields]
+        edited.extend(inserts + updates)
+        edited.extend(dict(zip(names, current[key]))
+                      for key in updated + deletes)
+    return TableChanges(len(inserts), len(updates), len(deletes))
+
+
+def owned_strings(field, prefixes: tuple):
+    """Returns the condition matching the string IDs that start with one of
+    the prefixes of a stage. Some prefixes are the start of others (weapon
+    and weapon_property), so the matches still have to go through is_owned."""
+
+    return reduce(operator.or_, [field.startswith(f"{prefix}_")
+                                 for prefix in prefixes])
+
+
+def is_owned(string_id: str, prefixes: tuple) -> bool:
+    """Checks if a string ID is one of the prefixes followed by an item ID."""
+
+    return string_id.rsplit("_", 1)[0] in prefixes
+
+
+def sync_strings(rows: list, prefixes: tuple, keys: set = None,
+                 edited: list = None) -> TableChanges:
+    """Diffs only the strings owned by a stage, which are the ones whose ID is
+    one of its prefixes followed by an item ID, or only the given string IDs."""
+
+    if keys is not None:
+        return sync_table(String, rows, stored_rows(
+            String.select(), String.string_id, keys), edited)
+    current_rows = (values for values in String._meta.database.execute(
+        String.select().where(owned_strings(String.string_id, prefixes)))
+        if is_owned(values[0], prefixes))
+    return sync_table(String, rows, current_rows, edited)
+
+
+def sync_translations(rows: list, prefixes: tuple, keys: set = None,
+                      edited: list = None) -> TableChanges:
+    """Diffs the translations of the strings owned by a stage, or of the given
+    string IDs only, keyed by their string ID and language. The keys of the
+    translations it changes are added to edited, if given."""
+
+    wanted = {(row["string"], row["language"]): row["text"] for row in rows}
+    query = Translation.select(
+        Translation.string, Translation.language, Translation.text)
+    if keys is None:
+        query = query.where(owned_strings(Translation.string, prefixes))
+    current = {(string_id, language): text
+               for string_id, language, text in stored_rows(
+                   query, Translation.string, keys)
+               if keys is not None or is_owned(string_id, prefixes)}
+
+    inserts = [row for row in rows
+               if (row["string"], row["language"]) not in current]
+    updates = [key for key, text in wanted.items()
+               if key in current and current[key] != text]
+    deletes = [key for key in current if key not in wanted]
+
+    bulk_insert(Translation, inserts)
+    for string_id, language in updates:
+        Translation.update(text=wanted[(string_id, language)]).where(
+            (Translation.string == string_id) &
+            (Translation.language == language)).execute()
+    for batch in chunked(deletes, MAX_VARIABLES // 2):
+        Translation.delete().where(
+            Tuple(Translation.string, Translation.language).in_(batch)).execute()
+
+    if edited is not None:
+        edited.extend(inserts)
+        edited.extend({"string": string_id, "language": language}
+                      for string_id, language in updates + deletes)
+    return TableChanges(len(inserts), len(updates), len(deletes))
+
+
+def sync_links(model: Model, rows: list, field=None, keys: set = None,
+               edited: list = None) -> TableChanges:
+    """Diffs the rows of a link table, without their ID, against the ones in
+    the database, or only the ones whose field is one of the given keys.
+    Duplicated rows in the database are removed along the way. The rows it
+    inserts and deletes are added to edited, if given."""
+
+    fields = [field for field in model._meta.sorted_fields
+              if field.name != "id"]
+    wanted = {tuple(row[field.name] for field in fields) for row in rows}
+
+    current, deletes = {}, {}
+    for row_id, *values in stored_rows(
+            model.select(model.id, *fields), field, keys):
+        values = tuple(values)
+        if values in wanted and values not in current:
+            current[values] = row_id
+        else:
+            deletes[row_id] = values
+
+    inserts = [row for row in rows
+               if tuple(row[field.name] for field in fields) not in current]
+    bulk_insert(model, inserts)
+    for batch in chunked(list(deletes), MAX_VARIABLES):
+        model.delete().where(model.id.in_(batch)).execute()
+
+    if edited is not None:
+        names = [field.name for field in fields]
+        edited.extend(inserts)
+        edited.extend(dict(zip(names, values)) for values in deletes.values())
+    return TableChanges(len(inserts), 0, len(deletes))
@@ -0,0 +1,82 @@
+"""Range modifiers of weapons at any distance. The lookups computed for every
+weapon at build time are loaded once into a single matrix, so the modifiers
+of whole arrays of (weapon, distance) pairs are read with one indexing
+operation instead of parsing range bands pair by pair."""
+
+from db_classes import db, Weapon, catalogue_version
+from peewee import SqliteDatabase
+import numpy as np
+
+
+# Stored in the matrix past the longest range of a weapon, since no modifier
+# goes that low
+OUT_OF_RANGE = np.iinfo(np.int8).min
+
+
+class RangeTable:
+    """Matrix with the modifier of every ranged weapon at every distance, one
+    row per weapon sorted by weapon ID. An extra row, for unknown weapons, and
+    an extra column, for distances past every range, are always out of range.
+    A table belongs to the catalogue version it was loaded from."""
+
+    def __init__(self, database: SqliteDatabase = db):
+        self.database = database
+        self.load()
+
+    def load(self) -> None:
+        """Loads the lookup of every weapon with a range in a single query."""
+
+        self.version = catalogue_version(self.database)
+        rows = list(Weapon
+                    .select(Weapon.weapon_id, Weapon.range_modifiers)
+                    .where(Weapon.range_modifiers.is_null(False))
+                    .order_by(Weapon.weapon_id)
+                    .tuples())
+
+        lookups = [np.frombuffer(lookup, np.int8) for _, lookup in rows]
+        self.weapon_ids = np.array([weapon_id for weapon_id, _ in rows],
+                                   dtype=np.int64)
+        self.max_distance = max((len(lookup) for lookup in lookups),
+                                default=0)
+        self.modifiers_matrix = np.full(
+            (len(lookups) + 1, self.max_distance + 1), OUT_OF_RANGE, np.int8)
+        for row, lookup in enumerate(lookups):
+            self.modifiers_matrix[row, :len(lookup)] = lookup
+
+    def is_stale(self) -> bool:
+        """Checks if the catalogue changed since the table was loaded."""
+
+        return catalogue_version(self.database) != self.version
+
+    def modifiers(self, weapon_ids, distances) -> np.ndarray:
+        """Returns the modifier of every weapon at the distance in the same
+        position, as an array of floats that is NaN where the distance is out
+        of range or the weapon has no range. Distances between two whole ones
+        take the band of the next one."""
+
+        weapon_ids, distances = np.broadcast_arrays(
+            np.asarray(weapon_ids, dtype=np.int64),
+            np.asarray(distances, dtype=np.float64))
+
+        rows = np.searchsorted(self.weapon_ids, weapon_ids)
+        rows = np.minimum(rows, len(self.weapon_ids))
+        known = rows < len(self.weapon_ids)
+        known[known] = self.weapon_ids[rows[known]] == weapon_ids[known]
+        rows[~known] = len(self.weapon_ids)
+
+        # NaN and negative distances land in the out of range column too
+        columns = np.ceil(distances)
+        columns[~(columns >= 0) | (columns > self.max_distance)] = \
+            self.max_distance
+        modifiers = self.modifiers_matrix[rows, columns.astype(np.int64)]
+
+        result = modifiers.astype(np.float64)
+        result[modifiers == OUT_OF_RANGE] = np.nan
+        return result
+
+    def modifier_at(self, weapon_id: int, distance: float) -> int:
+        """Returns the modifier of a weapon at a distance, or None if it's
+        out of range."""
+
+        modifier = self.modifiers([weapon_id], [distance])[0]
+        return None if np.isnan(modifier) else int(modifier)